@@ -0,0 +1,188 @@
+# Admission control: per-client rate limits and global concurrency limits with load shedding
+import math
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Optional
+
+from fastapi import HTTPException
+
+from .config import Config
+from .resilience import LatencyTracker
+
+
+class AdmissionRejected(HTTPException):
+    """Request shed by admission control (429 rate limited, 503 overloaded), with Retry-After."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: float):
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(status_code=status_code, detail=detail,
+                         headers={"Retry-After": str(self.retry_after)})
+
+
+class TokenBucket:
+    """``rate`` tokens per second refilled up to ``burst``."""
+
+    def __init__(self, rate: float, burst: float, now: float = None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic() if now is None else now
+
+    def take(self, now: float) -> float:
+        """Take one token; returns 0 on success, otherwise seconds until one is available."""
+        self.tokens = min(self.burst, self.tokens + max(0.0, now - self.updated) * self.rate)
+        self.updated = max(self.updated, now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Token bucket per client key; the least recently seen clients are forgotten past ``max_clients``."""
+
+    def __init__(self, per_minute: float = None, burst: int = None, max_clients: int = 10000):
+        self.per_minute = per_minute if per_minute is not None else Config.RATE_LIMIT_PER_MINUTE
+        self.burst = max(1, burst or Config.RATE_LIMIT_BURST)
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.limited = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.per_minute > 0
+
+    def check(self, client: str) -> float:
+        """0 if ``client`` may proceed, otherwise the Retry-After in seconds."""
+        if not self.enabled:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = self._buckets[client] = TokenBucket(self.per_minute / 60.0, self.burst, now)
+                while len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            self._buckets.move_to_end(client)
+            wait = bucket.take(now)
+            if wait:
+                self.limited += 1
+            else:
+                self.allowed += 1
+        return wait
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "per_minute": self.per_minute,
+            "burst": self.burst,
+            "clients": len(self._buckets),
+            "allowed": self.allowed,
+            "limited": self.limited,
+        }
+
+
+class ConcurrencyLimiter:
+    """
+    Caps in-flight work of one kind (LLM calls, SQL executions). Callers beyond
+    ``limit`` wait up to ``max_wait`` seconds; once ``max_queue`` callers are
+    already waiting, or the wait runs out, the request is shed with a 503.
+    """
+
+    def __init__(self, name: str, limit: int, max_wait: float = None, max_queue: int = None):
+        self.name = name
+        self.limit = max(1, limit)
+        self.max_wait = max_wait if max_wait is not None else Config.ADMISSION_MAX_WAIT_SECONDS
+        self.max_queue = max_queue if max_queue is not None else Config.ADMISSION_MAX_QUEUE
+        self._slots = threading.BoundedSemaphore(self.limit)
+        self._lock = threading.Lock()
+        self._hold = LatencyTracker()
+        self._wait = LatencyTracker()
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+
+    def _retry_after(self) -> float:
+        """Rough time for the current backlog to drain, from the median hold time."""
+        typical = self._hold.percentile(0.5) or 1.0
+        return typical * (self.waiting + self.limit) / self.limit
+
+    @contextmanager
+    def slot(self):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                if self.waiting >= self.max_queue:
+                    self.rejected_queue_full += 1
+                    raise AdmissionRejected(503, f"Server busy: too many queued {self.name} requests.",
+                                            self._retry_after())
+                self.waiting += 1
+                self.queued += 1
+            started = time.monotonic()
+            acquired = self._slots.acquire(timeout=self.max_wait)
+            with self._lock:
+                self.waiting -= 1
+            self._wait.record(time.monotonic() - started)
+            if not acquired:
+                with self._lock:
+                    self.rejected_timeout += 1
+                raise AdmissionRejected(503, f"Server busy: no {self.name} capacity within "
+                                        f"{self.max_wait:.0f}s.", self._retry_after())
+        with self._lock:
+            self.in_flight += 1
+            self.admitted += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._hold.record(time.monotonic() - started)
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+            "wait_p95_ms": round((self._wait.percentile(0.95) or 0) * 1000, 1),
+            "hold_p50_ms": round((self._hold.percentile(0.5) or 0) * 1000, 1),
+        }
+
+
+rate_limiter = RateLimiter()
+# Typing-driven /prefetch calls get their own, looser bucket so they never use up /ask quota
+prefetch_rate_limiter = RateLimiter(Config.PREFETCH_RATE_LIMIT_PER_MINUTE, Config.PREFETCH_RATE_LIMIT_BURST)
+llm_limiter = ConcurrencyLimiter("LLM", Config.LLM_MAX_CONCURRENCY)
+sql_limiter = ConcurrencyLimiter("SQL", Config.SQL_MAX_CONCURRENCY)
+
+
+def client_key(headers, client_host: Optional[str]) -> str:
+    """API key header if present, else the (optionally forwarded) client address."""
+    api_key = headers.get(Config.CLIENT_KEY_HEADER) if Config.CLIENT_KEY_HEADER else None
+    if api_key:
+        return f"key:{api_key}"
+    if Config.TRUST_FORWARDED_FOR:
+        forwarded = headers.get("x-forwarded-for")
+        if forwarded:
+            return f"ip:{forwarded.split(',')[0].strip()}"
+    return f"ip:{client_host or 'unknown'}"
+
+
+def admission_stats() -> dict:
+    return {
+        "rate_limit": rate_limiter.stats(),
+        "prefetch_rate_limit": prefetch_rate_limiter.stats(),
+        "llm": llm_limiter.stats(),
+        "sql": sql_limiter.stats(),
+    }
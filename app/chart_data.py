@@ -0,0 +1,324 @@
+# Server-side aggregation and downsampling of stored results for charting
+import math
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import numpy as np
+
+from .prompts import CHART_FAMILIES
+from .result_store import StoredResult
+from .sqlite_client import run_query
+
+CATEGORY_CHARTS = CHART_FAMILIES["category"]
+SERIES_CHARTS = CHART_FAMILIES["series"]
+DISTRIBUTION_CHARTS = {"Box Plot", "Violin Plot"}
+OTHER_LABEL = "Other"
+# Finest scatter grid tried while looking for enough occupied cells
+MAX_GRID_CELLS_PER_AXIS = 1 << 16
+
+
+class ChartDataError(ValueError):
+    """The stored result cannot be reduced for the requested chart."""
+
+
+@dataclass
+class ChartData:
+    chart_type: str
+    columns: List[str]
+    rows: list
+    method: str
+    source_rows: int
+    index: Optional[list] = None
+    extra: dict = field(default_factory=dict)
+
+
+def _quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def _query(sql: str, params: tuple = ()):
+    columns, rows_or_error = run_query(sql, params)
+    if isinstance(rows_or_error, str):
+        raise ChartDataError(rows_or_error)
+    return columns, rows_or_error
+
+
+def _as_number(column: str) -> str:
+    """SQL expression that is the column's value when it is a number, NULL otherwise."""
+    return f"CASE WHEN typeof({_quote(column)}) IN ('integer', 'real') THEN {_quote(column)} END"
+
+
+def _sample(result: StoredResult, sample_size: int = 200):
+    """Column names and the columns whose sampled non-null values are all numbers."""
+    columns, rows = _query(f"SELECT * FROM ({result.sql}) LIMIT ?", (sample_size,))
+    numeric = []
+    for i, column in enumerate(columns):
+        values = [row[i] for row in rows if row[i] is not None]
+        if values and all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+            numeric.append(column)
+    return columns, numeric
+
+
+def _float_array(values) -> np.ndarray:
+    """Numbers from ``_as_number`` columns; NULLs become NaN."""
+    return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+
+
+def _column_array(result: StoredResult, column: str):
+    """Numeric values of ``column`` (other values dropped) and the result's row count."""
+    _, rows = _query(f"SELECT {_as_number(column)} FROM ({result.sql})")
+    values = _float_array(row[0] for row in rows)
+    return values[~np.isnan(values)], len(rows)
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets downsampling; returns indices of the points
+    to keep (always including the first and last).
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    keep = np.empty(threshold, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], max(edges[i + 1], edges[i] + 1)
+        next_start, next_end = edges[i + 1], (edges[i + 2] if i + 2 < len(edges) else n)
+        next_end = max(next_end, next_start + 1)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        # Triangle area between the previous kept point, each candidate and the next bucket's mean
+        areas = np.abs((x[selected] - avg_x) * (y[start:end] - y[selected])
+                       - (x[selected] - x[start:end]) * (avg_y - y[selected]))
+        selected = start + int(np.argmax(areas))
+        keep[i + 1] = selected
+    return keep
+
+
+def _top_n(result: StoredResult, columns: List[str], numeric: List[str], chart_type: str,
+           max_points: int) -> ChartData:
+    """
+    GROUP BY the category in SQL, keeping the top N and folding the rest into
+    one overflow bucket. The bucket is told apart by a flag, not by its label,
+    and labelled ``Other (K more)`` made unique against the real categories;
+    ``extra["other_label"]`` names it.
+    """
+    if len(columns) < 2:
+        raise ChartDataError(f"{chart_type} requires at least 2 columns")
+    category, value = _quote(columns[0]), _quote(columns[1])
+    aggregate = f"SUM({_as_number(columns[1])})" if columns[1] in numeric else "COUNT(*)"
+    # Waterfalls are read in sequence, everything else by size
+    rank_order = "first_seen" if chart_type == "Waterfall Chart" else "v DESC"
+    sql = f"""
+        WITH src AS (SELECT row_number() OVER () AS pos, * FROM ({result.sql})),
+        grouped AS (SELECT {category} AS k, {aggregate} AS v, MIN(pos) AS first_seen, COUNT(*) AS n
+                    FROM src GROUP BY {category}),
+        ranked AS (SELECT k, v, n, first_seen, row_number() OVER (ORDER BY {rank_order}) AS rn FROM grouped)
+        SELECT rn >= ? AS overflow, CASE WHEN rn < ? THEN k END AS label, SUM(v) AS total, SUM(n), COUNT(*)
+        FROM ranked GROUP BY overflow, label ORDER BY MIN(rn)
+    """
+    _, rows = _query(sql, (max_points, max_points))
+    source_rows = sum(r[3] for r in rows)
+    method = "sql_top_n" if len(rows) < source_rows else "sql_group_by"
+    extra = {}
+    labels = {str(r[1]) for r in rows if not r[0]}
+    data = []
+    for overflow, label, total, _, categories in rows:
+        if overflow:
+            label = f"{OTHER_LABEL} ({categories} more)"
+            while label in labels:
+                label += "*"
+            extra = {"other_label": label, "other_categories": categories}
+        data.append([label, total])
+    return ChartData(chart_type, columns[:2], data, method, source_rows, extra=extra)
+
+
+def _series(result: StoredResult, columns: List[str], numeric: List[str], chart_type: str,
+            max_points: int) -> ChartData:
+    """LTTB on (x, y) sorted by x; non-numeric x values are placed by position."""
+    if len(columns) < 2:
+        raise ChartDataError(f"{chart_type} requires at least 2 columns")
+    if columns[1] not in numeric:
+        raise ChartDataError(f"{chart_type} needs a numeric second column")
+    _, rows = _query(f"SELECT {_quote(columns[0])}, {_quote(columns[1])}, {_as_number(columns[0])}, "
+                     f"{_as_number(columns[1])} FROM ({result.sql})")
+    source_rows = len(rows)
+    if len(rows) <= max_points:
+        return ChartData(chart_type, columns[:2], [list(r[:2]) for r in rows], "none", source_rows)
+
+    y = _float_array(r[3] for r in rows)
+    x = (_float_array(r[2] for r in rows) if columns[0] in numeric
+         else np.arange(len(rows), dtype=np.float64))
+    valid = ~(np.isnan(x) | np.isnan(y))
+    positions = np.flatnonzero(valid)
+    # LTTB buckets by position, so the points must be in x order
+    positions = positions[np.argsort(x[positions], kind="stable")]
+    keep = positions[lttb(x[positions], y[positions], max_points)]
+    return ChartData(chart_type, columns[:2], [list(rows[i][:2]) for i in keep], "lttb", source_rows)
+
+
+def grid_thin(xy: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Indices of the first point in each occupied cell of the coarsest square
+    grid with at least ``max_points`` occupied cells, evenly thinned down to
+    ``max_points``. Fewer come back only when the points have fewer distinct
+    positions.
+    """
+    lo, hi = xy.min(axis=0), xy.max(axis=0)
+    scaled = (xy - lo) / np.where(hi > lo, hi - lo, 1.0)
+
+    def occupied(cells: int) -> np.ndarray:
+        cell = np.minimum((scaled * cells).astype(np.int64), cells - 1)
+        _, first = np.unique(cell[:, 0] * cells + cell[:, 1], return_index=True)
+        return np.sort(first)
+
+    low, high = 1, max(2, math.ceil(math.sqrt(max_points)))
+    keep = occupied(high)
+    while len(keep) < max_points and high < MAX_GRID_CELLS_PER_AXIS:
+        low, high = high, high * 2
+        keep = occupied(high)
+    # Narrow down to the coarsest grid that still fills max_points
+    while len(keep) >= max_points and high - low > 1:
+        middle = (low + high) // 2
+        candidate = occupied(middle)
+        if len(candidate) >= max_points:
+            high, keep = middle, candidate
+        else:
+            low = middle
+    if len(keep) > max_points:
+        keep = keep[np.linspace(0, len(keep) - 1, max_points).astype(np.int64)]
+    return keep
+
+
+def _scatter(result: StoredResult, columns: List[str], numeric: List[str], chart_type: str,
+             max_points: int) -> ChartData:
+    """Grid thinning: keep one point per occupied cell so outliers and shape survive."""
+    if len(columns) < 2:
+        raise ChartDataError(f"{chart_type} requires at least 2 columns")
+    keep_columns = columns[:3]
+    width = len(keep_columns)
+    _, rows = _query(f"SELECT {', '.join(_quote(c) for c in keep_columns)}, {_as_number(columns[0])}, "
+                     f"{_as_number(columns[1])} FROM ({result.sql})")
+    source_rows = len(rows)
+    if len(rows) <= max_points:
+        return ChartData(chart_type, keep_columns, [list(r[:width]) for r in rows], "none", source_rows)
+
+    if columns[0] in numeric and columns[1] in numeric:
+        xy = np.column_stack([_float_array(r[width] for r in rows), _float_array(r[width + 1] for r in rows)])
+        # Points without both coordinates cannot be drawn; leave them out rather than pin them to 0
+        positions = np.flatnonzero(~np.isnan(xy).any(axis=1))
+        if not len(positions):
+            raise ChartDataError(f"{columns[0]} and {columns[1]} have no numeric pairs")
+        keep = positions[grid_thin(xy[positions], max_points)]
+        method = "grid_thinning"
+    else:
+        keep = np.linspace(0, len(rows) - 1, max_points).astype(np.int64)
+        method = "stride_sample"
+    return ChartData(chart_type, keep_columns, [list(rows[i][:width]) for i in keep[:max_points]], method,
+                     source_rows)
+
+
+def _histogram(result: StoredResult, columns: List[str], numeric: List[str], chart_type: str,
+               max_points: int) -> ChartData:
+    """Pre-binned counts of the first numeric column."""
+    if not numeric:
+        raise ChartDataError("Histogram requires numeric data")
+    values, source_rows = _column_array(result, numeric[0])
+    if not len(values):
+        raise ChartDataError(f"{numeric[0]} has no numeric values")
+    bins = max(1, min(max_points, int(math.sqrt(len(values))) or 1, 100))
+    counts, edges = np.histogram(values, bins=bins)
+    rows = [[float(edges[i]), float(edges[i + 1]), int(counts[i])] for i in range(len(counts))]
+    return ChartData(chart_type, [f"{numeric[0]}_start", f"{numeric[0]}_end", "count"], rows,
+                     "numpy_histogram", source_rows, extra={"value_column": numeric[0]})
+
+
+def _distribution(result: StoredResult, columns: List[str], numeric: List[str], chart_type: str,
+                  max_points: int) -> ChartData:
+    """Evenly spaced quantiles of the first numeric column, preserving the distribution's shape."""
+    if not numeric:
+        raise ChartDataError(f"{chart_type} requires numeric data")
+    values, source_rows = _column_array(result, numeric[0])
+    if len(values) <= max_points:
+        return ChartData(chart_type, [numeric[0]], [[float(v)] for v in values], "none", source_rows)
+    sample = np.quantile(values, np.linspace(0, 1, max_points))
+    return ChartData(chart_type, [numeric[0]], [[float(v)] for v in sample], "quantile_sample", source_rows)
+
+
+def _heatmap(result: StoredResult, columns: List[str], numeric: List[str], chart_type: str,
+             max_points: int) -> ChartData:
+    """Correlation matrix for numeric data, otherwise a GROUP BY count matrix of the top categories."""
+    if numeric:
+        _, rows = _query(f"SELECT {', '.join(_as_number(c) for c in numeric)} FROM ({result.sql})")
+        source_rows = len(rows)
+        data = np.array([[np.nan if v is None else v for v in row] for row in rows],
+                        dtype=np.float64).reshape(len(rows), len(numeric))
+        if len(numeric) == 1:
+            corr = np.ones((1, 1))
+        else:
+            corr = np.ma.corrcoef(np.ma.masked_invalid(data), rowvar=False).filled(np.nan)
+        matrix = [[None if np.isnan(v) else float(v) for v in row] for row in np.atleast_2d(corr)]
+        return ChartData(chart_type, numeric, matrix, "numpy_corr", source_rows, index=numeric)
+
+    if len(columns) < 2:
+        raise ChartDataError("Heatmap requires numeric data or at least 2 columns")
+    side = max(2, int(math.sqrt(max_points)))
+    row_col = _quote(columns[0])
+    col_col = _quote(columns[1] if len(columns) > 2 else columns[0])
+    sql = f"""
+        WITH src AS (SELECT {row_col} AS r, {col_col} AS c FROM ({result.sql})),
+        top_r AS (SELECT r FROM src GROUP BY r ORDER BY COUNT(*) DESC LIMIT ?),
+        top_c AS (SELECT c FROM src GROUP BY c ORDER BY COUNT(*) DESC LIMIT ?),
+        cells AS (SELECT r, c, COUNT(*) AS n FROM src
+                  WHERE r IN (SELECT r FROM top_r) AND c IN (SELECT c FROM top_c)
+                  GROUP BY r, c)
+        SELECT total.n, cells.r, cells.c, cells.n FROM (SELECT COUNT(*) AS n FROM src) AS total
+        LEFT JOIN cells
+    """
+    # The LEFT JOIN always yields one row, so the row count comes back even with no cells
+    _, counted = _query(sql, (side, side))
+    source_rows = counted[0][0]
+    rows = [r[1:] for r in counted if r[3] is not None]
+    index = sorted({r[0] for r in rows}, key=str)
+    labels = sorted({r[1] for r in rows}, key=str)
+    position = {label: j for j, label in enumerate(labels)}
+    matrix = {r: [0] * len(labels) for r in index}
+    for r, c, count in rows:
+        matrix[r][position[c]] = count
+    return ChartData(chart_type, labels, [matrix[r] for r in index], "sql_pivot_count", source_rows, index=index)
+
+
+def _table(result: StoredResult, columns: List[str], numeric: List[str], chart_type: str,
+           max_points: int) -> ChartData:
+    _, rows = _query(f"SELECT *, COUNT(*) OVER () FROM ({result.sql}) LIMIT ?", (max_points,))
+    source_rows = rows[0][-1] if rows else 0
+    return ChartData(chart_type, columns, [list(r[:-1]) for r in rows], "head", source_rows)
+
+
+def build_chart_data(result: StoredResult, chart_type: str, max_points: int) -> ChartData:
+    """
+    Reduce a stored result to just the points needed to draw ``chart_type``.
+    The statement runs twice: a small sample for column names and types, then
+    the reduction, which also counts the source rows. Values that are not
+    numbers are left out of numeric reductions.
+    """
+    columns, numeric = _sample(result)
+
+    if chart_type in CATEGORY_CHARTS:
+        builder = _top_n
+    elif chart_type in SERIES_CHARTS:
+        builder = _series
+    elif chart_type == "Scatter Plot":
+        builder = _scatter
+    elif chart_type == "Histogram":
+        builder = _histogram
+    elif chart_type in DISTRIBUTION_CHARTS:
+        builder = _distribution
+    elif chart_type == "Heatmap":
+        builder = _heatmap
+    else:
+        builder = _table
+    return builder(result, columns, numeric, chart_type, max_points)
@@ -24,18 +24,129 @@ class Config:
     # Vector Store Configuration
     VECTOR_STORE_PATH: str = os.getenv("VECTOR_STORE_PATH", "retriever/faiss_index")
     
+    # SQL Validation
+    SQL_VALIDATION: bool = os.getenv("SQL_VALIDATION", "True").lower() == "true"
+    # LLM round-trips allowed to fix invalid or failing SQL before giving up
+    SQL_REPAIR_ATTEMPTS: int = int(os.getenv("SQL_REPAIR_ATTEMPTS", "1"))
+    
+    # Result Pagination
+    RESULT_PAGE_SIZE: int = int(os.getenv("RESULT_PAGE_SIZE", "100"))
+    RESULT_PAGE_SIZE_MAX: int = int(os.getenv("RESULT_PAGE_SIZE_MAX", "1000"))
+    RESULT_STORE_MAX_ENTRIES: int = int(os.getenv("RESULT_STORE_MAX_ENTRIES", "256"))
+    RESULT_STORE_TTL_SECONDS: float = float(os.getenv("RESULT_STORE_TTL_SECONDS", "900"))
+    # Rows held per result handle; larger results are cut off and flagged as truncated
+    RESULT_MAX_ROWS: int = int(os.getenv("RESULT_MAX_ROWS", "10000"))
+    
+    # Server-side chart reduction (GET /results/{handle}/chart)
+    CHART_MAX_POINTS: int = int(os.getenv("CHART_MAX_POINTS", "1000"))
+    CHART_MAX_POINTS_LIMIT: int = int(os.getenv("CHART_MAX_POINTS_LIMIT", "10000"))
+    
+    # Question caches: retrieval keyed by question, SQL by question + chart family
+    ASK_CACHE_MAX_ENTRIES: int = int(os.getenv("ASK_CACHE_MAX_ENTRIES", "512"))
+    ASK_CACHE_TTL_SECONDS: float = float(os.getenv("ASK_CACHE_TTL_SECONDS", "900"))
+    
+    # /prefetch while the user types: always warms retrieval; speculative SQL is generated only
+    # with spare LLM capacity, within a global PREFETCH_LLM_PER_MINUTE budget (0 disables it)
+    PREFETCH_SQL: bool = os.getenv("PREFETCH_SQL", "True").lower() == "true"
+    PREFETCH_MIN_CHARS: int = int(os.getenv("PREFETCH_MIN_CHARS", "12"))
+    PREFETCH_LLM_PER_MINUTE: float = float(os.getenv("PREFETCH_LLM_PER_MINUTE", "20"))
+    # How long /ask waits for a speculative generation of the same question already in flight
+    PREFETCH_WAIT_SECONDS: float = float(os.getenv("PREFETCH_WAIT_SECONDS", "15"))
+    PREFETCH_RATE_LIMIT_PER_MINUTE: float = float(os.getenv("PREFETCH_RATE_LIMIT_PER_MINUTE", "120"))
+    PREFETCH_RATE_LIMIT_BURST: int = int(os.getenv("PREFETCH_RATE_LIMIT_BURST", "20"))
+    
+    # Read-only snapshots for result queries (off|file|memory|auto; auto keeps DBs up to
+    # SNAPSHOT_MEMORY_MAX_MB in RAM). SNAPSHOT_BACKUP_PAGES > 0 copies in steps so writers interleave
+    SNAPSHOT_MODE: str = os.getenv("SNAPSHOT_MODE", "off")
+    SNAPSHOT_DIR: str = os.getenv("SNAPSHOT_DIR", "snapshots")
+    SNAPSHOT_REFRESH_SECONDS: float = float(os.getenv("SNAPSHOT_REFRESH_SECONDS", "60"))
+    SNAPSHOT_MEMORY_MAX_MB: float = float(os.getenv("SNAPSHOT_MEMORY_MAX_MB", "256"))
+    SNAPSHOT_BACKUP_PAGES: int = int(os.getenv("SNAPSHOT_BACKUP_PAGES", "0"))
+    
+    # Background jobs (/jobs); JOBS_DB_PATH enables a durable SQLite-backed queue
+    JOB_WORKERS: int = int(os.getenv("JOB_WORKERS", "2"))
+    JOB_QUEUE_MAX: int = int(os.getenv("JOB_QUEUE_MAX", "100"))
+    JOB_RETENTION_SECONDS: float = float(os.getenv("JOB_RETENTION_SECONDS", "3600"))
+    JOBS_DB_PATH: str = os.getenv("JOBS_DB_PATH", "")
+    # Seconds a worker's claim on a durable job lasts without renewal before another process re-queues it
+    JOB_LEASE_SECONDS: float = float(os.getenv("JOB_LEASE_SECONDS", "30"))
+    
+    # Admission control: per-client token buckets on /ask and /jobs, global in-flight caps
+    RATE_LIMIT_PER_MINUTE: float = float(os.getenv("RATE_LIMIT_PER_MINUTE", "30"))
+    RATE_LIMIT_BURST: int = int(os.getenv("RATE_LIMIT_BURST", "10"))
+    CLIENT_KEY_HEADER: str = os.getenv("CLIENT_KEY_HEADER", "X-API-Key")
+    TRUST_FORWARDED_FOR: bool = os.getenv("TRUST_FORWARDED_FOR", "False").lower() == "true"
+    LLM_MAX_CONCURRENCY: int = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+    SQL_MAX_CONCURRENCY: int = int(os.getenv("SQL_MAX_CONCURRENCY", "4"))
+    ADMISSION_MAX_WAIT_SECONDS: float = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "10"))
+    ADMISSION_MAX_QUEUE: int = int(os.getenv("ADMISSION_MAX_QUEUE", "32"))
+    
+    # Query log: one JSON line per question (empty path disables); {pid} gives each worker process
+    # its own file, since several processes rotating one file lose and duplicate records
+    QUERY_LOG_PATH: str = os.getenv("QUERY_LOG_PATH", "logs/queries.{pid}.jsonl")
+    QUERY_LOG_MAX_BYTES: int = int(os.getenv("QUERY_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+    QUERY_LOG_BACKUPS: int = int(os.getenv("QUERY_LOG_BACKUPS", "5"))
+    # Keep raw LLM responses so replays can serve them from the mock LLM (opt-in: they can hold data)
+    QUERY_LOG_RESPONSES: bool = os.getenv("QUERY_LOG_RESPONSES", "False").lower() == "true"
+    
     # Application Settings
     DEBUG: bool = os.getenv("DEBUG", "False").lower() == "true"
     LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
     
     # RAG Configuration
     TOP_K_RETRIEVAL: int = int(os.getenv("TOP_K_RETRIEVAL", "5"))
+    # Adaptive k: TOP_K_RETRIEVAL becomes the upper bound; stop at a score gap or once
+    # the softmax of the scores covers RETRIEVAL_CUMULATIVE_MASS, then bridge via foreign keys
+    RETRIEVAL_ADAPTIVE: bool = os.getenv("RETRIEVAL_ADAPTIVE", "True").lower() == "true"
+    RETRIEVAL_MIN_K: int = int(os.getenv("RETRIEVAL_MIN_K", "1"))
+    RETRIEVAL_SCORE_GAP: float = float(os.getenv("RETRIEVAL_SCORE_GAP", "0.1"))
+    RETRIEVAL_CUMULATIVE_MASS: float = float(os.getenv("RETRIEVAL_CUMULATIVE_MASS", "0.9"))
+    RETRIEVAL_SOFTMAX_TEMPERATURE: float = float(os.getenv("RETRIEVAL_SOFTMAX_TEMPERATURE", "0.05"))
+    RETRIEVAL_FK_EXPANSION: int = int(os.getenv("RETRIEVAL_FK_EXPANSION", "2"))
     EMBEDDING_MODEL: str = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+    # Storage precision of the memory-mapped embedding matrix (float32 or float16)
+    EMBEDDING_DTYPE: str = os.getenv("EMBEDDING_DTYPE", "float32")
+    # retriever/build_index.py: >1 encodes in a process pool, streaming CHUNK_SIZE rows at a time to disk
+    INDEX_BUILD_WORKERS: int = int(os.getenv("INDEX_BUILD_WORKERS", "1"))
+    INDEX_BUILD_CHUNK_SIZE: int = int(os.getenv("INDEX_BUILD_CHUNK_SIZE", "512"))
+    
+    # Shared embedding server (retriever/model_server.py); leave both empty to encode in-process
+    EMBEDDING_SERVER_URL: str = os.getenv("EMBEDDING_SERVER_URL", "")
+    EMBEDDING_SERVER_SOCKET: str = os.getenv("EMBEDDING_SERVER_SOCKET", "")
+    EMBEDDING_SERVER_HOST: str = os.getenv("EMBEDDING_SERVER_HOST", "127.0.0.1")
+    EMBEDDING_SERVER_PORT: int = int(os.getenv("EMBEDDING_SERVER_PORT", "8765"))
+    EMBEDDING_SERVER_TIMEOUT: float = float(os.getenv("EMBEDDING_SERVER_TIMEOUT", "10"))
+    
+    # Micro-batching of encode requests
+    EMBED_BATCHING: bool = os.getenv("EMBED_BATCHING", "True").lower() == "true"
+    EMBED_BATCH_MAX_SIZE: int = int(os.getenv("EMBED_BATCH_MAX_SIZE", "32"))
+    EMBED_BATCH_MAX_WAIT_MS: float = float(os.getenv("EMBED_BATCH_MAX_WAIT_MS", "5"))
     
     # LLM Configuration
     MAX_TOKENS: int = int(os.getenv("MAX_TOKENS", "500"))
     TEMPERATURE: float = float(os.getenv("TEMPERATURE", "0.1"))
     
+    # LLM Resilience
+    LLM_TIMEOUT: float = float(os.getenv("LLM_TIMEOUT", "15"))
+    LLM_MAX_RETRIES: int = int(os.getenv("LLM_MAX_RETRIES", "2"))
+    LLM_BACKOFF_BASE: float = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+    LLM_BACKOFF_MAX: float = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+    # Seconds before a duplicate (hedged) request is sent; "p95" uses observed latency, empty disables
+    LLM_HEDGE_DELAY: str = os.getenv("LLM_HEDGE_DELAY", "")
+    LLM_CIRCUIT_FAILURE_THRESHOLD: int = int(os.getenv("LLM_CIRCUIT_FAILURE_THRESHOLD", "5"))
+    LLM_CIRCUIT_RESET_SECONDS: float = float(os.getenv("LLM_CIRCUIT_RESET_SECONDS", "30"))
+    
+    # LLM Backend Pool
+    # JSON list (inline or path to a .json file) of backends; empty uses LLM_BASE_URL/LLM_MODEL
+    LLM_BACKENDS: str = os.getenv("LLM_BACKENDS", "")
+    LLM_CHAT_PATH: str = os.getenv("LLM_CHAT_PATH", "/llm/chat/completions")
+    LLM_AUTH_SCHEME: str = os.getenv("LLM_AUTH_SCHEME", "Token")
+    LLM_BACKEND_MAX_CONCURRENCY: int = int(os.getenv("LLM_BACKEND_MAX_CONCURRENCY", "8"))
+    LLM_EWMA_ALPHA: float = float(os.getenv("LLM_EWMA_ALPHA", "0.3"))
+    LLM_POOL_WAIT_SECONDS: float = float(os.getenv("LLM_POOL_WAIT_SECONDS", "5"))
+    # Regenerate with a larger model tier when the generated SQL fails to execute
+    LLM_MAX_ESCALATIONS: int = int(os.getenv("LLM_MAX_ESCALATIONS", "1"))
+    
     def __init__(self):
         """Initialize configuration and validate required settings"""
         self._validate_config()
@@ -79,6 +190,7 @@ class Config:
         return {
             "path": self.VECTOR_STORE_PATH,
             "embedding_model": self.EMBEDDING_MODEL,
+            "embedding_dtype": self.EMBEDDING_DTYPE,
             "top_k": self.TOP_K_RETRIEVAL
         }
     
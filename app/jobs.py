@@ -0,0 +1,531 @@
+# Background execution of questions with priorities, progress and cancellation
+import itertools
+import json
+import os
+import queue
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import List, Optional
+
+from fastapi import HTTPException
+
+from .config import Config
+from .pipeline import PipelineCancelled, PipelineHooks, answer_question
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = {SUCCEEDED, FAILED, CANCELLED}
+# SQLite VM instructions between cancellation checks on a job's query
+PROGRESS_HANDLER_STEPS = 10000
+# How often a detached copy re-reads a job another process is running
+JOB_POLL_SECONDS = 0.5
+
+
+class JobQueueFullError(RuntimeError):
+    """Too many jobs are already waiting."""
+
+
+class Job(PipelineHooks):
+    """
+    One submitted question. Doubles as the pipeline's hooks: it records the
+    current stage, stops at checkpoints once cancelled, and aborts its SQL
+    through a progress handler once cancelled (``interrupt()`` alone is lost
+    when it lands before a statement starts).
+    """
+
+    def __init__(self, question: str, chart_type: Optional[str] = None, priority: int = 0,
+                 job_id: str = None, created_at: float = None, client: str = None):
+        self.id = job_id or uuid.uuid4().hex
+        self.client = client
+        self.question = question
+        self.chart_type = chart_type
+        self.priority = priority
+        self.status = QUEUED
+        self.stage_name = None
+        self.result = None
+        self.error = None
+        self.status_code = None
+        self.created_at = created_at or time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.version = 0
+        self._cancelled = threading.Event()
+        self._conn = None
+        self._changed = threading.Condition()
+        self._listener = None
+        self._store = None  # set on detached copies of jobs another process runs
+
+    # PipelineHooks
+    def stage(self, name: str):
+        self._update(stage_name=name)
+
+    def checkpoint(self):
+        if self._cancelled.is_set():
+            raise PipelineCancelled(self.id)
+
+    def on_connect(self, conn):
+        # A non-zero return aborts the running statement with "interrupted"
+        conn.set_progress_handler(lambda: 1 if self._cancelled.is_set() else 0, PROGRESS_HANDLER_STEPS)
+        with self._changed:
+            self._conn = conn
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED
+
+    def _update(self, **fields):
+        with self._changed:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self.version += 1
+            self._changed.notify_all()
+        if self._listener:
+            self._listener(self)
+
+    def _start(self, claim=None) -> bool:
+        """Move QUEUED -> RUNNING; False if the job was cancelled while waiting or ``claim()`` fails."""
+        with self._changed:
+            if self.status != QUEUED or self._cancelled.is_set():
+                return False
+            if claim is not None and not claim():
+                return False
+            self.status = RUNNING
+            self.started_at = time.time()
+        self._update()
+        return True
+
+    def _finish(self, status: str, result: dict = None, error: str = None, status_code: int = None):
+        self._update(status=status, result=result, error=error, status_code=status_code,
+                     finished_at=time.time(), _conn=None)
+
+    def cancel(self) -> bool:
+        """Cancel a queued job, or stop a running one at its next checkpoint or SQL progress check."""
+        with self._changed:
+            if self.finished:
+                return False
+            self._cancelled.set()
+            conn = self._conn if self.status == RUNNING else None
+            was_queued = self.status == QUEUED
+        if was_queued:
+            self._finish(CANCELLED, error="Cancelled before it started.")
+        elif conn is not None:
+            try:
+                conn.interrupt()
+            except sqlite3.ProgrammingError:
+                pass  # the query already finished and closed its connection
+        return True
+
+    def wait(self, version: int, timeout: float) -> int:
+        """Block until the job changes from ``version`` (or ``timeout``); returns the current version."""
+        if self._store is not None:
+            return self._poll(version, timeout)
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    def _poll(self, version: int, timeout: float) -> int:
+        deadline = time.monotonic() + timeout
+        while self.version == version:
+            fresh = self._store.load(self.id)
+            if fresh is not None and fresh.to_dict() != self.to_dict():
+                with self._changed:
+                    for name in ("status", "stage_name", "result", "error", "status_code",
+                                 "started_at", "finished_at"):
+                        setattr(self, name, getattr(fresh, name))
+                    self.version += 1
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(JOB_POLL_SECONDS, remaining))
+        return self.version
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "stage": self.stage_name,
+            "priority": self.priority,
+            "question": self.question,
+            "chart_type": self.chart_type,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "status_code": self.status_code,
+            "result": self.result,
+        }
+
+
+class JobStore:
+    """
+    Optional SQLite persistence so queued jobs and finished results survive a
+    restart. Several processes (uvicorn workers) may share one store: a worker
+    runs a job only after claiming its row, holds the claim with a lease it
+    keeps renewing, and finds cancels from other processes in ``cancel_requested``.
+    """
+
+    COLUMNS = ("id", "question", "chart_type", "priority", "status", "stage", "created_at", "started_at",
+               "finished_at", "error", "status_code", "result", "client")
+    # Claim columns belong to the store; save() never overwrites them
+    ADDED_COLUMNS = {"client": "TEXT", "owner": "TEXT", "lease_until": "REAL",
+                     "cancel_requested": "INTEGER NOT NULL DEFAULT 0"}
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY, question TEXT NOT NULL, chart_type TEXT, priority INTEGER NOT NULL,
+                status TEXT NOT NULL, stage TEXT, created_at REAL NOT NULL, started_at REAL,
+                finished_at REAL, error TEXT, status_code INTEGER, result TEXT
+            )""")
+        # Stores created before jobs kept their client or could be claimed
+        existing = [row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")]
+        for name, declaration in self.ADDED_COLUMNS.items():
+            if name not in existing:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {declaration}")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        self._conn.commit()
+
+    def _execute(self, sql: str, params=()) -> int:
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            self._conn.commit()
+            return cursor.rowcount
+
+    def save(self, job: Job):
+        result = json.dumps(job.result, default=str) if job.result is not None else None
+        updates = ", ".join(f"{name} = excluded.{name}" for name in self.COLUMNS[1:])
+        self._execute(
+            f"INSERT INTO jobs ({', '.join(self.COLUMNS)}) VALUES ({', '.join('?' * len(self.COLUMNS))}) "
+            f"ON CONFLICT(id) DO UPDATE SET {updates}",
+            (job.id, job.question, job.chart_type, job.priority, job.status, job.stage_name,
+             job.created_at, job.started_at, job.finished_at, job.error, job.status_code, result,
+             job.client))
+
+    def _job(self, row) -> Job:
+        job = Job(row[1], row[2], row[3], job_id=row[0], created_at=row[6], client=row[12])
+        job.status, job.stage_name, job.started_at, job.finished_at = row[4], row[5], row[7], row[8]
+        job.error, job.status_code = row[9], row[10]
+        job.result = json.loads(row[11]) if row[11] else None
+        return job
+
+    def load(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._job(row) if row else None
+
+    def claim(self, job_id: str, owner: str, lease_seconds: float) -> bool:
+        """Atomically take a queued job for ``owner``; False if it was cancelled or another process has it."""
+        now = time.time()
+        return self._execute(
+            "UPDATE jobs SET status = ?, owner = ?, lease_until = ?, started_at = ? WHERE id = ? AND status = ?",
+            (RUNNING, owner, now + lease_seconds, now, job_id, QUEUED)) == 1
+
+    def renew(self, job_ids: List[str], owner: str, lease_seconds: float) -> List[str]:
+        """Extend ``owner``'s leases on ``job_ids``; returns those another process asked to cancel."""
+        if not job_ids:
+            return []
+        marks = ", ".join("?" * len(job_ids))
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET lease_until = ? WHERE owner = ? AND id IN ({marks})",
+                               (time.time() + lease_seconds, owner, *job_ids))
+            self._conn.commit()
+            rows = self._conn.execute(f"SELECT id FROM jobs WHERE cancel_requested = 1 AND id IN ({marks})",
+                                      job_ids).fetchall()
+        return [row[0] for row in rows]
+
+    def cancel_queued(self, job_id: str) -> bool:
+        """Atomically cancel a job nobody has claimed yet."""
+        return self._execute("UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ? AND status = ?",
+                             (CANCELLED, "Cancelled before it started.", time.time(), job_id, QUEUED)) == 1
+
+    def request_cancel(self, job_id: str) -> bool:
+        """
+        Cancel a job some other process holds: a queued one is finished here,
+        a running one is flagged for its owner to stop at the next renewal.
+        """
+        if self.cancel_queued(job_id):
+            return True
+        return self._execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = ?",
+                             (job_id, RUNNING)) == 1
+
+    def release(self, owner: str, job_ids: List[str]):
+        """Hand ``owner``'s unfinished jobs back to the queue (on shutdown)."""
+        if job_ids:
+            self._execute(f"UPDATE jobs SET status = ?, owner = NULL, lease_until = NULL "
+                          f"WHERE owner = ? AND status = ? AND id IN ({', '.join('?' * len(job_ids))})",
+                          (QUEUED, owner, RUNNING, *job_ids))
+
+    def recoverable(self) -> List[Job]:
+        """Queued jobs plus running ones whose owner stopped renewing its lease (those are re-queued)."""
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET status = ?, owner = NULL, lease_until = NULL "
+                               "WHERE status = ? AND (lease_until IS NULL OR lease_until < ?)",
+                               (QUEUED, RUNNING, time.time()))
+            self._conn.commit()
+            rows = self._conn.execute(f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE status = ? "
+                                      f"ORDER BY created_at", (QUEUED,)).fetchall()
+        return [self._job(row) for row in rows]
+
+    def purge(self, finished_before: float):
+        self._execute("DELETE FROM jobs WHERE finished_at < ?", (finished_before,))
+
+
+class JobQueue:
+    """
+    Bounded in-process worker pool fed by a priority queue (higher ``priority``
+    runs first, FIFO within a priority), optionally persisted to ``JobStore``.
+    With a store, every process sharing it acts as one queue: jobs are claimed
+    before they run, leases that stop being renewed are re-queued, and cancels
+    reach whichever process runs the job.
+    """
+
+    def __init__(self, workers: int = None, max_queued: int = None, retention: float = None,
+                 db_path: str = None, lease_seconds: float = None):
+        self.workers = max(1, workers or Config.JOB_WORKERS)
+        self.max_queued = max(1, max_queued or Config.JOB_QUEUE_MAX)
+        self.retention = retention if retention is not None else Config.JOB_RETENTION_SECONDS
+        self.lease_seconds = lease_seconds if lease_seconds is not None else Config.JOB_LEASE_SECONDS
+        db_path = db_path if db_path is not None else Config.JOBS_DB_PATH
+        self.store = JobStore(db_path) if db_path else None
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._queue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        self._heartbeat_thread = None
+        self._stopping = threading.Event()
+        self.counters = {"submitted": 0, "rejected": 0, "recovered": 0,
+                         SUCCEEDED: 0, FAILED: 0, CANCELLED: 0}
+
+    def start(self):
+        """Start the workers, re-queueing jobs a previous (or crashed) process left unfinished."""
+        with self._lock:
+            if self._threads:
+                return
+            self._stopping.clear()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+                self._threads.append(thread)
+                thread.start()
+        if self.store:
+            recovered = self._recover()
+            if recovered:
+                print(f"📥 Recovered {recovered} unfinished job(s) from {self.store.path}")
+            self._heartbeat_thread = threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True)
+            self._heartbeat_thread.start()
+        print(f"👷 Job queue started with {self.workers} worker(s)")
+
+    def stop(self, timeout: float = 10):
+        """
+        Stop the workers once their current job ends. Durable jobs still
+        running after ``timeout`` are handed back to the store for another
+        process to pick up.
+        """
+        with self._lock:
+            threads, self._threads = self._threads, []
+        if not threads:
+            return
+        self._stopping.set()
+        for _ in threads:
+            self._queue.put((float("-inf"), next(self._seq), None))
+        deadline = time.monotonic() + timeout
+        for thread in threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        if self._heartbeat_thread is not None:
+            self._heartbeat_thread.join(timeout=5)
+            self._heartbeat_thread = None
+        if self.store:
+            with self._lock:
+                running = [job for job in self._jobs.values() if job.status == RUNNING]
+            for job in running:
+                job._listener = None  # whatever it does from now on must not overwrite the next owner
+            self.store.release(self.owner, [job.id for job in running])
+            if running:
+                print(f"📤 Handed {len(running)} running job(s) back to {self.store.path}")
+        print("👷 Job queue stopped")
+
+    def _track(self, job: Job, save: bool = True):
+        if self.store:
+            job._listener = self.store.save
+            if save:
+                self.store.save(job)
+        with self._lock:
+            self._jobs[job.id] = job
+
+    def _forget(self, job: Job):
+        """Stop tracking a job another process now owns; get() follows its row instead."""
+        job._listener = None
+        with self._lock:
+            if self._jobs.get(job.id) is job:
+                del self._jobs[job.id]
+
+    def _detached(self, job_id: str) -> Optional[Job]:
+        job = self.store.load(job_id) if self.store else None
+        if job is not None:
+            job._store = self.store
+        return job
+
+    def _enqueue(self, job: Job):
+        self._queue.put((-job.priority, next(self._seq), job.id))
+
+    def _recover(self) -> int:
+        """Queue stored jobs nobody here tracks: new ones from other processes and expired leases."""
+        recovered = 0
+        for job in self.store.recoverable():
+            with self._lock:
+                if job.id in self._jobs:
+                    continue
+            # The row is already stored; saving it again could undo another process's claim
+            self._track(job, save=False)
+            self._enqueue(job)
+            recovered += 1
+        self.counters["recovered"] += recovered
+        return recovered
+
+    def _heartbeat(self):
+        """Renew leases on our running jobs, apply cancels sent through the store, and adopt orphans."""
+        interval = min(1.0, self.lease_seconds / 3)
+        last_recovery = time.monotonic()
+        while not self._stopping.wait(interval):
+            with self._lock:
+                running = [job.id for job in self._jobs.values() if job.status == RUNNING]
+            try:
+                for job_id in self.store.renew(running, self.owner, self.lease_seconds):
+                    with self._lock:
+                        job = self._jobs.get(job_id)
+                    if job is not None:
+                        job.cancel()
+                if time.monotonic() - last_recovery >= self.lease_seconds:
+                    last_recovery = time.monotonic()
+                    self._recover()
+            except sqlite3.Error as e:
+                print(f"⚠️ Job heartbeat on {self.store.path} failed: {e}")
+
+    def _purge_finished(self):
+        cutoff = time.time() - self.retention
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.finished and job.finished_at < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+        if self.store and expired:
+            self.store.purge(cutoff)
+
+    def queued(self) -> int:
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.status == QUEUED)
+
+    def submit(self, question: str, chart_type: Optional[str] = None, priority: int = 0,
+               client: str = None) -> Job:
+        self.start()
+        self._purge_finished()
+        if self.queued() >= self.max_queued:
+            self.counters["rejected"] += 1
+            raise JobQueueFullError(f"{self.max_queued} jobs are already queued")
+        job = Job(question, chart_type, priority, client=client)
+        self._track(job)
+        self._enqueue(job)
+        self.counters["submitted"] += 1
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """
+        The job as this process sees it. Jobs another process runs come back as
+        a detached copy read from the store, whose ``wait()`` follows the row.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None or self.store is None:
+            return job if job is not None else self._detached(job_id)
+        if job.status == QUEUED:
+            # Queued here may already be claimed (or cancelled) by another process
+            fresh = self._detached(job_id)
+            if fresh is not None and fresh.status != QUEUED:
+                self._forget(job)
+                return fresh
+        return job
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if self.store is not None:
+            if job is None:
+                self.store.request_cancel(job_id)
+                return self._detached(job_id)
+            with job._changed:
+                # Holding the job's lock keeps our own workers from claiming it meanwhile
+                foreign = job.status == QUEUED and not self.store.cancel_queued(job_id)
+            if foreign:
+                self._forget(job)
+                self.store.request_cancel(job_id)
+                return self._detached(job_id)
+        if job is not None and job.cancel() and job.status == CANCELLED:
+            self.counters[CANCELLED] += 1
+        return job
+
+    def _worker(self):
+        while True:
+            _, _, job_id = self._queue.get()
+            if job_id is None:
+                return
+            with self._lock:
+                job = self._jobs.get(job_id)
+            if job is None:
+                continue
+            claim = (lambda: self.store.claim(job.id, self.owner, self.lease_seconds)) if self.store else None
+            if job._start(claim):
+                self._run(job)
+            elif self.store and not job.finished:
+                self._forget(job)  # claimed or cancelled elsewhere
+
+    def _run(self, job: Job):
+        try:
+            result = answer_question(job.question, job.chart_type, hooks=job,
+                                     context={"source": "job", "job_id": job.id, "client": job.client})
+            # A cancel that arrived after the last stage still wins over the result
+            job.checkpoint()
+            job._finish(SUCCEEDED, result=result)
+        except PipelineCancelled:
+            job._finish(CANCELLED, error="Cancelled while running.")
+        except HTTPException as e:
+            job._finish(FAILED, error=str(e.detail), status_code=e.status_code)
+        except Exception as e:
+            print(f"❌ Job {job.id} crashed: {e}")
+            job._finish(FAILED, error=str(e), status_code=500)
+        self.counters[job.status] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            by_status = {}
+            for job in self._jobs.values():
+                by_status[job.status] = by_status.get(job.status, 0) + 1
+        return {
+            "workers": self.workers,
+            "max_queued": self.max_queued,
+            "durable": self.store is not None,
+            "jobs": by_status,
+            **self.counters,
+        }
+
+
+_job_queue = None
+
+
+def get_job_queue() -> JobQueue:
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = JobQueue()
+    return _job_queue
@@ -1,47 +1,392 @@
+import json
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 import requests
 from dotenv import load_dotenv
 
+from app.config import Config
+from app.resilience import CircuitBreaker, LatencyTracker, backoff_delay
+
 # Load environment variables from .env file
 load_dotenv()
 
-class LLMClient:
-    def __init__(self, api_key=None, base_url=None, model=None):
-        self.api_key = api_key or os.getenv("LLM_API_KEY")
-        self.base_url = base_url or os.getenv("LLM_BASE_URL", "https://api.openai.com/v1")
-        self.model = model or os.getenv("LLM_MODEL", "gpt-3.5-turbo")
 
-    def generate_sql(self, prompt: str) -> str:
-        """
-        Call the custom LLM to generate SQL based on the provided prompt.
-        """
-        # Handle API key format - if it already starts with "Token", use as-is
-        auth_header = self.api_key if self.api_key.startswith("Token ") else f"Token {self.api_key}"
-        
+class LLMError(Exception):
+    """Base class for LLM call failures surfaced to the API layer."""
+    retryable = True
+
+
+class LLMTimeoutError(LLMError):
+    """The upstream did not answer within LLM_TIMEOUT."""
+
+
+class LLMUnavailableError(LLMError):
+    """The upstream is unreachable, saturated, or its circuit breaker is open."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class LLMResponseError(LLMError):
+    """The upstream answered with an error status or an unusable body."""
+
+    def __init__(self, message, status_code=None, retryable=False):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retryable = retryable
+
+
+class LLMBackend:
+    """One chat-completions endpoint with its own concurrency limit and health."""
+
+    def __init__(self, name, base_url, model, api_key="", chat_path=None, auth_scheme=None,
+                 tier=0, max_concurrency=None, timeout=None):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.api_key = api_key or ""
+        self.chat_path = chat_path if chat_path is not None else Config.LLM_CHAT_PATH
+        self.auth_scheme = auth_scheme if auth_scheme is not None else Config.LLM_AUTH_SCHEME
+        self.tier = int(tier)
+        self.max_concurrency = int(max_concurrency or Config.LLM_BACKEND_MAX_CONCURRENCY)
+        self.timeout = float(timeout or Config.LLM_TIMEOUT)
+        self.breaker = CircuitBreaker(Config.LLM_CIRCUIT_FAILURE_THRESHOLD, Config.LLM_CIRCUIT_RESET_SECONDS)
+        self.latency = LatencyTracker()
+        self.ewma_latency = None
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"LLMBackend({self.name!r}, model={self.model!r}, tier={self.tier})"
+
+    @property
+    def score(self) -> float:
+        """Expected wait: EWMA latency scaled by current load. Untried backends score 0."""
+        return (self.ewma_latency or 0.0) * (self.in_flight + 1)
+
+    def try_acquire(self, timeout=None) -> bool:
+        acquired = self._slots.acquire(timeout=timeout) if timeout else self._slots.acquire(blocking=False)
+        if acquired:
+            with self._lock:
+                self.in_flight += 1
+        return acquired
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def _observe(self, seconds: float, failed: bool = False):
+        alpha = Config.LLM_EWMA_ALPHA
+        if failed:
+            # A fast failure must not make a broken backend look attractive
+            seconds = max(seconds, self.timeout)
+        with self._lock:
+            self.requests += 1
+            if failed:
+                self.failures += 1
+            if self.ewma_latency is None:
+                self.ewma_latency = seconds
+            else:
+                self.ewma_latency = alpha * seconds + (1 - alpha) * self.ewma_latency
+        if not failed:
+            self.latency.record(seconds)
+
+    def _auth_header(self) -> str:
+        # Handle API key format - if it already starts with the scheme, use as-is
+        if not self.auth_scheme or self.api_key.startswith(f"{self.auth_scheme} "):
+            return self.api_key
+        return f"{self.auth_scheme} {self.api_key}"
+
+    def post(self, messages) -> str:
+        """Single HTTP round-trip; raises a typed LLMError on failure."""
         headers = {
-            "Authorization": auth_header,
+            "Authorization": self._auth_header(),
             "Content-Type": "application/json",
             "accept": "application/json"
         }
+        payload = {"model": self.model, "messages": messages}
 
-        payload = {
-            "model": self.model,
-            "messages": [
-                {"role": "system", "content": "You are a helpful SQL assistant."},
-                {"role": "user", "content": prompt}
-            ]
-        }
-
+        started = time.monotonic()
         try:
             response = requests.post(
-                f"{self.base_url}/llm/chat/completions",
+                f"{self.base_url}{self.chat_path}",
                 json=payload,
                 headers=headers,
-                timeout=15
+                timeout=self.timeout
             )
-            response.raise_for_status()
-            result = response.json()
-            return result["choices"][0]["message"]["content"].strip()
-        except Exception as e:
-            print(f"❌ LLM API Error: {e}")
-            return ""
+        except requests.exceptions.Timeout as e:
+            self._observe(self.timeout, failed=True)
+            raise LLMTimeoutError(f"{self.name}: LLM request timed out after {self.timeout}s") from e
+        except requests.exceptions.ConnectionError as e:
+            self._observe(time.monotonic() - started, failed=True)
+            raise LLMUnavailableError(f"{self.name}: could not connect to {self.base_url}: {e}") from e
+
+        elapsed = time.monotonic() - started
+        if response.status_code == 429 or response.status_code >= 500:
+            self._observe(elapsed, failed=True)
+            raise LLMResponseError(f"{self.name}: LLM returned HTTP {response.status_code}",
+                                   status_code=response.status_code, retryable=True)
+        if response.status_code >= 400:
+            self._observe(elapsed, failed=True)
+            raise LLMResponseError(f"{self.name}: LLM rejected the request: "
+                                   f"HTTP {response.status_code} {response.text[:200]}",
+                                   status_code=response.status_code)
+
+        try:
+            content = response.json()["choices"][0]["message"]["content"].strip()
+        except (ValueError, KeyError, IndexError, TypeError, AttributeError) as e:
+            self._observe(elapsed, failed=True)
+            raise LLMResponseError(f"{self.name}: malformed LLM response: {e}",
+                                   status_code=response.status_code) from e
+        if not content:
+            self._observe(elapsed, failed=True)
+            raise LLMResponseError(f"{self.name}: LLM returned an empty completion",
+                                   status_code=response.status_code, retryable=True)
+
+        self._observe(elapsed)
+        return content
+
+    def stats(self) -> dict:
+        return {
+            "model": self.model,
+            "base_url": self.base_url,
+            "tier": self.tier,
+            **self.breaker.snapshot(),
+            "ewma_latency_s": round(self.ewma_latency, 4) if self.ewma_latency is not None else None,
+            "latency_p95_s": self.latency.percentile(0.95),
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "requests": self.requests,
+            "failures": self.failures,
+        }
+
+
+class LLMPool:
+    """
+    Routes each request to the fastest healthy backend, trying cheaper tiers
+    first. Tier 0 is the cheapest/fastest; higher tiers are larger models used
+    when escalating.
+    """
+
+    def __init__(self, backends):
+        if not backends:
+            raise ValueError("LLMPool needs at least one backend")
+        self.backends = list(backends)
+
+    @property
+    def max_tier(self) -> int:
+        return max(b.tier for b in self.backends)
+
+    def _candidates(self, min_tier, exclude):
+        eligible = [b for b in self.backends
+                    if b.tier >= min_tier and b not in exclude and b.breaker.state != CircuitBreaker.OPEN]
+        # Lowest eligible tier only; within it, least expected latency first
+        if not eligible:
+            return []
+        tier = min(b.tier for b in eligible)
+        return sorted((b for b in eligible if b.tier == tier), key=lambda b: b.score)
+
+    def claim(self, backend, timeout=None) -> bool:
+        """Reserve a slot on ``backend`` if it has capacity and its breaker allows a call."""
+        if not backend.try_acquire(timeout):
+            return False
+        if not backend.breaker.allow():
+            backend.release()
+            return False
+        return True
+
+    def acquire(self, min_tier=0, exclude=(), wait_timeout=None) -> LLMBackend:
+        """Reserve a slot on the best backend; blocks up to ``wait_timeout`` if all are busy."""
+        candidates = self._candidates(min_tier, exclude)
+        for backend in candidates:
+            if self.claim(backend):
+                return backend
+        if candidates and wait_timeout:
+            if self.claim(candidates[0], timeout=wait_timeout):
+                return candidates[0]
+            raise LLMUnavailableError(f"All LLM backends at tier {candidates[0].tier} are saturated",
+                                      retry_after=wait_timeout)
+        if candidates:
+            raise LLMUnavailableError("All LLM backends are saturated")
+
+        retry_after = min((b.breaker.retry_after() for b in self.backends if b.tier >= min_tier), default=None)
+        raise LLMUnavailableError(f"No healthy LLM backend at tier >= {min_tier}", retry_after=retry_after)
+
+    def stats(self) -> dict:
+        return {b.name: b.stats() for b in self.backends}
+
+
+def _backend_from_spec(spec, index):
+    api_key = spec.get("api_key") or os.getenv(spec.get("api_key_env", ""), "") or os.getenv("LLM_API_KEY", "")
+    return LLMBackend(
+        name=spec.get("name", f"backend-{index}"),
+        base_url=spec["base_url"],
+        model=spec["model"],
+        api_key=api_key,
+        chat_path=spec.get("chat_path"),
+        auth_scheme=spec.get("auth_scheme"),
+        tier=spec.get("tier", 0),
+        max_concurrency=spec.get("max_concurrency"),
+        timeout=spec.get("timeout"),
+    )
+
+
+def load_backend_specs():
+    """Backend list from LLM_BACKENDS (inline JSON or a path to a JSON file), or None."""
+    raw = Config.LLM_BACKENDS.strip()
+    if not raw:
+        return None
+    if not raw.startswith("["):
+        with open(raw, "r", encoding="utf-8") as f:
+            raw = f.read()
+    return json.loads(raw)
+
+
+_default_pool = None
+_pool_lock = threading.Lock()
+_hedge_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="llm-hedge")
+
+
+def get_default_pool() -> LLMPool:
+    """Process-wide pool so latency history and breaker state survive across requests."""
+    global _default_pool
+    with _pool_lock:
+        if _default_pool is None:
+            specs = load_backend_specs()
+            if specs:
+                backends = [_backend_from_spec(spec, i) for i, spec in enumerate(specs)]
+            else:
+                backends = [LLMBackend(
+                    name="default",
+                    base_url=os.getenv("LLM_BASE_URL", "https://api.openai.com/v1"),
+                    model=os.getenv("LLM_MODEL", "gpt-3.5-turbo"),
+                    api_key=os.getenv("LLM_API_KEY", ""),
+                )]
+            _default_pool = LLMPool(backends)
+            print(f"🤖 LLM pool: {', '.join(repr(b) for b in backends)}")
+        return _default_pool
+
+
+def llm_stats():
+    """Per-backend health, latency and load, for /metrics."""
+    return get_default_pool().stats()
+
+
+class LLMClient:
+    def __init__(self, api_key=None, base_url=None, model=None, pool=None):
+        if pool is None and (api_key or base_url or model):
+            # Explicit endpoint: a private single-backend pool
+            pool = LLMPool([LLMBackend(
+                name="explicit",
+                base_url=base_url or os.getenv("LLM_BASE_URL", "https://api.openai.com/v1"),
+                model=model or os.getenv("LLM_MODEL", "gpt-3.5-turbo"),
+                api_key=api_key or os.getenv("LLM_API_KEY", ""),
+            )])
+        self.pool = pool or get_default_pool()
+        self.max_retries = Config.LLM_MAX_RETRIES
+        self.last_backend = None
+
+    @property
+    def model(self):
+        backend = self.last_backend or self.pool.backends[0]
+        return backend.model
+
+    def can_escalate(self) -> bool:
+        """Whether a larger model tier exists above the one that last answered."""
+        return self.last_backend is not None and self.last_backend.tier < self.pool.max_tier
+
+    def _hedge_delay(self, backend):
+        """Seconds to wait before sending a duplicate request, or None to disable hedging."""
+        setting = Config.LLM_HEDGE_DELAY.strip().lower()
+        if not setting:
+            return None
+        if setting == "p95":
+            # Only hedge once there is enough history for the percentile to mean something
+            if len(backend.latency) < 20:
+                return None
+            return backend.latency.percentile(0.95)
+        return float(setting)
+
+    def _call(self, backend, messages):
+        """Run one request on a reserved backend and settle its breaker and slot."""
+        try:
+            content = backend.post(messages)
+            backend.breaker.record_success()
+            return backend, content
+        except LLMError as e:
+            if e.retryable:
+                backend.breaker.record_failure()
+            else:
+                # The upstream is healthy, the request itself was bad
+                backend.breaker.record_success()
+            raise
+        finally:
+            backend.release()
+
+    def _hedged_call(self, backend, messages, min_tier):
+        """Send the request, and a duplicate to the next-best backend if the first is slow."""
+        delay = self._hedge_delay(backend)
+        if delay is None:
+            return self._call(backend, messages)
+
+        pending = {_hedge_pool.submit(self._call, backend, messages)}
+        done, pending = wait(pending, timeout=delay)
+        if not done:
+            try:
+                hedge = self.pool.acquire(min_tier, exclude=(backend,))
+            except LLMUnavailableError:
+                # No other backend free; duplicate on the same one if it has a slot
+                hedge = backend if self.pool.claim(backend) else None
+            if hedge is not None:
+                print(f"⏱️ {backend.name} slower than {delay:.2f}s, hedging on {hedge.name}")
+                pending.add(_hedge_pool.submit(self._call, hedge, messages))
+
+        last_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    return future.result()
+                except LLMError as e:
+                    last_error = e
+        raise last_error
+
+    def generate_sql(self, prompt: str, min_tier: int = 0) -> str:
+        """
+        Call the custom LLM to generate SQL based on the provided prompt.
+        Routes to the fastest healthy backend at ``min_tier`` or above, fails
+        over and retries transient failures with jittered backoff, and raises
+        an LLMError subclass instead of returning an empty string.
+        """
+        messages = [
+            {"role": "system", "content": "You are a helpful SQL assistant."},
+            {"role": "user", "content": prompt}
+        ]
+
+        failed = []
+        for attempt in range(self.max_retries + 1):
+            try:
+                backend = self.pool.acquire(min_tier, exclude=failed,
+                                            wait_timeout=Config.LLM_POOL_WAIT_SECONDS)
+            except LLMUnavailableError:
+                if not failed:
+                    raise
+                # Every other backend is out; allow the ones that already failed once
+                failed = []
+                backend = self.pool.acquire(min_tier, wait_timeout=Config.LLM_POOL_WAIT_SECONDS)
+            try:
+                self.last_backend, content = self._hedged_call(backend, messages, min_tier)
+                return content
+            except LLMError as e:
+                print(f"❌ LLM API Error (attempt {attempt + 1}/{self.max_retries + 1}): {e}")
+                if not e.retryable or attempt == self.max_retries:
+                    raise
+                failed.append(backend)
+                time.sleep(backoff_delay(attempt, Config.LLM_BACKOFF_BASE, Config.LLM_BACKOFF_MAX))
@@ -1,4 +1,6 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 import sys
 import os
 
@@ -6,8 +8,42 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from app.router import router
+from app.jobs import get_job_queue
+from app.admission import prefetch_rate_limiter, rate_limiter, client_key
+from app.snapshots import get_snapshot_manager
 
-app = FastAPI(title="AI SQL Agent", version="1.0")
+# Endpoints that spend LLM quota are rate limited per client
+RATE_LIMITED_ROUTES = {
+    ("POST", "/ask"): rate_limiter,
+    ("POST", "/jobs"): rate_limiter,
+    ("POST", "/prefetch"): prefetch_rate_limiter,
+}
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Start job workers up front so a durable queue resumes unfinished jobs
+    get_job_queue().start()
+    snapshots = get_snapshot_manager()
+    if snapshots is not None:
+        snapshots.start()
+    yield
+    get_job_queue().stop()
+    if snapshots is not None:
+        snapshots.stop()
+
+app = FastAPI(title="AI SQL Agent", version="1.0", lifespan=lifespan)
+
+@app.middleware("http")
+async def rate_limit(request: Request, call_next):
+    limiter = RATE_LIMITED_ROUTES.get((request.method, request.url.path.rstrip("/")))
+    if limiter is not None:
+        client = client_key(request.headers, request.client.host if request.client else None)
+        retry_after = limiter.check(client)
+        if retry_after:
+            seconds = max(1, int(retry_after + 0.999))
+            return JSONResponse(status_code=429, headers={"Retry-After": str(seconds)},
+                                content={"detail": f"Rate limit exceeded, retry in {seconds}s."})
+    return await call_next(request)
 
 # Include the /ask endpoint
 app.include_router(router)
@@ -15,13 +15,43 @@ class QueryResponse(BaseModel):
     error_message: Optional[str] = None
     execution_time: Optional[float] = None
 
+class ColumnInfo(BaseModel):
+    """Model for column metadata"""
+    name: str
+    type: str = ""
+    not_null: bool = False
+    default: Optional[str] = None
+    primary_key: bool = False
+
+class ForeignKeyInfo(BaseModel):
+    """Model for a foreign key from one column to another table"""
+    column: str
+    ref_table: str
+    ref_column: Optional[str] = None
+
+class IndexInfo(BaseModel):
+    """Model for index metadata"""
+    name: str
+    unique: bool = False
+    columns: List[str]
+
 class TableInfo(BaseModel):
     """Model for table metadata"""
     table_name: str
-    columns: List[str]
+    kind: str = "table"
+    columns: List[ColumnInfo]
+    primary_key: List[str] = []
+    foreign_keys: List[ForeignKeyInfo] = []
+    indexes: List[IndexInfo] = []
+    row_count: Optional[int] = None
     description: Optional[str] = None
 
+    @property
+    def column_names(self) -> List[str]:
+        return [col.name for col in self.columns]
+
 class SchemaInfo(BaseModel):
     """Model for database schema information"""
     tables: List[TableInfo]
     total_tables: int
+    database_path: Optional[str] = None
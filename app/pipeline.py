@@ -0,0 +1,360 @@
+# The question -> SQL -> result pipeline shared by /ask and the job workers
+import sys
+import os
+import threading
+import time
+from typing import Optional
+
+from fastapi import HTTPException
+
+from app.admission import TokenBucket, llm_limiter, sql_limiter
+from app.cache import TTLCache
+from app.config import Config
+from app.llm_client import LLMClient, LLMError, LLMTimeoutError, LLMUnavailableError
+from app.prompts import build_prompt, build_repair_prompt, describe_schemas, chart_family
+from app.query_log import estimate_tokens, get_query_log, prompt_hash
+from app.result_store import get_result_store
+from app.sql_validator import validate_sql
+from app.utils import extract_sql_from_llm_response
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from retriever.query_index import retrieve_tables
+
+config = Config()
+
+# Retrieval depends only on the question; generated SQL also on the chart family
+retrieval_cache = TTLCache(config.ASK_CACHE_MAX_ENTRIES, config.ASK_CACHE_TTL_SECONDS)
+sql_cache = TTLCache(config.ASK_CACHE_MAX_ENTRIES, config.ASK_CACHE_TTL_SECONDS)
+
+# Speculative SQL from /prefetch: generations in flight (SQL key -> Event), keys they filled,
+# and a global budget of LLM calls (bursts of up to ~10s worth)
+_speculating = {}
+_speculating_lock = threading.Lock()
+_speculated = TTLCache(config.ASK_CACHE_MAX_ENTRIES, config.ASK_CACHE_TTL_SECONDS)
+_speculation_budget = TokenBucket(config.PREFETCH_LLM_PER_MINUTE / 60.0,
+                                  max(1.0, config.PREFETCH_LLM_PER_MINUTE / 6.0))
+prefetch_counters = {"requests": 0, "too_short": 0, "retrieval_warmed": 0, "retrieval_cached": 0,
+                     "sql_scheduled": 0, "sql_generated": 0, "sql_invalid": 0, "sql_failed": 0,
+                     "sql_busy": 0, "sql_over_budget": 0, "ask_hits": 0, "ask_waited": 0}
+
+
+class PipelineCancelled(Exception):
+    """The run was cancelled between or during stages."""
+
+
+class PipelineHooks:
+    """
+    Callbacks for observing and cancelling a run. The defaults do nothing;
+    background jobs override them to report progress and interrupt SQLite.
+    """
+
+    def stage(self, name: str):
+        """Called when the pipeline enters ``name``."""
+
+    def checkpoint(self):
+        """Raise PipelineCancelled to stop before the next stage."""
+
+    def on_connect(self, conn):
+        """Receives each SQLite connection used to execute the generated SQL."""
+
+
+def _question_key(question: str) -> str:
+    """Case- and whitespace-insensitive cache key for a question."""
+    return " ".join(question.lower().split())
+
+
+def llm_http_error(error: LLMError) -> HTTPException:
+    """Map LLM failures to distinct HTTP errors instead of running empty SQL."""
+    if isinstance(error, LLMUnavailableError):
+        headers = None
+        if error.retry_after:
+            headers = {"Retry-After": str(max(1, int(error.retry_after)))}
+        return HTTPException(status_code=503, detail=f"LLM unavailable: {error}", headers=headers)
+    if isinstance(error, LLMTimeoutError):
+        return HTTPException(status_code=504, detail=f"LLM timed out: {error}")
+    return HTTPException(status_code=502, detail=f"LLM error: {error}")
+
+
+def _retrieve(question_key: str, question: str):
+    """Retrieved ``(table_name, schema_text)`` list through the retrieval cache, and whether it was cached."""
+    retrieved = retrieval_cache.get(question_key)
+    if retrieved is not None:
+        return retrieved, True
+    retrieved = retrieve_tables(question)
+    if retrieved:
+        retrieval_cache.set(question_key, retrieved)
+    return retrieved, False
+
+
+def _generate_sql(llm: LLMClient, prompt: str, min_tier: int = 0, record: dict = None) -> str:
+    call = {"prompt_sha1": prompt_hash(prompt), "prompt_tokens": estimate_tokens(prompt), "min_tier": min_tier}
+    if record is not None:
+        record.setdefault("llm_calls", []).append(call)
+    started = time.perf_counter()
+    try:
+        with llm_limiter.slot():
+            raw_sql = llm.generate_sql(prompt, min_tier=min_tier)
+    except LLMError as e:
+        call["error"] = str(e)
+        raise llm_http_error(e)
+    finally:
+        call["ms"] = round((time.perf_counter() - started) * 1000, 1)
+    call["backend"] = llm.last_backend.name
+    if config.QUERY_LOG_RESPONSES:
+        call["response"] = raw_sql
+
+    # Optional: extract SQL cleanly
+    sql = extract_sql_from_llm_response(raw_sql)
+    print(f"Generated SQL ({llm.last_backend.name}): {sql}")
+    if not sql:
+        raise HTTPException(status_code=502, detail="LLM did not return any SQL.")
+    return sql
+
+
+def answer_question(question: str, chart_type: Optional[str] = None, hooks: PipelineHooks = None,
+                    context: dict = None) -> dict:
+    """
+    Retrieve schemas, generate and validate SQL, and execute its first page.
+    Returns the /ask response fields; failures raise HTTPException (or
+    PipelineCancelled when ``hooks`` cancels the run). Every run, successful
+    or not, is appended to the query log together with ``context``.
+    """
+    record = {"ts": time.time(), **(context or {}), "question": question, "chart_type": chart_type}
+    try:
+        response = _answer(question, chart_type, hooks or PipelineHooks(), record)
+        record.update(status="ok", sql=response["sql"], row_count=len(response["rows"]),
+                      has_more=response["has_more"], timings=response["timings"], cached=response["cached"])
+        return response
+    except PipelineCancelled:
+        record["status"] = "cancelled"
+        raise
+    except HTTPException as e:
+        record.update(status="error", status_code=e.status_code, error=str(e.detail))
+        raise
+    except Exception as e:
+        record.update(status="error", status_code=500, error=str(e))
+        raise
+    finally:
+        query_log = get_query_log()
+        if query_log:
+            record["prompt_tokens"] = sum(call["prompt_tokens"] for call in record.get("llm_calls", []))
+            query_log.write(record)
+
+
+def _answer(question: str, chart_type: Optional[str], hooks: PipelineHooks, record: dict) -> dict:
+    user_question = question.strip()
+    started = time.perf_counter()
+    timings = {"retrieval_ms": 0.0, "llm_ms": 0.0, "validation_ms": 0.0, "execution_ms": 0.0}
+    record["timings"] = timings
+
+    def elapsed_ms(since: float) -> float:
+        return (time.perf_counter() - since) * 1000
+
+    if not user_question:
+        raise HTTPException(status_code=400, detail="Question cannot be empty.")
+
+    question_key = _question_key(user_question)
+    sql_key = (question_key, chart_family(chart_type))
+
+    # Step 1: Retrieve relevant table schemas from FAISS (cached per question, whatever the chart)
+    hooks.stage("retrieval")
+    stage = time.perf_counter()
+    retrieved, retrieval_cached = _retrieve(question_key, user_question)
+    cached = {"retrieval": retrieval_cached, "sql": False}
+    timings["retrieval_ms"] += elapsed_ms(stage)
+    record["cached"] = cached
+    record["retrieved_tables"] = [table_name for table_name, _ in retrieved or []]
+    if not retrieved:
+        raise HTTPException(status_code=404, detail="No relevant tables found.")
+
+    # Step 2: Build LLM prompt with column types and keys from the schema catalog
+    retrieved = describe_schemas(retrieved)
+
+    # Step 3: Call LLM (cheapest tier first), unless this question already has SQL for this chart shape
+    llm = LLMClient()
+    sql = sql_cache.get(sql_key)
+    if sql is None:
+        # A /prefetch for this question may already be generating it
+        with _speculating_lock:
+            pending = _speculating.get(sql_key)
+        if pending is not None:
+            hooks.stage("generation")
+            stage = time.perf_counter()
+            prefetch_counters["ask_waited"] += 1
+            if pending.wait(config.PREFETCH_WAIT_SECONDS):
+                sql = sql_cache.get(sql_key)
+            timings["llm_ms"] += elapsed_ms(stage)
+    if sql is not None:
+        cached["sql"] = True
+        if _speculated.pop(sql_key):
+            cached["prefetched"] = True
+            prefetch_counters["ask_hits"] += 1
+    else:
+        hooks.checkpoint()
+        hooks.stage("generation")
+        prompt = build_prompt(user_question, retrieved, chart_type)
+        stage = time.perf_counter()
+        sql = _generate_sql(llm, prompt, record=record)
+        timings["llm_ms"] += elapsed_ms(stage)
+
+    # Step 4: Validate locally, then run SQL on SQLite. Failures get a bounded
+    # repair round-trip with the error fed back, then one escalation to a larger tier.
+    # Results are held server-side; only the first page is executed here.
+    store = get_result_store()
+    repairs = 0
+    escalations = 0
+    while True:
+        hooks.checkpoint()
+        hooks.stage("validation")
+        record["sql"] = sql
+        stage = time.perf_counter()
+        error = validate_sql(sql) if config.SQL_VALIDATION else None
+        timings["validation_ms"] += elapsed_ms(stage)
+        status_code = 422
+        if error is None:
+            hooks.checkpoint()
+            hooks.stage("execution")
+            stage = time.perf_counter()
+            with sql_limiter.slot():
+                result = store.create(sql, user_question)
+                columns, rows_or_error, next_cursor = store.fetch_page(result, on_connect=hooks.on_connect)
+            timings["execution_ms"] += elapsed_ms(stage)
+            if not isinstance(rows_or_error, str):
+                sql_cache.set(sql_key, sql)
+                break
+            store.discard(result.handle)
+            error, status_code = rows_or_error, 500
+        record.setdefault("sql_errors", []).append(error)
+
+        # An interrupted query is a cancellation, not something to repair
+        hooks.checkpoint()
+
+        # Cached SQL that no longer works (e.g. schema changed) is regenerated from scratch
+        if cached["sql"]:
+            sql_cache.pop(sql_key)
+            cached["sql"] = False
+            hooks.stage("generation")
+            stage = time.perf_counter()
+            sql = _generate_sql(llm, build_prompt(user_question, retrieved, chart_type), record=record)
+            timings["llm_ms"] += elapsed_ms(stage)
+            continue
+
+        tier = llm.last_backend.tier
+        if repairs < config.SQL_REPAIR_ATTEMPTS:
+            repairs += 1
+        elif llm.can_escalate() and escalations < config.LLM_MAX_ESCALATIONS:
+            escalations += 1
+            tier += 1
+        else:
+            raise HTTPException(status_code=status_code, detail=error)
+
+        print(f"🔧 Repairing SQL on tier {tier}: {error}")
+        hooks.stage("repair")
+        repair_prompt = build_repair_prompt(user_question, retrieved, sql, error, chart_type)
+        stage = time.perf_counter()
+        sql = _generate_sql(llm, repair_prompt, min_tier=tier, record=record)
+        timings["llm_ms"] += elapsed_ms(stage)
+
+    timings = {name: round(ms, 1) for name, ms in timings.items()}
+    timings.update(repairs=repairs + escalations, total_ms=round(elapsed_ms(started), 1))
+    return {
+        "sql": sql,
+        "columns": columns,
+        "rows": rows_or_error,
+        "result_handle": result.handle,
+        "next_cursor": next_cursor,
+        "has_more": next_cursor is not None,
+        "truncated": result.truncated,
+        "timings": timings,
+        "cached": cached,
+    }
+
+
+def _reserve_speculation(sql_key) -> str:
+    """Claim a speculative generation for ``sql_key``; returns "scheduled" or why not."""
+    if not config.PREFETCH_SQL or config.PREFETCH_LLM_PER_MINUTE <= 0:
+        return "disabled"
+    if sql_key in sql_cache:
+        return "cached"
+    with _speculating_lock:
+        if sql_key in _speculating:
+            return "in_progress"
+        # Never queue behind, or take capacity from, questions someone is waiting for
+        if llm_limiter.in_flight + llm_limiter.waiting >= llm_limiter.limit:
+            prefetch_counters["sql_busy"] += 1
+            return "busy"
+        if _speculation_budget.take(time.monotonic()):
+            prefetch_counters["sql_over_budget"] += 1
+            return "over_budget"
+        _speculating[sql_key] = threading.Event()
+    prefetch_counters["sql_scheduled"] += 1
+    return "scheduled"
+
+
+def prefetch(question: str, chart_type: Optional[str] = None, generate_sql: bool = True) -> dict:
+    """
+    Warm the caches /ask reads for a question that is still being typed.
+    Retrieval runs now; when ``generate_sql`` is set and the speculative
+    budget allows, ``sql`` is "scheduled" and the caller must run
+    ``speculate_sql`` (e.g. as a background task).
+    """
+    prefetch_counters["requests"] += 1
+    user_question = question.strip()
+    if len(user_question) < config.PREFETCH_MIN_CHARS:
+        prefetch_counters["too_short"] += 1
+        return {"retrieval": "skipped", "sql": "skipped", "tables": []}
+
+    question_key = _question_key(user_question)
+    retrieved, retrieval_cached = _retrieve(question_key, user_question)
+    prefetch_counters["retrieval_cached" if retrieval_cached else "retrieval_warmed"] += 1
+    result = {"retrieval": "cached" if retrieval_cached else "warmed",
+              "tables": [table_name for table_name, _ in retrieved or []]}
+    if not retrieved:
+        result["sql"] = "skipped"
+    elif not generate_sql:
+        result["sql"] = "disabled"
+    else:
+        result["sql"] = _reserve_speculation((question_key, chart_family(chart_type)))
+    return result
+
+
+def speculate_sql(question: str, chart_type: Optional[str] = None):
+    """
+    Generate and validate SQL for a prefetch reserved by ``prefetch`` and put
+    it in the SQL cache. The SQL is not executed; if it fails when /ask runs
+    it, /ask regenerates it like any stale cached SQL.
+    """
+    user_question = question.strip()
+    question_key = _question_key(user_question)
+    sql_key = (question_key, chart_family(chart_type))
+    try:
+        retrieved, _ = _retrieve(question_key, user_question)
+        if not retrieved:
+            return
+        prompt = build_prompt(user_question, describe_schemas(retrieved), chart_type)
+        sql = _generate_sql(LLMClient(), prompt)
+        error = validate_sql(sql) if config.SQL_VALIDATION else None
+        if error is not None:
+            prefetch_counters["sql_invalid"] += 1
+            return
+        sql_cache.set(sql_key, sql)
+        _speculated.set(sql_key, True)
+        prefetch_counters["sql_generated"] += 1
+    except Exception as e:
+        prefetch_counters["sql_failed"] += 1
+        print(f"⚠️ Speculative SQL for {user_question!r} failed: {getattr(e, 'detail', e)}")
+    finally:
+        with _speculating_lock:
+            done = _speculating.pop(sql_key, None)
+        if done is not None:
+            done.set()
+
+
+def prefetch_stats() -> dict:
+    with _speculating_lock:
+        in_flight = len(_speculating)
+    return {
+        "enabled": config.PREFETCH_SQL and config.PREFETCH_LLM_PER_MINUTE > 0,
+        "llm_per_minute": config.PREFETCH_LLM_PER_MINUTE,
+        "in_flight": in_flight,
+        **prefetch_counters,
+    }
@@ -1,8 +1,41 @@
-from typing import List, Tuple
+from typing import List, Optional, Tuple
+from app.schema_catalog import get_table, describe_table
+
+# Blanket row cap requested from the LLM; larger results are paged server-side
+MAX_RESULT_ROWS = 100
 
 # 🔧 This is your system instruction to guide the LLM
 SYSTEM_INSTRUCTION = "You are a SQL lite assistant. Given the following table schemas and a question, generate a correct SQLlite query."
 
+# Dashboard chart types grouped by the result shape they need
+CHART_FAMILIES = {
+    "category": {"Bar Chart", "Pie Chart", "Donut Chart", "Treemap", "Sunburst", "Waterfall Chart"},
+    "series": {"Line Chart", "Area Chart"},
+    "scatter": {"Scatter Plot"},
+    "distribution": {"Histogram", "Box Plot", "Violin Plot"},
+    "matrix": {"Heatmap"},
+}
+
+# Result-shape instruction added to the prompt for each chart family
+CHART_HINTS = {
+    "category": "Return a label column first and one aggregated numeric value column second.",
+    "series": "Return an ordered x column (date or number) first and a numeric y column second, ordered by x.",
+    "scatter": "Return two numeric columns (x, y) and optionally a label column, one row per item.",
+    "distribution": "Return one row per item with the raw (not aggregated) numeric values.",
+    "matrix": "Return several numeric columns, or two category columns to count combinations of.",
+}
+
+def chart_family(chart_type: Optional[str]) -> Optional[str]:
+    """Shape family for a dashboard chart type; None for tables and unknown types."""
+    for family, chart_types in CHART_FAMILIES.items():
+        if chart_type in chart_types:
+            return family
+    return None
+
+def _chart_hint_line(chart_type: Optional[str]) -> str:
+    family = chart_family(chart_type)
+    return f"\n-- {CHART_HINTS[family]}" if family else ""
+
 def format_schema_block(table_schemas: List[Tuple[str, str]]) -> str:
     """
     Takes a list of (table_name, schema_text) and formats into LLM-readable form.
@@ -18,9 +51,25 @@ def format_schema_block(table_schemas: List[Tuple[str, str]]) -> str:
         result += f"-- Table: {table_name}\n{schema_text.strip()}\n\n"
     return result.strip()
 
-def build_prompt(user_question: str, table_schemas: List[Tuple[str, str]]) -> str:
+def describe_schemas(table_schemas: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    """
+    Replaces the retrieved schema text with column types, keys and row counts
+    from the schema catalog, keeping the original text for unknown tables.
+    """
+    described = []
+    for table_name, schema_text in table_schemas:
+        try:
+            table = get_table(table_name)
+        except Exception:
+            table = None
+        described.append((table_name, describe_table(table) if table else schema_text))
+    return described
+
+def build_prompt(user_question: str, table_schemas: List[Tuple[str, str]],
+                 chart_type: Optional[str] = None) -> str:
     """
     Combines the system instruction, table schemas, and user question into a final LLM prompt.
+    ``chart_type`` only adds a result-shape hint; it never changes the question text.
     """
     schema_section = format_schema_block(table_schemas)
 
@@ -35,10 +84,37 @@ def build_prompt(user_question: str, table_schemas: List[Tuple[str, str]]) -> st
 
 -- Never returns id's or primary keys in the result unless explicitly asked.
 
--- Always use LIMIT 100 to avoid large results.
+-- Always use LIMIT {MAX_RESULT_ROWS} to avoid large results.
 -- Always return the quantitative results.
 -- Always return Name as including first_name and last_name.
--- Never return more than 100 rows.
+-- Never return more than {MAX_RESULT_ROWS} rows.{_chart_hint_line(chart_type)}
+```sql
+"""
+    return prompt
+
+def build_repair_prompt(user_question: str, table_schemas: List[Tuple[str, str]],
+                        failed_sql: str, error_message: str, chart_type: Optional[str] = None) -> str:
+    """
+    Asks the LLM to fix a query that failed validation or execution, feeding back the error.
+    """
+    schema_section = format_schema_block(table_schemas)
+
+    prompt = f"""{SYSTEM_INSTRUCTION}
+
+{schema_section}
+
+-- User Question:
+{user_question}
+
+-- This query was generated for the question but is invalid:
+```sql
+{failed_sql.strip()}
+```
+
+-- SQLite reported:
+-- {error_message.strip()}
+
+-- Write only the corrected SQL query. Use only the tables and columns listed above. Do not explain.{_chart_hint_line(chart_type)}
 ```sql
 """
     return prompt
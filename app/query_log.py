@@ -0,0 +1,68 @@
+# Structured, rotating JSONL log of every answered question
+import hashlib
+import json
+import logging
+import os
+import time
+from logging.handlers import RotatingFileHandler
+from typing import Optional
+
+from .config import Config
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token), enough for sizing prompts."""
+    return max(1, round(len(text) / 4)) if text else 0
+
+
+def prompt_hash(prompt: str) -> str:
+    """Stable key used to match recorded LLM responses to prompts on replay."""
+    return hashlib.sha1(prompt.encode("utf-8")).hexdigest()
+
+
+class QueryLog:
+    """
+    Appends one JSON object per line and rotates the file at ``max_bytes``,
+    keeping ``backups`` old files (``queries.123.jsonl.1``, ``.2``, ...). A
+    ``{pid}`` placeholder in the path gives each worker process its own file;
+    without it, only run a single process, as rotation is not multi-process safe.
+    """
+
+    def __init__(self, path: str, max_bytes: int = None, backups: int = None):
+        self.path = path.replace("{pid}", str(os.getpid()))
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        handler = RotatingFileHandler(self.path, encoding="utf-8",
+                                      maxBytes=max_bytes if max_bytes is not None else Config.QUERY_LOG_MAX_BYTES,
+                                      backupCount=backups if backups is not None else Config.QUERY_LOG_BACKUPS)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        self._logger = logging.getLogger(f"ai_insight.query_log.{self.path}")
+        self._logger.propagate = False
+        self._logger.setLevel(logging.INFO)
+        self._logger.handlers = [handler]
+        self.records = 0
+        self.errors = 0
+
+    def write(self, record: dict):
+        record.setdefault("ts", time.time())
+        try:
+            self._logger.info(json.dumps(record, default=str, ensure_ascii=False))
+            self.records += 1
+        except Exception as e:
+            self.errors += 1
+            print(f"⚠️ Could not write query log record: {e}")
+
+    def stats(self) -> dict:
+        return {"path": self.path, "records": self.records, "errors": self.errors}
+
+
+_query_log = None
+
+
+def get_query_log() -> Optional[QueryLog]:
+    """The process-wide query log, or None when QUERY_LOG_PATH is empty."""
+    global _query_log
+    if _query_log is None and Config.QUERY_LOG_PATH:
+        _query_log = QueryLog(Config.QUERY_LOG_PATH)
+    return _query_log
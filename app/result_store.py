@@ -0,0 +1,125 @@
+# Server-side result handles with cursor-based pagination over held rows
+import base64
+import json
+import re
+import threading
+import uuid
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from .cache import TTLCache
+from .config import Config
+from .prompts import MAX_RESULT_ROWS
+from .sqlite_client import run_query
+
+# The blanket row cap the prompt asks for; paging replaces it, explicit LIMITs are kept
+_PROMPT_LIMIT = re.compile(rf"\s+LIMIT\s+{MAX_RESULT_ROWS}\s*;?\s*$", re.IGNORECASE)
+_ASKED_FOR_LIMIT = re.compile(rf"\b{MAX_RESULT_ROWS}\b")
+
+
+class InvalidCursorError(ValueError):
+    """Cursor token is malformed or belongs to another result handle."""
+
+
+@dataclass
+class StoredResult:
+    handle: str
+    sql: str
+    columns: List[str] = field(default_factory=list)
+    # Rows held after the first fetch; pages are slices of them
+    rows: Optional[list] = None
+    truncated: bool = False
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+
+def pageable_sql(sql: str, question: str = None) -> str:
+    """
+    Strip the trailing semicolon and the prompt's blanket LIMIT so the full
+    result can be paged. The LIMIT is kept when the question itself asked for
+    that many rows ("top 100 ...").
+    """
+    sql = sql.strip()
+    if not (question and _ASKED_FOR_LIMIT.search(question)):
+        sql = _PROMPT_LIMIT.sub("", sql)
+    return sql.rstrip().rstrip(";").rstrip()
+
+
+def encode_cursor(handle: str, last_row: int) -> str:
+    raw = json.dumps({"h": handle, "r": last_row}, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(handle: str, cursor: Optional[str]) -> int:
+    """Position in the held rows where the next page starts (0 for the first page)."""
+    if not cursor:
+        return 0
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        last_row = int(data["r"])
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidCursorError(f"Malformed cursor: {e}") from e
+    if data.get("h") != handle or last_row < 0:
+        raise InvalidCursorError("Cursor does not belong to this result")
+    return last_row
+
+
+class ResultStore:
+    """Bounded, TTL-evicted store of result handles -> cached SQL and its held rows."""
+
+    def __init__(self, maxsize: int = None, ttl: float = None):
+        self._cache = TTLCache(maxsize or Config.RESULT_STORE_MAX_ENTRIES,
+                               ttl or Config.RESULT_STORE_TTL_SECONDS)
+
+    def create(self, sql: str, question: str = None) -> StoredResult:
+        result = StoredResult(handle=uuid.uuid4().hex, sql=pageable_sql(sql, question))
+        self._cache.set(result.handle, result)
+        return result
+
+    def get(self, handle: str) -> Optional[StoredResult]:
+        return self._cache.get(handle)
+
+    def discard(self, handle: str):
+        self._cache.pop(handle)
+
+    def fetch_page(self, result: StoredResult, cursor: Optional[str] = None, page_size: int = None,
+                   on_connect=None):
+        """
+        Returns (columns, rows, next_cursor) for one page, or ([], error_message, None)
+        if the SQL fails, mirroring run_query.
+
+        The first fetch runs the statement once, unchanged (its ORDER BY and
+        column names are kept), and holds up to RESULT_MAX_ROWS rows; the cursor
+        is a position in those rows. Later pages are slices: no SQL, no LLM, and
+        stable even if the database changes in between.
+        """
+        page_size = max(1, min(page_size or Config.RESULT_PAGE_SIZE, Config.RESULT_PAGE_SIZE_MAX))
+        after_row = decode_cursor(result.handle, cursor)
+        with result._lock:
+            if result.rows is None:
+                max_rows = Config.RESULT_MAX_ROWS
+                columns, rows_or_error = run_query(result.sql, on_connect=on_connect, limit=max_rows + 1)
+                if isinstance(rows_or_error, str):
+                    return [], rows_or_error, None
+                result.columns = columns
+                result.truncated = len(rows_or_error) > max_rows
+                result.rows = rows_or_error[:max_rows]
+
+        rows = result.rows[after_row:after_row + page_size]
+        next_cursor = None
+        if after_row + page_size < len(result.rows):
+            next_cursor = encode_cursor(result.handle, after_row + page_size)
+        return result.columns, rows, next_cursor
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+
+_store = None
+
+
+def get_result_store() -> ResultStore:
+    global _store
+    if _store is None:
+        _store = ResultStore()
+    return _store
@@ -1,53 +1,226 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from app.llm_client import LLMClient
-from app.prompts import build_prompt
-from app.sqlite_client import run_query
+from typing import Optional
+from app.llm_client import llm_stats
+from app.models import SchemaInfo
+from app.schema_catalog import get_schema_catalog
+from app.result_store import get_result_store, InvalidCursorError
+from app.chart_data import build_chart_data, ChartDataError
+from app.pipeline import answer_question, prefetch, prefetch_stats, retrieval_cache, speculate_sql, sql_cache
+from app.admission import admission_stats, client_key, sql_limiter
+from app.query_log import get_query_log
+from app.snapshots import get_snapshot_manager
+from app.jobs import Job, JobQueueFullError, get_job_queue
+from app.config import Config
+import json
+import sqlite3
 import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
-from retriever.query_index import retrieve_tables
+from retriever.query_index import batching_stats
 
 router = APIRouter()
+config = Config()
 
 # Request body model
 class AskRequest(BaseModel):
     question: str
+    # Dashboard chart the answer is for; shapes the SQL without changing the question
+    chart_type: Optional[str] = None
 
 # Response model
 class AskResponse(BaseModel):
     sql: str
     columns: list
     rows: list
+    result_handle: Optional[str] = None
+    next_cursor: Optional[str] = None
+    has_more: bool = False
+    truncated: bool = False
+    timings: dict = {}
+    cached: dict = {}
+
+# Warm-up for a question still being typed; generate_sql=False only warms retrieval
+class PrefetchRequest(AskRequest):
+    generate_sql: bool = True
+
+# What /prefetch did: retrieval cached|warmed|skipped; sql scheduled, cached, in_progress,
+# busy, over_budget, disabled or skipped
+class PrefetchResponse(BaseModel):
+    retrieval: str
+    sql: str
+    tables: list = []
+
+# Background job submission: an /ask request plus a priority (higher runs first)
+class JobRequest(AskRequest):
+    priority: int = 0
+
+# Job state; ``result`` holds the /ask response once the job succeeds
+class JobStatus(BaseModel):
+    job_id: str
+    status: str
+    stage: Optional[str] = None
+    priority: int = 0
+    question: str
+    chart_type: Optional[str] = None
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+    status_code: Optional[int] = None
+    result: Optional[AskResponse] = None
+
+# Further pages of a stored result
+class ResultPage(BaseModel):
+    result_handle: str
+    columns: list
+    rows: list
+    next_cursor: Optional[str] = None
+    has_more: bool = False
+    truncated: bool = False
+
+# Chart-ready, server-reduced data for a stored result
+class ChartResponse(BaseModel):
+    result_handle: str
+    chart_type: str
+    columns: list
+    rows: list
+    index: Optional[list] = None
+    method: str
+    source_rows: int
+    extra: dict = {}
 
 # FastAPI route
 @router.post("/ask", response_model=AskResponse)
-def ask_question(req: AskRequest):
-    user_question = req.question.strip()
+def ask_question(req: AskRequest, request: Request):
+    client = client_key(request.headers, request.client.host if request.client else None)
+    return AskResponse(**answer_question(req.question, req.chart_type,
+                                         context={"source": "ask", "client": client}))
+
+
+@router.post("/prefetch", response_model=PrefetchResponse)
+def prefetch_question(req: PrefetchRequest, background_tasks: BackgroundTasks):
+    """Warm retrieval (and speculative SQL) so the later /ask for this question is served from cache."""
+    result = prefetch(req.question, req.chart_type, req.generate_sql)
+    if result["sql"] == "scheduled":
+        background_tasks.add_task(speculate_sql, req.question, req.chart_type)
+    return result
 
-    if not user_question:
+
+@router.post("/jobs", response_model=JobStatus, status_code=202)
+def submit_job(req: JobRequest, request: Request):
+    """Queue a question for background execution; poll /jobs/{id} or stream /jobs/{id}/events."""
+    if not req.question.strip():
         raise HTTPException(status_code=400, detail="Question cannot be empty.")
+    try:
+        client = client_key(request.headers, request.client.host if request.client else None)
+        job = get_job_queue().submit(req.question, req.chart_type, req.priority, client=client)
+    except JobQueueFullError as e:
+        raise HTTPException(status_code=503, detail=f"Job queue is full: {e}",
+                            headers={"Retry-After": "5"})
+    return job.to_dict()
+
+
+def _get_job(job_id: str) -> Job:
+    job = get_job_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired.")
+    return job
+
+
+@router.get("/jobs/{job_id}", response_model=JobStatus)
+def get_job(job_id: str):
+    return _get_job(job_id).to_dict()
+
+
+@router.get("/jobs/{job_id}/events")
+def stream_job(job_id: str):
+    """Server-sent events with the job's status after every change, ending when it finishes."""
+    job = _get_job(job_id)
 
-    # Step 1: Retrieve relevant table schemas from FAISS
-    retrieved = retrieve_tables(user_question)
-    if not retrieved:
-        raise HTTPException(status_code=404, detail="No relevant tables found.")
+    def events():
+        version = None
+        while True:
+            if job.version != version:
+                version = job.version
+                yield f"event: status\ndata: {json.dumps(job.to_dict(), default=str)}\n\n"
+                if job.finished:
+                    return
+            elif job.wait(version, timeout=15) == version:
+                yield ": keep-alive\n\n"
 
-    # Step 2: Build LLM prompt
-    prompt = build_prompt(user_question, retrieved)
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
 
-    # Step 3: Call LLM
-    llm = LLMClient()
-    raw_sql = llm.generate_sql(prompt)
 
-    # Optional: extract SQL cleanly
-    from app.utils import extract_sql_from_llm_response
-    sql = extract_sql_from_llm_response(raw_sql)
-    print(f"Generated SQL: {sql}")
+@router.delete("/jobs/{job_id}", response_model=JobStatus)
+def cancel_job(job_id: str):
+    """Cancel a queued job or interrupt a running one (including its SQLite query)."""
+    _get_job(job_id)
+    return get_job_queue().cancel(job_id).to_dict()
 
-    # Step 4: Run SQL on SQLite
-    columns, rows_or_error = run_query(sql)
-    if isinstance(rows_or_error, str):  # error message
+
+@router.get("/results/{handle}", response_model=ResultPage)
+def get_result_page(handle: str, cursor: Optional[str] = None, page_size: Optional[int] = None):
+    """Next page of a stored /ask result, sliced from the rows held for its handle."""
+    store = get_result_store()
+    result = store.get(handle)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Result handle not found or expired.")
+    try:
+        with sql_limiter.slot():
+            columns, rows_or_error, next_cursor = store.fetch_page(result, cursor, page_size)
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if isinstance(rows_or_error, str):
         raise HTTPException(status_code=500, detail=rows_or_error)
+    return ResultPage(result_handle=handle, columns=columns, rows=rows_or_error,
+                      next_cursor=next_cursor, has_more=next_cursor is not None, truncated=result.truncated)
+
+
+@router.get("/results/{handle}/chart", response_model=ChartResponse)
+def get_chart_data(handle: str, chart_type: str, max_points: Optional[int] = None):
+    """
+    Aggregate or downsample a stored result for ``chart_type`` on the server
+    (top-N GROUP BY, histogram bins, LTTB, grid thinning, correlation) so the
+    dashboard only receives the points it draws.
+    """
+    result = get_result_store().get(handle)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Result handle not found or expired.")
+    max_points = max(2, min(max_points or config.CHART_MAX_POINTS, config.CHART_MAX_POINTS_LIMIT))
+    try:
+        with sql_limiter.slot():
+            chart = build_chart_data(result, chart_type, max_points)
+    except ChartDataError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return ChartResponse(result_handle=handle, chart_type=chart.chart_type, columns=chart.columns,
+                         rows=chart.rows, index=chart.index, method=chart.method,
+                         source_rows=chart.source_rows, extra=chart.extra)
+
+
+@router.get("/schema", response_model=SchemaInfo)
+def get_schema():
+    """Tables, columns, keys, indexes and approximate row counts (cached until the DB changes)."""
+    try:
+        return get_schema_catalog()
+    except (OSError, sqlite3.Error) as e:
+        raise HTTPException(status_code=500, detail=f"Could not read database schema: {e}")
+
 
-    return AskResponse(sql=sql, columns=columns, rows=rows_or_error)
+@router.get("/metrics")
+def get_metrics():
+    """Runtime counters for monitoring."""
+    return {
+        "embedding_batcher": batching_stats(),
+        "llm": llm_stats(),
+        "result_store": get_result_store().stats(),
+        "retrieval_cache": retrieval_cache.stats(),
+        "sql_cache": sql_cache.stats(),
+        "prefetch": prefetch_stats(),
+        "jobs": get_job_queue().stats(),
+        "admission": admission_stats(),
+        "query_log": get_query_log().stats() if get_query_log() else None,
+        "snapshots": get_snapshot_manager().stats() if get_snapshot_manager() else None,
+    }
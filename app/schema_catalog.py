@@ -0,0 +1,146 @@
+# Cached schema catalog shared by the index builder, prompts, validator and /schema
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+
+from .config import Config
+from .models import ColumnInfo, ForeignKeyInfo, IndexInfo, SchemaInfo, TableInfo
+from .sqlite_client import connect_readonly
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _file_signature(db_path: str) -> tuple:
+    """mtime/size of the database and its WAL, which changes before a checkpoint does."""
+    signature = []
+    for path in (db_path, db_path + "-wal"):
+        try:
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+
+def _quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def _row_counts(conn: sqlite3.Connection, tables: List[str]) -> Dict[str, Optional[int]]:
+    """Approximate row counts from sqlite_stat1 (ANALYZE), falling back to MAX(rowid)."""
+    counts = {}
+    try:
+        for tbl, stat in conn.execute("SELECT tbl, stat FROM sqlite_stat1"):
+            if stat:
+                rows = int(stat.split()[0])
+                counts[tbl] = max(rows, counts.get(tbl, 0))
+    except sqlite3.Error:
+        pass  # no sqlite_stat1 until ANALYZE has run
+
+    for table in tables:
+        if table in counts:
+            continue
+        try:
+            # O(log n) estimate for rowid tables; exact unless rows were deleted
+            counts[table] = conn.execute(f"SELECT MAX(rowid) FROM {_quote(table)}").fetchone()[0] or 0
+        except sqlite3.Error:
+            counts[table] = None  # WITHOUT ROWID tables
+    return counts
+
+
+def introspect(db_path: str) -> SchemaInfo:
+    """Read tables, columns, keys, indexes and approximate row counts from SQLite."""
+    conn = connect_readonly(db_path)
+    try:
+        objects = conn.execute(
+            "SELECT name, type FROM sqlite_master WHERE type IN ('table', 'view') "
+            "AND name NOT LIKE 'sqlite_%' ORDER BY name").fetchall()
+        counts = _row_counts(conn, [name for name, kind in objects if kind == "table"])
+
+        infos = []
+        for table, kind in objects:
+            quoted = _quote(table)
+            # cid, name, type, notnull, dflt_value, pk
+            cols = conn.execute(f"PRAGMA table_info({quoted})").fetchall()
+            columns = [ColumnInfo(name=c[1], type=c[2] or "", not_null=bool(c[3]),
+                                  default=None if c[4] is None else str(c[4]), primary_key=c[5] > 0)
+                       for c in cols]
+            primary_key = [c[1] for c in sorted((c for c in cols if c[5] > 0), key=lambda c: c[5])]
+
+            # id, seq, table, from, to, on_update, on_delete, match
+            foreign_keys = [ForeignKeyInfo(column=fk[3], ref_table=fk[2], ref_column=fk[4])
+                            for fk in conn.execute(f"PRAGMA foreign_key_list({quoted})")]
+
+            indexes = []
+            # seq, name, unique, origin, partial
+            for idx in conn.execute(f"PRAGMA index_list({quoted})").fetchall():
+                idx_cols = [r[2] for r in conn.execute(f"PRAGMA index_info({_quote(idx[1])})") if r[2]]
+                indexes.append(IndexInfo(name=idx[1], unique=bool(idx[2]), columns=idx_cols))
+
+            infos.append(TableInfo(table_name=table, kind=kind, columns=columns, primary_key=primary_key,
+                                   foreign_keys=foreign_keys, indexes=indexes, row_count=counts.get(table)))
+    finally:
+        conn.close()
+
+    return SchemaInfo(tables=infos, total_tables=len(infos), database_path=db_path)
+
+
+def get_schema_catalog(db_path: str = None) -> SchemaInfo:
+    """Catalog for ``db_path``, introspected once and reused until the file changes."""
+    db_path = os.path.abspath(db_path or Config.DATABASE_PATH)
+    signature = _file_signature(db_path)
+    with _cache_lock:
+        cached = _cache.get(db_path)
+        if cached and cached[0] == signature:
+            return cached[1]
+
+    catalog = introspect(db_path)
+    with _cache_lock:
+        _cache[db_path] = (signature, catalog)
+    return catalog
+
+
+def table_map(catalog: SchemaInfo) -> Dict[str, TableInfo]:
+    """Lower-cased table name -> TableInfo."""
+    return {t.table_name.lower(): t for t in catalog.tables}
+
+
+def get_table(table_name: str, db_path: str = None) -> Optional[TableInfo]:
+    return table_map(get_schema_catalog(db_path)).get(table_name.lower())
+
+
+def schema_text(table: TableInfo) -> str:
+    """Compact text embedded into the vector index."""
+    return f"Table: {table.table_name} | Columns: {', '.join(table.column_names)}"
+
+
+def describe_table(table: TableInfo) -> str:
+    """Column types, keys and size, for the LLM prompt."""
+    columns = []
+    for col in table.columns:
+        text = f"{col.name} {col.type}".strip()
+        if col.primary_key:
+            text += " PK"
+        columns.append(text)
+    lines = [", ".join(columns)]
+    for fk in table.foreign_keys:
+        lines.append(f"FK {fk.column} -> {fk.ref_table}.{fk.ref_column or fk.column}")
+    if table.row_count is not None:
+        lines.append(f"~{table.row_count} rows")
+    return "\n".join(lines)
+
+
+def foreign_key_neighbors(table_name: str, db_path: str = None) -> List[str]:
+    """Tables joined to ``table_name`` by a foreign key in either direction."""
+    catalog = get_schema_catalog(db_path)
+    name = table_name.lower()
+    neighbors = []
+    for table in catalog.tables:
+        if table.table_name.lower() == name:
+            neighbors.extend(fk.ref_table for fk in table.foreign_keys)
+        elif any(fk.ref_table.lower() == name for fk in table.foreign_keys):
+            neighbors.append(table.table_name)
+    seen = set()
+    return [t for t in neighbors if not (t.lower() in seen or seen.add(t.lower()))]
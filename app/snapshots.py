@@ -0,0 +1,315 @@
+# Read-only snapshots of the SQLite database so analytic queries never contend with writers
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+
+from .config import Config
+
+MODES = ("file", "memory", "auto")
+MAX_BACKUP_PASSES = 3
+
+
+class _BackupRestarted(Exception):
+    pass
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True  # exists but belongs to someone else, or cannot be checked here
+    return True
+
+
+class Snapshot:
+    """
+    One consistent copy of the source database. File snapshots are opened
+    ``immutable`` (no locking at all); memory snapshots are a shared-cache
+    in-memory database kept alive by ``_keeper``.
+    """
+
+    def __init__(self, snapshot_id: int, uri: str, kind: str, source_signature: tuple, size_bytes: int,
+                 path: str = None, keeper: sqlite3.Connection = None):
+        self.id = snapshot_id
+        self.uri = uri
+        self.kind = kind
+        self.path = path
+        self.source_signature = source_signature
+        self.size_bytes = size_bytes
+        self.created_at = time.time()
+        self.readers = 0
+        self._keeper = keeper
+
+    def connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.uri, uri=True)
+        if self.kind == "memory":
+            conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    def discard(self):
+        """Free the copy; called once it is retired and has no readers."""
+        if self._keeper is not None:
+            self._keeper.close()
+            self._keeper = None
+        if self.path:
+            try:
+                os.remove(self.path)
+            except OSError as e:
+                print(f"⚠️ Could not remove snapshot {self.path}: {e}")
+
+
+class SnapshotManager:
+    """
+    Keeps a periodically refreshed, read-only copy of ``source`` made with
+    SQLite's online backup API, and hands out connections to the newest one.
+    A refresh builds the next copy off to the side and swaps it in under a
+    lock; older copies are discarded once their last reader closes.
+    """
+
+    def __init__(self, source: str = None, mode: str = None, directory: str = None,
+                 refresh_seconds: float = None, memory_max_mb: float = None, backup_pages: int = None):
+        self.source = os.path.abspath(source or Config.DATABASE_PATH)
+        self.mode = (mode or Config.SNAPSHOT_MODE).lower()
+        if self.mode not in MODES:
+            raise ValueError(f"Unknown SNAPSHOT_MODE {self.mode!r}; choose from off, {', '.join(MODES)}")
+        self.directory = directory or Config.SNAPSHOT_DIR
+        self.refresh_seconds = refresh_seconds if refresh_seconds is not None else Config.SNAPSHOT_REFRESH_SECONDS
+        self.memory_max_bytes = (memory_max_mb if memory_max_mb is not None
+                                 else Config.SNAPSHOT_MEMORY_MAX_MB) * 1024 * 1024
+        self.backup_pages = backup_pages if backup_pages is not None else Config.SNAPSHOT_BACKUP_PAGES
+        self._current: Optional[Snapshot] = None
+        self._retired = []
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._seq = 0
+        self.counters = {"refreshes": 0, "unchanged": 0, "failures": 0, "discarded": 0, "backup_fallbacks": 0,
+                         "swept": 0}
+        self.last_refresh_ms = None
+        self.last_error = None
+
+    def _source_signature(self) -> tuple:
+        """Changes whenever the source (or its WAL) is written."""
+        signature = []
+        for path in (self.source, self.source + "-wal"):
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def _kind(self) -> str:
+        if self.mode == "auto":
+            return "memory" if os.path.getsize(self.source) <= self.memory_max_bytes else "file"
+        return self.mode
+
+    def _backup(self, source: sqlite3.Connection, target: sqlite3.Connection):
+        if self.backup_pages <= 0:
+            source.backup(target)
+            return
+        # Stepped copies let writers commit in between, but SQLite restarts the copy after
+        # every such commit; give up after copying the database a few times over and
+        # take it in one read transaction instead
+        copied = 0
+
+        def progress(status, remaining, total):
+            nonlocal copied
+            copied += self.backup_pages
+            if copied > MAX_BACKUP_PASSES * total:
+                raise _BackupRestarted()
+
+        try:
+            source.backup(target, pages=self.backup_pages, progress=progress, sleep=0.05)
+        except _BackupRestarted:
+            self.counters["backup_fallbacks"] += 1
+            source.backup(target)
+
+    def _take(self) -> Snapshot:
+        signature = self._source_signature()
+        kind = self._kind()
+        self._seq += 1
+        source = sqlite3.connect(Path(self.source).as_uri() + "?mode=ro", uri=True, timeout=30)
+        try:
+            if kind == "memory":
+                uri = f"file:ai_insight_snapshot_{os.getpid()}_{self._seq}?mode=memory&cache=shared"
+                target = sqlite3.connect(uri, uri=True, check_same_thread=False)
+                path = None
+            else:
+                os.makedirs(self.directory, exist_ok=True)
+                path = os.path.abspath(os.path.join(
+                    self.directory, f"{Path(self.source).stem}.{os.getpid()}.{self._seq}.db"))
+                tmp_path = path + ".tmp"
+                target = sqlite3.connect(tmp_path)
+            try:
+                self._backup(source, target)
+            except BaseException:
+                target.close()
+                if path:
+                    os.remove(tmp_path)
+                raise
+        finally:
+            source.close()
+
+        if kind == "memory":
+            size = target.execute("PRAGMA page_count").fetchone()[0] * target.execute("PRAGMA page_size").fetchone()[0]
+            return Snapshot(self._seq, uri, kind, signature, size, keeper=target)
+        target.close()
+        os.replace(tmp_path, path)
+        return Snapshot(self._seq, Path(path).as_uri() + "?mode=ro&immutable=1", kind, signature,
+                        os.path.getsize(path), path=path)
+
+    def refresh(self, force: bool = False) -> bool:
+        """Take a new snapshot if the source changed; returns True when one was swapped in."""
+        with self._refresh_lock:
+            current = self._current
+            if not force and current is not None and current.source_signature == self._source_signature():
+                self.counters["unchanged"] += 1
+                return False
+            started = time.perf_counter()
+            try:
+                snapshot = self._take()
+            except (OSError, sqlite3.Error) as e:
+                self.counters["failures"] += 1
+                self.last_error = str(e)
+                print(f"⚠️ Snapshot of {self.source} failed: {e}")
+                return False
+            self.last_refresh_ms = round((time.perf_counter() - started) * 1000, 1)
+            self.last_error = None
+            with self._lock:
+                previous, self._current = self._current, snapshot
+                if previous is not None:
+                    self._retired.append(previous)
+                self._discard_idle()
+            self.counters["refreshes"] += 1
+            return True
+
+    def _discard_idle(self):
+        """Drop retired snapshots nobody is reading; call with ``_lock`` held."""
+        idle = [s for s in self._retired if s.readers == 0]
+        self._retired = [s for s in self._retired if s.readers > 0]
+        for snapshot in idle:
+            snapshot.discard()
+            self.counters["discarded"] += 1
+
+    @contextmanager
+    def connect(self):
+        """Connection to the newest snapshot, or to the live database if none exists yet."""
+        with self._lock:
+            snapshot = self._current
+            if snapshot is not None:
+                snapshot.readers += 1
+        if snapshot is None:
+            conn = sqlite3.connect(Path(self.source).as_uri() + "?mode=ro", uri=True)
+        else:
+            try:
+                conn = snapshot.connect()
+            except sqlite3.Error:
+                self._release(snapshot)
+                raise
+        try:
+            yield conn
+        finally:
+            conn.close()
+            if snapshot is not None:
+                self._release(snapshot)
+
+    def _release(self, snapshot: Snapshot):
+        with self._lock:
+            snapshot.readers -= 1
+            if snapshot is not self._current:
+                self._discard_idle()
+
+    def _sweep(self):
+        """
+        Delete snapshot files in ``directory`` that no live manager owns: those
+        of this pid that are not in use, and those of other pids that are no
+        longer running (crashed workers, earlier runs) once they are older than
+        a refresh interval.
+        """
+        if not os.path.isdir(self.directory):
+            return
+        pattern = re.compile(re.escape(Path(self.source).stem) + r"\.(\d+)\.\d+\.db(\.tmp)?$")
+        with self._lock:
+            in_use = {s.path for s in [self._current, *self._retired] if s is not None and s.path}
+        cutoff = time.time() - max(self.refresh_seconds, 1)
+        for name in os.listdir(self.directory):
+            match = pattern.match(name)
+            path = os.path.abspath(os.path.join(self.directory, name))
+            if not match or path in in_use:
+                continue
+            pid = int(match.group(1))
+            try:
+                # Runs before the first refresh or on the refresh thread, so none of ours is mid-write
+                if pid != os.getpid() and (_pid_alive(pid) or os.path.getmtime(path) > cutoff):
+                    continue
+                os.remove(path)
+                self.counters["swept"] += 1
+            except OSError:
+                pass  # removed by another worker's sweep
+
+    def _run(self):
+        while not self._stop.wait(self.refresh_seconds):
+            self.refresh()
+            self._sweep()
+
+    def start(self):
+        """Take the first snapshot now, then refresh every ``refresh_seconds`` in the background."""
+        if self._thread is not None:
+            return
+        self._sweep()
+        if self.refresh(force=True):
+            print(f"📸 Serving queries from a {self._current.kind} snapshot of {self.source} "
+                  f"({self._current.size_bytes / 1024 / 1024:.1f} MB, {self.last_refresh_ms} ms)")
+        if self.refresh_seconds > 0:
+            self._thread = threading.Thread(target=self._run, name="snapshot-refresh", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        with self._lock:
+            if self._current is not None:
+                self._retired.append(self._current)
+                self._current = None
+            self._discard_idle()
+
+    def stats(self) -> dict:
+        with self._lock:
+            current = self._current
+            retired = len(self._retired)
+            readers = (current.readers if current else 0) + sum(s.readers for s in self._retired)
+        return {
+            "mode": self.mode,
+            "kind": current.kind if current else None,
+            "snapshot_id": current.id if current else None,
+            "age_seconds": round(time.time() - current.created_at, 1) if current else None,
+            "size_bytes": current.size_bytes if current else None,
+            "refresh_seconds": self.refresh_seconds,
+            "last_refresh_ms": self.last_refresh_ms,
+            "last_error": self.last_error,
+            "readers": readers,
+            "retired": retired,
+            **self.counters,
+        }
+
+
+_snapshot_manager = None
+
+
+def get_snapshot_manager() -> Optional[SnapshotManager]:
+    """The process-wide snapshot manager, or None when SNAPSHOT_MODE is off."""
+    global _snapshot_manager
+    if _snapshot_manager is None and Config.SNAPSHOT_MODE.lower() != "off":
+        _snapshot_manager = SnapshotManager()
+    return _snapshot_manager
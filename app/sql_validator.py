@@ -0,0 +1,134 @@
+# Local validation of LLM-generated SQL before it is executed
+import re
+import sqlite3
+from typing import Dict, List, Optional
+
+from .config import Config
+from .schema_catalog import get_schema_catalog, table_map
+from .sqlite_client import connect_readonly, deny_writes
+
+_KEYWORDS_AFTER_TABLE = {
+    "where", "join", "inner", "left", "right", "full", "cross", "natural", "on", "using",
+    "group", "order", "limit", "having", "union", "except", "intersect", "window", "as", "from", "select",
+}
+
+
+def _table_columns(db_path: str) -> Dict[str, List[str]]:
+    """Lower-cased table/view name -> column names, from the shared schema catalog."""
+    return {name: table.column_names for name, table in table_map(get_schema_catalog(db_path)).items()}
+
+
+def _strip_literals(sql: str) -> str:
+    """Blank out string literals and comments so keyword scans don't see their contents."""
+    sql = re.sub(r"--[^\n]*", " ", sql)
+    sql = re.sub(r"/\*.*?\*/", " ", sql, flags=re.DOTALL)
+    return re.sub(r"'(?:[^']|'')*'", "''", sql)
+
+
+def _unquote(identifier: str) -> str:
+    return identifier.strip('"`[]')
+
+
+def _aliases(sql: str) -> Dict[str, str]:
+    """
+    alias -> table name for FROM/JOIN/comma sources. Only used to word
+    "no such column" errors; SQLite itself decides what the query reads.
+    """
+    aliases = {}
+    # A source is not followed by "." or "(" (that would be a column or function in a select list)
+    pattern = re.compile(r"(?:\bfrom|\bjoin|,)\s+([\w\"`\[\]]+)(?!\s*[.(])(?:\s+(?:as\s+)?([\w\"`\[\]]+))?",
+                         re.IGNORECASE)
+    for match in pattern.finditer(_strip_literals(sql)):
+        table = _unquote(match.group(1))
+        alias = match.group(2)
+        if alias is None or alias.lower() in _KEYWORDS_AFTER_TABLE:
+            alias = table
+        aliases.setdefault(_unquote(alias).lower(), table)
+    return aliases
+
+
+def _compile(sql: str, db_path: str):
+    """
+    Compile ``sql`` with EXPLAIN on a read-only connection whose authorizer only
+    allows reads. Returns (tables read, denied action codes, sqlite error or None).
+    """
+    tables, denied = [], []
+
+    def on_read(table, source):
+        # Reads through a view are reported for the view itself too; keep direct reads only
+        if source is None and table and not table.lower().startswith("sqlite_") and table not in tables:
+            tables.append(table)
+
+    conn = deny_writes(connect_readonly(db_path), on_read=on_read, on_denied=denied.append)
+    try:
+        conn.execute(f"EXPLAIN {sql.strip().rstrip(';')}")
+        return tables, denied, None
+    except sqlite3.Error as e:
+        return tables, denied, e
+    finally:
+        conn.close()
+
+
+def referenced_tables(sql: str, db_path: str = None) -> List[str]:
+    """Tables and views the statement reads, as reported by SQLite while compiling it."""
+    db_path = db_path or Config.DATABASE_PATH
+    tables, _, error = _compile(sql, db_path)
+    if error is not None:
+        raise ValueError(f"SQL Error: {error}")
+    # Table-valued functions (json_each, pragma_*) are read like tables but are not in the schema
+    known = _table_columns(db_path)
+    return [table for table in tables if table.lower() in known]
+
+
+def _check_statement_shape(sql: str) -> Optional[str]:
+    cleaned = _strip_literals(sql).strip().rstrip(";").strip()
+    if not cleaned:
+        return "Empty SQL statement."
+    if ";" in cleaned:
+        return "Only a single SQL statement is allowed."
+    first_word = cleaned.split(None, 1)[0].lower()
+    if first_word not in ("select", "with", "values"):
+        return f"Only read-only SELECT queries are allowed, got '{first_word.upper()}'."
+    return None
+
+
+def _explain_error(sql: str, error: Exception, catalog: Dict[str, List[str]]) -> str:
+    """Turn SQLite's unknown-name errors into messages that list what is available."""
+    message = str(error)
+    table = re.match(r"no such table: (?:\w+\.)?(.+)", message)
+    if table:
+        return f"Unknown table(s): {table.group(1)}. Available tables: {', '.join(sorted(catalog))}."
+    column = re.match(r"no such column: (?:(\w+)\.)?(\w+)", message)
+    if column and column.group(1):
+        qualifier = column.group(1)
+        name = _aliases(sql).get(qualifier.lower(), qualifier)
+        if name.lower() in catalog:
+            return (f"Unknown column {qualifier}.{column.group(2)}: table {name} has columns "
+                    f"{', '.join(catalog[name.lower()])}.")
+    return f"SQL Error: {message}"
+
+
+def validate_sql(sql: str, db_path: str = None) -> Optional[str]:
+    """
+    Check generated SQL without executing it.
+    Returns None when the query is valid, otherwise an error message suitable
+    for feeding back to the LLM.
+    """
+    error = _check_statement_shape(sql)
+    if error:
+        return error
+
+    db_path = db_path or Config.DATABASE_PATH
+    try:
+        catalog = _table_columns(db_path)
+    except (OSError, sqlite3.Error) as e:
+        return f"Could not read database schema: {e}"
+
+    # EXPLAIN compiles the statement (resolving every name) without running it; the
+    # authorizer catches writes hidden behind a read keyword, e.g. WITH ... DELETE
+    _, denied, error = _compile(sql, db_path)
+    if denied:
+        return "Only read-only SELECT queries are allowed; the statement would modify the database."
+    if error is not None:
+        return _explain_error(sql, error, catalog)
+    return None
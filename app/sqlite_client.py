@@ -1,20 +1,76 @@
 import sqlite3
 import os
+from contextlib import contextmanager
+from pathlib import Path
 from .config import Config
+from .snapshots import get_snapshot_manager
 
-def run_query(sql: str):
+config = Config()
+
+# Authorizer actions a plain query needs; anything else (writes, DDL, ATTACH, PRAGMA) is denied
+READ_ACTIONS = {sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION, sqlite3.SQLITE_RECURSIVE}
+
+def connect_readonly(db_path: str) -> sqlite3.Connection:
+    """Open the database read-only (introspection and validation never write)."""
+    return sqlite3.connect(Path(db_path).resolve().as_uri() + "?mode=ro", uri=True)
+
+def deny_writes(conn: sqlite3.Connection, on_read=None, on_denied=None):
+    """
+    Install an authorizer that only lets statements read. ``on_read(table, source)``
+    sees every table read (``source`` is the view or trigger it was read through);
+    ``on_denied(action)`` sees every denied action.
+    """
+    def authorize(action, arg1, arg2, db_name, source):
+        # Table-valued functions (json_each, pragma_*) declare themselves through an internal
+        # sqlite_master UPDATE check; user statements cannot modify sqlite_master anyway
+        if action == sqlite3.SQLITE_UPDATE and arg1 in ("sqlite_master", "sqlite_schema"):
+            return sqlite3.SQLITE_OK
+        if action in READ_ACTIONS:
+            if action == sqlite3.SQLITE_READ and on_read is not None:
+                on_read(arg1, source)
+            return sqlite3.SQLITE_OK
+        if on_denied is not None:
+            on_denied(action)
+        return sqlite3.SQLITE_DENY
+
+    conn.set_authorizer(authorize)
+    return conn
+
+@contextmanager
+def query_connection():
+    """
+    Read-only connection for result queries: the newest snapshot when SNAPSHOT_MODE
+    is on, else the live DB opened ``mode=ro``. Either way writes are denied.
+    """
+    manager = get_snapshot_manager()
+    if manager is not None:
+        with manager.connect() as conn:
+            yield deny_writes(conn)
+        return
+    conn = deny_writes(connect_readonly(config.DATABASE_PATH))
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+def run_query(sql: str, params: tuple = (), on_connect=None, limit: int = None):
     """
     Executes the given SQL on the SQLite DB and returns column names + rows.
     If there's an error, returns ([], error_message).
+    ``on_connect(conn)`` is called before executing, e.g. so another thread
+    can cancel the query (``conn.interrupt()`` or a progress handler). ``limit``
+    stops fetching early without rewriting the SQL.
     """
-    config = Config()
     try:
-        conn = sqlite3.connect(config.DATABASE_PATH)
-        cursor = conn.cursor()
-        cursor.execute(sql)
-        rows = cursor.fetchall()
-        columns = [desc[0] for desc in cursor.description]
-        conn.close()
-        return columns, rows
+        with query_connection() as conn:
+            if on_connect:
+                on_connect(conn)
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            if cursor.description is None:
+                return [], "SQL Error: statement returned no result set"
+            rows = cursor.fetchall() if limit is None else cursor.fetchmany(limit)
+            columns = [desc[0] for desc in cursor.description]
+            return columns, rows
     except Exception as e:
         return [], f"SQL Error: {e}"
\ No newline at end of file
@@ -0,0 +1,167 @@
+# Pooled, caching HTTP client used by the Streamlit dashboard
+import copy
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class ApiClient:
+    """
+    One keep-alive ``requests.Session`` for every dashboard rerun, plus a small
+    TTL cache of answers so reruns and repeated questions don't hit the backend.
+    ``for_session`` gives each dashboard session its own view with its own
+    client key, so the backend rate limits sessions separately.
+    """
+
+    def __init__(self, base_url: str, timeout: float = 30, cache_size: int = 128, cache_ttl: float = 300,
+                 job_timeout: float = 600, poll_interval: float = 0.5):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.job_timeout = job_timeout
+        self.poll_interval = poll_interval
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="api-client")
+        self.headers = {}
+        self._last_prefetch = None
+
+    def for_session(self, client_id: str, key_header: str = "X-API-Key") -> "ApiClient":
+        """Shares the connection pool and answer cache, but sends ``client_id`` and tracks prefetches per session."""
+        view = copy.copy(self)
+        view.headers = {key_header: client_id} if key_header else {}
+        view._last_prefetch = None
+        return view
+
+    def _cache_get(self, key):
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self.cache_ttl:
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return entry[1]
+
+    def _cache_set(self, key, value):
+        with self._lock:
+            self._cache[key] = (time.monotonic(), value)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def cached_answer(self, question: str, chart_type: str, max_rows: int):
+        """Answer already fetched for this question + chart type, if still fresh."""
+        return self._cache_get((question, chart_type, max_rows))
+
+    def run_job(self, question: str, chart_type: str, on_status=None) -> dict:
+        """
+        Submit the question to /jobs and poll until it finishes, so slow SQL is not
+        bound by the HTTP timeout. ``on_status`` receives every job status seen.
+        Failed jobs raise ``requests.HTTPError`` like a failed /ask would.
+        """
+        res = self.session.post(f"{self.base_url}/jobs",
+                                json={"question": question, "chart_type": chart_type},
+                                headers=self.headers, timeout=self.timeout)
+        res.raise_for_status()
+        job = res.json()
+        deadline = time.monotonic() + self.job_timeout
+        while job["status"] in ("queued", "running"):
+            if on_status:
+                on_status(job)
+            if time.monotonic() > deadline:
+                self.cancel_job(job["job_id"])
+                raise requests.exceptions.Timeout(f"Job {job['job_id']} did not finish in {self.job_timeout:.0f}s")
+            time.sleep(self.poll_interval)
+            res = self.session.get(f"{self.base_url}/jobs/{job['job_id']}", headers=self.headers,
+                                   timeout=self.timeout)
+            res.raise_for_status()
+            job = res.json()
+        if on_status:
+            on_status(job)
+        if job["status"] != "succeeded":
+            raise requests.exceptions.HTTPError(f"{job.get('status_code') or ''} {job['status']}: {job['error']}")
+        return job["result"]
+
+    def cancel_job(self, job_id: str):
+        self.session.delete(f"{self.base_url}/jobs/{job_id}", headers=self.headers, timeout=self.timeout)
+
+    def ask(self, question: str, chart_type: str, max_rows: int = 1000, on_status=None) -> dict:
+        """Answer through /jobs and follow result cursors up to ``max_rows``; cached by question + chart type."""
+        key = (question, chart_type, max_rows)
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached
+
+        data = self.run_job(question, chart_type, on_status)
+
+        # Page through the stored result up to the configured row budget
+        while data.get("has_more") and len(data.get("rows", [])) < max_rows:
+            page = self.result_page(data["result_handle"], data["next_cursor"],
+                                    min(1000, max_rows - len(data["rows"])))
+            data["rows"].extend(page["rows"])
+            data["next_cursor"] = page.get("next_cursor")
+            data["has_more"] = page.get("has_more", False)
+
+        self._cache_set(key, data)
+        return data
+
+    def ask_async(self, question: str, chart_type: str, max_rows: int = 1000, on_status=None):
+        """Run ``ask`` on a worker thread so the dashboard can keep updating while it waits."""
+        return self._executor.submit(self.ask, question, chart_type, max_rows, on_status)
+
+    def prefetch(self, question: str, chart_type: str, min_chars: int = 12):
+        """
+        Fire-and-forget /prefetch while the user is typing, so Run Query finds the
+        retrieval and SQL already cached. Skipped for short questions, the question
+        last prefetched (reruns from other widgets) and answers already cached here.
+        Debouncing is left to the input widget. Returns the future, or None when skipped.
+        """
+        question = question.strip()
+        key = (question, chart_type)
+        with self._lock:
+            if len(question) < min_chars or key == self._last_prefetch:
+                return None
+            self._last_prefetch = key
+            if any(k[:2] == key for k in self._cache):
+                return None
+
+        def send():
+            try:
+                self.session.post(f"{self.base_url}/prefetch",
+                                  json={"question": question, "chart_type": chart_type},
+                                  headers=self.headers, timeout=5)
+            except requests.RequestException:
+                pass  # purely an optimisation; Run Query works without it
+
+        return self._executor.submit(send)
+
+    def result_page(self, handle: str, cursor: str, page_size: int) -> dict:
+        res = self.session.get(f"{self.base_url}/results/{handle}",
+                               params={"cursor": cursor, "page_size": page_size}, headers=self.headers,
+                               timeout=self.timeout)
+        res.raise_for_status()
+        return res.json()
+
+    def chart_data(self, handle: str, chart_type: str, max_points: int) -> dict:
+        key = ("chart", handle, chart_type, max_points)
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached
+        res = self.session.get(f"{self.base_url}/results/{handle}/chart",
+                               params={"chart_type": chart_type, "max_points": max_points},
+                               headers=self.headers, timeout=self.timeout)
+        res.raise_for_status()
+        data = res.json()
+        self._cache_set(key, data)
+        return data
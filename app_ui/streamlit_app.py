@@ -8,12 +8,79 @@ from plotly.subplots import make_subplots
 import requests
 import numpy as np
 from datetime import datetime
+import io
+import time
 import warnings
 import os
+import uuid
+from api_client import ApiClient
 warnings.filterwarnings('ignore')
 
+try:
+    # Optional: reruns while the user types (debounced in the browser), enabling prefetch before Enter
+    from st_keyup import st_keyup
+except ImportError:
+    st_keyup = None
+
 # Configuration
 FASTAPI_URL = os.getenv("FASTAPI_URL", "http://localhost:8001/ask")
+API_BASE_URL = FASTAPI_URL.rsplit("/ask", 1)[0]
+CACHE_TTL_SECONDS = int(os.getenv("DASHBOARD_CACHE_TTL", "300"))
+# Warm the backend (/prefetch) with the question being typed; the debounce (ms) applies
+# to the optional streamlit-keyup input, plain text inputs only prefetch on Enter
+PREFETCH_ENABLED = os.getenv("DASHBOARD_PREFETCH", "True").lower() == "true"
+PREFETCH_DEBOUNCE_MS = int(os.getenv("DASHBOARD_PREFETCH_DEBOUNCE_MS", "600"))
+PREFETCH_MIN_CHARS = int(os.getenv("PREFETCH_MIN_CHARS", "12"))
+# Each browser session sends its own id in this header, so the backend rate limits sessions separately
+CLIENT_KEY_HEADER = os.getenv("CLIENT_KEY_HEADER", "X-API-Key")
+
+# Backend stages reported in the /ask response timings
+STAGE_LABELS = [
+    ("retrieval_ms", "🔎 Schema retrieval"),
+    ("llm_ms", "🧠 SQL generation"),
+    ("validation_ms", "🧪 SQL validation"),
+    ("execution_ms", "🗄️ Query execution"),
+]
+
+# Live job stage (from /jobs polling) -> progress label
+JOB_STAGE_LABELS = {
+    "retrieval": "🔎 Finding relevant tables",
+    "generation": "🧠 Generating SQL",
+    "validation": "🧪 Validating SQL",
+    "execution": "🗄️ Running query",
+    "repair": "🔧 Repairing SQL",
+}
+
+# Export format -> (file extension, MIME type)
+EXPORT_FORMATS = {
+    "CSV": ("csv", "text/csv"),
+    "JSON": ("json", "application/json"),
+    "Excel": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+}
+
+@st.cache_resource
+def get_api_client():
+    """One pooled HTTP session and answer cache shared by every rerun and session."""
+    return ApiClient(API_BASE_URL, timeout=30, cache_ttl=CACHE_TTL_SECONDS)
+
+def get_session_api_client():
+    """This browser session's view of the shared client, with its own client key."""
+    if "api_client" not in st.session_state:
+        st.session_state.api_client = get_api_client().for_session(
+            f"dashboard:{uuid.uuid4().hex}", CLIENT_KEY_HEADER)
+    return st.session_state.api_client
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, show_spinner=False, max_entries=32)
+def build_export(df: pd.DataFrame, export_format: str) -> bytes:
+    """Serialize the result in memory (no temp files), only when a download is requested."""
+    if export_format == "CSV":
+        return df.to_csv(index=False).encode("utf-8")
+    if export_format == "JSON":
+        return df.to_json(orient='records', indent=2).encode("utf-8")
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+        df.to_excel(writer, index=False)
+    return buffer.getvalue()
 
 # Page configuration
 st.set_page_config(
@@ -128,6 +195,12 @@ with st.sidebar:
         fig_width = st.slider("Figure Width", 6, 20, 12)
         fig_height = st.slider("Figure Height", 4, 15, 8)
         font_size = st.slider("Font Size", 8, 20, 12)
+        server_charts = st.checkbox("Server-side Chart Aggregation", value=True,
+                                    help="Let the API bin, group and downsample data before it is plotted")
+        max_chart_points = st.slider("Max Chart Points", 100, 5000, 1000, step=100)
+        max_rows = st.number_input("Max Rows to Load", min_value=100, max_value=100000,
+                                   value=1000, step=100,
+                                   help="Further pages are fetched from the server without re-running the AI")
         
     # Sample questions
     st.markdown("### 💡 Sample Questions")
@@ -149,12 +222,21 @@ col1, col2 = st.columns([2, 1])
 
 with col1:
     # Question input
-    user_question = st.text_input(
-        "🤔 Ask your data question:",
-        placeholder="e.g., Show me the total revenue by product category for the last quarter",
-        value=st.session_state.get('user_question', ''),
-        help="Type your question in natural language. Be specific about what you want to see."
-    )
+    if st_keyup is not None and PREFETCH_ENABLED:
+        user_question = st_keyup(
+            "🤔 Ask your data question:",
+            placeholder="e.g., Show me the total revenue by product category for the last quarter",
+            value=st.session_state.get('user_question', ''),
+            debounce=PREFETCH_DEBOUNCE_MS,
+            key="question_keyup"
+        )
+    else:
+        user_question = st.text_input(
+            "🤔 Ask your data question:",
+            placeholder="e.g., Show me the total revenue by product category for the last quarter",
+            value=st.session_state.get('user_question', ''),
+            help="Type your question in natural language. Be specific about what you want to see."
+        )
 
 with col2:
     # Action buttons
@@ -164,246 +246,276 @@ with col2:
 
 if clear_query:
     st.session_state.user_question = ""
+    st.session_state.pop("active_question", None)
+    st.session_state.pop("prepared_export", None)
     st.rerun()
 
+# Speculatively warm retrieval and SQL while the question is being written
+if PREFETCH_ENABLED and user_question and not run_query:
+    get_session_api_client().prefetch(user_question, chart_type, min_chars=PREFETCH_MIN_CHARS)
+
 # Query execution
-if run_query:
-    if not user_question:
-        st.warning("⚠️ Please enter a question to get started.")
-    else:
-        try:
-            # Progress tracking
-            progress_bar = st.progress(0)
-            status_text = st.empty()
-            
-            status_text.text("🔄 Sending request to AI backend...")
-            progress_bar.progress(25)
-            
-            # Send request to FastAPI backend
-            res = requests.post(
-                FASTAPI_URL,
-                json={"question": f"{user_question}. In the format It will be helpful for this chart {chart_type}"},
-                timeout=30
-            )
-            
-            res.raise_for_status()
-            
-            status_text.text("🧠 Processing AI response...")
-            progress_bar.progress(50)
-            
-            data = res.json()
+if run_query and not user_question:
+    st.warning("⚠️ Please enter a question to get started.")
+elif run_query:
+    st.session_state.active_question = user_question
+    st.session_state.pop("prepared_export", None)
+
+# Results stay on screen across reruns; changing the chart re-renders from cache
+active_question = st.session_state.get("active_question")
+if active_question:
+    api = get_session_api_client()
+    try:
+        data = api.cached_answer(active_question, chart_type, int(max_rows))
+        if data is None:
+            # Run the request off the script thread and report progress while it is in flight
+            with st.status("🔄 Asking the AI backend...", expanded=False) as status:
+                job = {}
+                future = api.ask_async(active_question, chart_type, int(max_rows), on_status=job.update)
+                started = time.monotonic()
+                while not future.done():
+                    stage = JOB_STAGE_LABELS.get(job.get("stage"), "🔄 Waiting for the AI backend")
+                    if job.get("status") == "queued":
+                        stage = "⏳ Queued"
+                    status.update(label=f"{stage}... {time.monotonic() - started:.1f}s")
+                    time.sleep(0.2)
+                data = future.result()
+                
+                # Stage timings measured by the backend
+                timings = data.get("timings", {})
+                for stage, label in STAGE_LABELS:
+                    if stage in timings:
+                        st.write(f"{label}: {timings[stage]:.0f} ms")
+                if timings.get("repairs"):
+                    st.write(f"🔧 SQL repairs: {timings['repairs']}")
+                status.update(label=f"✅ Answer ready in {time.monotonic() - started:.1f}s", state="complete")
+        
+        # Display results
+        if "sql" in data:
+            sql = data["sql"]
+            columns = data.get("columns", [])
+            rows = data.get("rows", [])
             
-            status_text.text("📊 Generating visualization...")
-            progress_bar.progress(75)
+            # SQL Display
+            with st.expander("🔍 Generated SQL Query", expanded=False):
+                st.code(sql, language="sql")
             
-            # Display results
-            if "sql" in data:
-                sql = data["sql"]
-                columns = data.get("columns", [])
-                rows = data.get("rows", [])
+            # Data processing
+            if rows and columns:
+                df = pd.DataFrame(rows, columns=columns)
                 
-                # SQL Display
-                with st.expander("🔍 Generated SQL Query", expanded=False):
-                    st.code(sql, language="sql")
+                # Data summary
+                col1, col2, col3, col4 = st.columns(4)
+                with col1:
+                    st.metric("📊 Total Rows", len(df))
+                with col2:
+                    st.metric("📈 Columns", len(df.columns))
+                with col3:
+                    if df.select_dtypes(include=[np.number]).empty:
+                        st.metric("💰 Numeric Cols", 0)
+                    else:
+                        st.metric("💰 Numeric Cols", len(df.select_dtypes(include=[np.number]).columns))
+                with col4:
+                    st.metric("⏰ Generated", datetime.now().strftime("%H:%M:%S"))
                 
-                # Data processing
-                if rows and columns:
-                    df = pd.DataFrame(rows, columns=columns)
-                    
-                    # Data summary
-                    col1, col2, col3, col4 = st.columns(4)
-                    with col1:
-                        st.metric("📊 Total Rows", len(df))
-                    with col2:
-                        st.metric("📈 Columns", len(df.columns))
-                    with col3:
-                        if df.select_dtypes(include=[np.number]).empty:
-                            st.metric("💰 Numeric Cols", 0)
-                        else:
-                            st.metric("💰 Numeric Cols", len(df.select_dtypes(include=[np.number]).columns))
-                    with col4:
-                        st.metric("⏰ Generated", datetime.now().strftime("%H:%M:%S"))
-                    
-                    progress_bar.progress(100)
-                    status_text.text("✅ Visualization ready!")
-                    
-                    # Chart generation
-                    st.markdown("### 📊 Data Visualization")
-                    
-                    chart_container = st.container()
-                    
-                    with chart_container:
-                        try:
-                            if chart_type == "Table":
-                                st.dataframe(df, use_container_width=True)
-                                
-                            elif chart_type == "Bar Chart" and len(df.columns) >= 2:
-                                fig = px.bar(df, x=df.columns[0], y=df.columns[1], 
-                                           color_discrete_sequence=px.colors.qualitative.Set3,
-                                           title=f"Bar Chart: {user_question}")
-                                fig.update_layout(showlegend=show_legend, 
-                                                width=fig_width*80, height=fig_height*60)
-                                st.plotly_chart(fig, use_container_width=True)
-                                
-                            elif chart_type == "Line Chart" and len(df.columns) >= 2:
-                                fig = px.line(df, x=df.columns[0], y=df.columns[1],
-                                            title=f"Line Chart: {user_question}")
-                                fig.update_layout(showlegend=show_legend,
-                                                width=fig_width*80, height=fig_height*60)
-                                st.plotly_chart(fig, use_container_width=True)
-                                
-                            elif chart_type == "Pie Chart" and len(df.columns) >= 2:
-                                fig = px.pie(df, names=df.columns[0], values=df.columns[1],
-                                           title=f"Pie Chart: {user_question}")
-                                st.plotly_chart(fig, use_container_width=True)
-                                
-                            elif chart_type == "Heatmap":
-                                # Create heatmap with numeric data
-                                numeric_df = df.select_dtypes(include=[np.number])
-                                if not numeric_df.empty:
-                                    fig = px.imshow(numeric_df.corr(), 
-                                                  color_continuous_scale=color_theme,
-                                                  title="Correlation Heatmap")
-                                    st.plotly_chart(fig, use_container_width=True)
-                                else:
-                                    # Alternative heatmap for categorical data
-                                    if len(df.columns) >= 2:
-                                        pivot_df = df.pivot_table(
-                                            index=df.columns[0], 
-                                            columns=df.columns[1] if len(df.columns) > 2 else df.columns[0],
-                                            values=df.columns[-1] if len(df.columns) > 2 else df.columns[1],
-                                            aggfunc='count', 
-                                            fill_value=0
-                                        )
-                                        fig = px.imshow(pivot_df, color_continuous_scale=color_theme,
-                                                      title="Data Heatmap")
-                                        st.plotly_chart(fig, use_container_width=True)
-                                    else:
-                                        st.info("Heatmap requires numeric data or at least 2 columns")
-                                        
-                            elif chart_type == "Scatter Plot" and len(df.columns) >= 2:
-                                fig = px.scatter(df, x=df.columns[0], y=df.columns[1],
-                                               color=df.columns[2] if len(df.columns) > 2 else None,
-                                               title=f"Scatter Plot: {user_question}")
-                                st.plotly_chart(fig, use_container_width=True)
-                                
-                            elif chart_type == "Area Chart" and len(df.columns) >= 2:
-                                fig = px.area(df, x=df.columns[0], y=df.columns[1],
-                                            title=f"Area Chart: {user_question}")
+                # Chart generation
+                st.markdown("### 📊 Data Visualization")
+                
+                # Ask the API for just the points this chart needs
+                plot_df = df
+                chart_meta = None
+                if server_charts and chart_type != "Table" and data.get("result_handle"):
+                    try:
+                        chart_meta = api.chart_data(data["result_handle"], chart_type, max_chart_points)
+                        plot_df = pd.DataFrame(chart_meta["rows"], columns=chart_meta["columns"],
+                                               index=chart_meta.get("index"))
+                        if chart_meta["method"] not in ("none", "head"):
+                            st.caption(f"📉 {chart_meta['source_rows']:,} rows reduced to {len(plot_df):,} "
+                                       f"points on the server ({chart_meta['method']})")
+                    except requests.exceptions.RequestException as chart_fetch_error:
+                        st.info(f"ℹ️ Server-side aggregation unavailable, charting loaded rows: {chart_fetch_error}")
+                
+                chart_container = st.container()
+                
+                with chart_container:
+                    try:
+                        if chart_type == "Table":
+                            st.dataframe(df, use_container_width=True)
+                            
+                        elif chart_type == "Bar Chart" and len(plot_df.columns) >= 2:
+                            fig = px.bar(plot_df, x=plot_df.columns[0], y=plot_df.columns[1], 
+                                       color_discrete_sequence=px.colors.qualitative.Set3,
+                                       title=f"Bar Chart: {active_question}")
+                            fig.update_layout(showlegend=show_legend, 
+                                            width=fig_width*80, height=fig_height*60)
+                            st.plotly_chart(fig, use_container_width=True)
+                            
+                        elif chart_type == "Line Chart" and len(plot_df.columns) >= 2:
+                            fig = px.line(plot_df, x=plot_df.columns[0], y=plot_df.columns[1],
+                                        title=f"Line Chart: {active_question}")
+                            fig.update_layout(showlegend=show_legend,
+                                            width=fig_width*80, height=fig_height*60)
+                            st.plotly_chart(fig, use_container_width=True)
+                            
+                        elif chart_type == "Pie Chart" and len(plot_df.columns) >= 2:
+                            fig = px.pie(plot_df, names=plot_df.columns[0], values=plot_df.columns[1],
+                                       title=f"Pie Chart: {active_question}")
+                            st.plotly_chart(fig, use_container_width=True)
+                            
+                        elif chart_type == "Heatmap" and chart_meta:
+                            # Matrix already computed by the API (correlation or category counts)
+                            fig = px.imshow(plot_df, color_continuous_scale=color_theme,
+                                          title="Correlation Heatmap" if chart_meta["method"] == "numpy_corr" else "Data Heatmap")
+                            st.plotly_chart(fig, use_container_width=True)
+                            
+                        elif chart_type == "Heatmap":
+                            # Create heatmap with numeric data
+                            numeric_plot_df = plot_df.select_dtypes(include=[np.number])
+                            if not numeric_plot_df.empty:
+                                fig = px.imshow(numeric_plot_df.corr(), 
+                                              color_continuous_scale=color_theme,
+                                              title="Correlation Heatmap")
                                 st.plotly_chart(fig, use_container_width=True)
-                                
-                            elif chart_type == "Histogram":
-                                numeric_cols = df.select_dtypes(include=[np.number]).columns
-                                if len(numeric_cols) > 0:
-                                    fig = px.histogram(df, x=numeric_cols[0],
-                                                     title=f"Histogram: {numeric_cols[0]}")
-                                    st.plotly_chart(fig, use_container_width=True)
-                                else:
-                                    st.info("Histogram requires numeric data")
-                                    
-                            elif chart_type == "Box Plot":
-                                numeric_cols = df.select_dtypes(include=[np.number]).columns
-                                if len(numeric_cols) > 0:
-                                    fig = px.box(df, y=numeric_cols[0],
-                                               title=f"Box Plot: {numeric_cols[0]}")
-                                    st.plotly_chart(fig, use_container_width=True)
-                                else:
-                                    st.info("Box plot requires numeric data")
-                                    
-                            elif chart_type == "Violin Plot":
-                                numeric_cols = df.select_dtypes(include=[np.number]).columns
-                                if len(numeric_cols) > 0:
-                                    fig = px.violin(df, y=numeric_cols[0],
-                                                  title=f"Violin Plot: {numeric_cols[0]}")
+                            else:
+                                # Alternative heatmap for categorical data
+                                if len(plot_df.columns) >= 2:
+                                    pivot_df = plot_df.pivot_table(
+                                        index=plot_df.columns[0], 
+                                        columns=plot_df.columns[1] if len(plot_df.columns) > 2 else plot_df.columns[0],
+                                        values=plot_df.columns[-1] if len(plot_df.columns) > 2 else plot_df.columns[1],
+                                        aggfunc='count', 
+                                        fill_value=0
+                                    )
+                                    fig = px.imshow(pivot_df, color_continuous_scale=color_theme,
+                                                  title="Data Heatmap")
                                     st.plotly_chart(fig, use_container_width=True)
                                 else:
-                                    st.info("Violin plot requires numeric data")
+                                    st.info("Heatmap requires numeric data or at least 2 columns")
                                     
-                            elif chart_type == "Donut Chart" and len(df.columns) >= 2:
-                                fig = px.pie(df, names=df.columns[0], values=df.columns[1],
-                                           title=f"Donut Chart: {user_question}", hole=0.4)
-                                st.plotly_chart(fig, use_container_width=True)
-                                
-                            elif chart_type == "Treemap" and len(df.columns) >= 2:
-                                fig = px.treemap(df, path=[df.columns[0]], values=df.columns[1],
-                                               title=f"Treemap: {user_question}")
+                        elif chart_type == "Scatter Plot" and len(plot_df.columns) >= 2:
+                            fig = px.scatter(plot_df, x=plot_df.columns[0], y=plot_df.columns[1],
+                                           color=plot_df.columns[2] if len(plot_df.columns) > 2 else None,
+                                           title=f"Scatter Plot: {active_question}")
+                            st.plotly_chart(fig, use_container_width=True)
+                            
+                        elif chart_type == "Area Chart" and len(plot_df.columns) >= 2:
+                            fig = px.area(plot_df, x=plot_df.columns[0], y=plot_df.columns[1],
+                                        title=f"Area Chart: {active_question}")
+                            st.plotly_chart(fig, use_container_width=True)
+                            
+                        elif chart_type == "Histogram" and chart_meta:
+                            # Bins already counted by the API
+                            value_column = chart_meta["extra"].get("value_column", "value")
+                            fig = px.bar(plot_df, x=plot_df.columns[0], y="count",
+                                       title=f"Histogram: {value_column}")
+                            fig.update_traces(width=(plot_df[plot_df.columns[1]] - plot_df[plot_df.columns[0]]).tolist(),
+                                              offset=0)
+                            st.plotly_chart(fig, use_container_width=True)
+                            
+                        elif chart_type == "Histogram":
+                            numeric_cols = plot_df.select_dtypes(include=[np.number]).columns
+                            if len(numeric_cols) > 0:
+                                fig = px.histogram(plot_df, x=numeric_cols[0],
+                                                 title=f"Histogram: {numeric_cols[0]}")
                                 st.plotly_chart(fig, use_container_width=True)
+                            else:
+                                st.info("Histogram requires numeric data")
                                 
-                            elif chart_type == "Sunburst" and len(df.columns) >= 2:
-                                fig = px.sunburst(df, path=[df.columns[0]], values=df.columns[1],
-                                                title=f"Sunburst: {user_question}")
+                        elif chart_type == "Box Plot":
+                            numeric_cols = plot_df.select_dtypes(include=[np.number]).columns
+                            if len(numeric_cols) > 0:
+                                fig = px.box(plot_df, y=numeric_cols[0],
+                                           title=f"Box Plot: {numeric_cols[0]}")
                                 st.plotly_chart(fig, use_container_width=True)
+                            else:
+                                st.info("Box plot requires numeric data")
                                 
-                            elif chart_type == "Waterfall Chart" and len(df.columns) >= 2:
-                                fig = go.Figure(go.Waterfall(
-                                    name="Waterfall",
-                                    orientation="v",
-                                    measure=["relative"] * len(df),
-                                    x=df[df.columns[0]],
-                                    y=df[df.columns[1]],
-                                    text=df[df.columns[1]],
-                                    textposition="outside",
-                                    connector={"line": {"color": "rgb(63, 63, 63)"}},
-                                ))
-                                fig.update_layout(title=f"Waterfall Chart: {user_question}")
+                        elif chart_type == "Violin Plot":
+                            numeric_cols = plot_df.select_dtypes(include=[np.number]).columns
+                            if len(numeric_cols) > 0:
+                                fig = px.violin(plot_df, y=numeric_cols[0],
+                                              title=f"Violin Plot: {numeric_cols[0]}")
                                 st.plotly_chart(fig, use_container_width=True)
-                                
                             else:
-                                st.warning(f"⚠️ {chart_type} requires appropriate data structure. Showing table instead.")
-                                st.dataframe(df, use_container_width=True)
+                                st.info("Violin plot requires numeric data")
                                 
-                        except Exception as chart_error:
-                            st.error(f"❌ Error creating {chart_type}: {str(chart_error)}")
-                            st.info("📋 Displaying data as table instead:")
+                        elif chart_type == "Donut Chart" and len(plot_df.columns) >= 2:
+                            fig = px.pie(plot_df, names=plot_df.columns[0], values=plot_df.columns[1],
+                                       title=f"Donut Chart: {active_question}", hole=0.4)
+                            st.plotly_chart(fig, use_container_width=True)
+                            
+                        elif chart_type == "Treemap" and len(plot_df.columns) >= 2:
+                            fig = px.treemap(plot_df, path=[plot_df.columns[0]], values=plot_df.columns[1],
+                                           title=f"Treemap: {active_question}")
+                            st.plotly_chart(fig, use_container_width=True)
+                            
+                        elif chart_type == "Sunburst" and len(plot_df.columns) >= 2:
+                            fig = px.sunburst(plot_df, path=[plot_df.columns[0]], values=plot_df.columns[1],
+                                            title=f"Sunburst: {active_question}")
+                            st.plotly_chart(fig, use_container_width=True)
+                            
+                        elif chart_type == "Waterfall Chart" and len(plot_df.columns) >= 2:
+                            fig = go.Figure(go.Waterfall(
+                                name="Waterfall",
+                                orientation="v",
+                                measure=["relative"] * len(plot_df),
+                                x=plot_df[plot_df.columns[0]],
+                                y=plot_df[plot_df.columns[1]],
+                                text=plot_df[plot_df.columns[1]],
+                                textposition="outside",
+                                connector={"line": {"color": "rgb(63, 63, 63)"}},
+                            ))
+                            fig.update_layout(title=f"Waterfall Chart: {active_question}")
+                            st.plotly_chart(fig, use_container_width=True)
+                            
+                        else:
+                            st.warning(f"⚠️ {chart_type} requires appropriate data structure. Showing table instead.")
                             st.dataframe(df, use_container_width=True)
-                    
-                    # Data download
-                    st.markdown("### 📥 Export Data")
-                    col1, col2, col3 = st.columns(3)
-                    
-                    with col1:
-                        csv = df.to_csv(index=False)
-                        st.download_button(
-                            label="📄 Download CSV",
-                            data=csv,
-                            file_name=f"data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                            mime="text/csv"
+                            
+                    except Exception as chart_error:
+                        st.error(f"❌ Error creating {chart_type}: {str(chart_error)}")
+                        st.info("📋 Displaying data as table instead:")
+                        st.dataframe(df, use_container_width=True)
+                
+                # Data download: files are built in memory only when requested
+                st.markdown("### 📥 Export Data")
+                col1, col2 = st.columns([1, 2])
+                
+                with col1:
+                    export_format = st.selectbox("Format", list(EXPORT_FORMATS), label_visibility="collapsed")
+                    prepare_export = st.button("📦 Prepare Download", use_container_width=True)
+                
+                with col2:
+                    if prepare_export:
+                        st.session_state.prepared_export = (
+                            export_format, build_export(df, export_format),
+                            f"data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{EXPORT_FORMATS[export_format][0]}"
                         )
-                    
-                    with col2:
-                        excel_buffer = pd.ExcelWriter('temp.xlsx', engine='openpyxl')
-                        df.to_excel(excel_buffer, index=False)
-                        excel_buffer.close()
-                        
-                    with col3:
-                        json_str = df.to_json(orient='records', indent=2)
+                    prepared = st.session_state.get("prepared_export")
+                    if prepared and prepared[0] == export_format:
                         st.download_button(
-                            label="📊 Download JSON",
-                            data=json_str,
-                            file_name=f"data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
-                            mime="application/json"
+                            label=f"⬇️ Download {export_format}",
+                            data=prepared[1],
+                            file_name=prepared[2],
+                            mime=EXPORT_FORMATS[export_format][1]
                         )
-                    
-                    # Clear progress indicators
-                    progress_bar.empty()
-                    status_text.empty()
-                    
-                else:
-                    st.info("ℹ️ No data returned from the query. Please try a different question.")
-                    
+                
             else:
-                st.error("❌ Unexpected response format from API")
-                st.json(data)  # Show raw response for debugging
+                st.info("ℹ️ No data returned from the query. Please try a different question.")
                 
-        except requests.exceptions.Timeout:
-            st.error("⏱️ Request timed out. Please try again or check your backend service.")
-        except requests.exceptions.ConnectionError:
-            st.error("🔌 Could not connect to the backend service. Please ensure it's running on http://localhost:8001")
-        except requests.exceptions.HTTPError as e:
-            st.error(f"🌐 HTTP error occurred: {e}")
-        except Exception as e:
-            st.error(f"❌ Unexpected error: {str(e)}")
+        else:
+            st.error("❌ Unexpected response format from API")
+            st.json(data)  # Show raw response for debugging
             
+    except requests.exceptions.Timeout:
+        st.error("⏱️ Request timed out. Please try again or check your backend service.")
+    except requests.exceptions.ConnectionError:
+        st.error("🔌 Could not connect to the backend service. Please ensure it's running on http://localhost:8001")
+    except requests.exceptions.HTTPError as e:
+        st.error(f"🌐 HTTP error occurred: {e}")
+    except Exception as e:
+        st.error(f"❌ Unexpected error: {str(e)}")
+        
 # Footer
 st.markdown("---")
 st.markdown("""
@@ -0,0 +1,136 @@
+# Benchmark: /ask cache hit rate when users switch chart types
+"""
+Replays a dashboard-like workload (popular questions asked repeatedly, each
+followed by a few chart switches) and compares two ways of sending chart intent:
+
+- legacy: the chart hint is appended to the question text, so every chart
+  switch is a new retrieval and LLM cache key;
+- structured: the question is sent as-is with ``chart_type`` as a separate
+  field; retrieval is keyed on the question and SQL on (question, chart family).
+
+By default the caches are simulated in-process with the app's ``TTLCache``.
+With ``--url`` the same workload is sent to a running API (ideally backed by
+``mock_llm_server.py``) and hit rates are read from each response's ``cached`` field.
+
+    python benchmarks/chart_switch_cache.py
+    python benchmarks/chart_switch_cache.py --url http://localhost:8001 --requests 60
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from app.cache import TTLCache
+from app.prompts import CHART_FAMILIES, chart_family
+
+CHART_TYPES = ["Table"] + sorted(t for types in CHART_FAMILIES.values() for t in types)
+
+QUESTIONS = [
+    "How many customers do we have?",
+    "Top 10 customers by total payment amount",
+    "Monthly revenue over time",
+    "Number of rentals per film category",
+    "Average rental duration by store",
+    "Which actors appear in the most films?",
+    "Payment amounts distribution",
+    "Films per rating",
+    "Revenue by staff member",
+    "Customers per country",
+]
+
+
+def legacy_question(question: str, chart_type: str) -> str:
+    """Question text as the dashboard used to send it."""
+    return f"{question}. In the format It will be helpful for this chart {chart_type}"
+
+
+def workload(requests: int, switches: int, seed: int):
+    """(question, chart_type) pairs: Zipf-popular questions, each followed by chart switches."""
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(len(QUESTIONS))]
+    events = []
+    while len(events) < requests:
+        question = rng.choices(QUESTIONS, weights)[0]
+        for chart_type in [rng.choice(CHART_TYPES) for _ in range(1 + switches)]:
+            events.append((question, chart_type))
+    return events[:requests]
+
+
+def simulate(events, structured: bool, retrieval_ms: float, llm_ms: float) -> dict:
+    retrieval_cache, sql_cache = TTLCache(512, 900), TTLCache(512, 900)
+    for question, chart_type in events:
+        if structured:
+            retrieval_key, sql_key = question.lower(), (question.lower(), chart_family(chart_type))
+        else:
+            retrieval_key = legacy_question(question, chart_type).lower()
+            sql_key = (retrieval_key, None)
+        if retrieval_cache.get(retrieval_key) is None:
+            retrieval_cache.set(retrieval_key, True)
+        if sql_cache.get(sql_key) is None:
+            sql_cache.set(sql_key, True)
+    return _summary(retrieval_cache.stats(), sql_cache.stats(), retrieval_ms, llm_ms)
+
+
+def _summary(retrieval: dict, sql: dict, retrieval_ms: float, llm_ms: float) -> dict:
+    return {
+        "retrieval_hit_rate": retrieval["hit_rate"],
+        "sql_hit_rate": sql["hit_rate"],
+        "retrieval_calls": retrieval["misses"],
+        "llm_calls": sql["misses"],
+        "est_backend_seconds": round((retrieval["misses"] * retrieval_ms + sql["misses"] * llm_ms) / 1000, 1),
+    }
+
+
+def replay(events, structured: bool, url: str) -> dict:
+    import requests
+
+    session = requests.Session()
+    counts = {"retrieval": 0, "sql": 0}
+    started = time.perf_counter()
+    for question, chart_type in events:
+        if structured:
+            body = {"question": question, "chart_type": chart_type}
+        else:
+            # Vary the text so answers cached by the structured run don't leak in
+            body = {"question": legacy_question(question, chart_type) + " (legacy)"}
+        res = session.post(f"{url.rstrip('/')}/ask", json=body, timeout=120)
+        res.raise_for_status()
+        cached = res.json().get("cached", {})
+        counts["retrieval"] += bool(cached.get("retrieval"))
+        counts["sql"] += bool(cached.get("sql"))
+    n = len(events)
+    return {
+        "retrieval_hit_rate": round(counts["retrieval"] / n, 4),
+        "sql_hit_rate": round(counts["sql"] / n, 4),
+        "retrieval_calls": n - counts["retrieval"],
+        "llm_calls": n - counts["sql"],
+        "wall_seconds": round(time.perf_counter() - started, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare /ask cache hit rates across chart switches")
+    parser.add_argument("--requests", type=int, default=500, help="Number of /ask calls to replay")
+    parser.add_argument("--switches", type=int, default=3, help="Chart switches after each question")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--retrieval-ms", type=float, default=25.0, help="Assumed cost of one retrieval (simulation)")
+    parser.add_argument("--llm-ms", type=float, default=1500.0, help="Assumed cost of one LLM call (simulation)")
+    parser.add_argument("--url", help="Replay against a running API instead of simulating")
+    args = parser.parse_args()
+
+    events = workload(args.requests, args.switches, args.seed)
+    print(f"📊 {len(events)} requests, {len(QUESTIONS)} questions, {args.switches} chart switches per question")
+    for label, structured in (("legacy (hint in question)", False), ("structured chart_type", True)):
+        if args.url:
+            result = replay(events, structured, args.url)
+        else:
+            result = simulate(events, structured, args.retrieval_ms, args.llm_ms)
+        print(f"\n{label}:")
+        for key, value in result.items():
+            print(f"  {key:22} {value}")
+
+
+if __name__ == "__main__":
+    main()
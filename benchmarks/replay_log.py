@@ -0,0 +1,189 @@
+# Replay a captured query log against a running API to reproduce production load
+"""
+Reads JSONL records written by the query log (``QUERY_LOG_PATH``: every
+worker's ``queries.{pid}.jsonl`` file and their rotated ``.1``, ``.2`` files,
+given as files, glob patterns or the log directory) and re-sends each question to ``/ask`` or
+``/jobs`` with the original chart type, either as fast as ``--concurrency``
+allows or paced by the recorded arrival times (``--speed``).
+
+For deterministic LLM behaviour, point the API at the mock LLM serving the
+recorded responses from the same log:
+
+    python mock_llm_server.py --port 9000 --replay-log logs --replay-latency
+    LLM_BASE_URL=http://127.0.0.1:9000 RATE_LIMIT_PER_MINUTE=0 python app/main.py
+    python benchmarks/replay_log.py logs --concurrency 8 --speed 2
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def expand_log_paths(paths):
+    """Files named directly, matched by a glob pattern, or ``*.jsonl*`` inside a directory."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "*.jsonl*"))))
+        elif glob.has_magic(path):
+            files.extend(sorted(glob.glob(path)))
+        else:
+            files.append(path)
+    return list(dict.fromkeys(files))
+
+
+def load_records(paths, include_errors: bool = False, limit: int = None):
+    """Logged /ask and job records from every worker's log, in arrival order."""
+    records = []
+    for path in expand_log_paths(paths):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if not record.get("question"):
+                    continue
+                if record.get("status") != "ok" and not include_errors:
+                    continue
+                records.append(record)
+    records.sort(key=lambda r: r.get("ts", 0))
+    return records[:limit] if limit else records
+
+
+def percentile(values, pct: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct))]
+
+
+class Replayer:
+    def __init__(self, base_url: str, endpoint: str, api_key: str = None, timeout: float = 120,
+                 poll_interval: float = 0.25):
+        self.base_url = base_url.rstrip("/")
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.headers = {"X-API-Key": api_key} if api_key else {}
+        self._local = threading.local()
+
+    @property
+    def session(self) -> requests.Session:
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def _ask(self, body: dict):
+        res = self.session.post(f"{self.base_url}/ask", json=body, headers=self.headers, timeout=self.timeout)
+        return res.status_code, res.json() if res.headers.get("content-type", "").startswith("application/json") else {}
+
+    def _job(self, body: dict):
+        res = self.session.post(f"{self.base_url}/jobs", json=body, headers=self.headers, timeout=self.timeout)
+        if res.status_code != 202:
+            return res.status_code, {}
+        job = res.json()
+        deadline = time.monotonic() + self.timeout
+        while job["status"] in ("queued", "running") and time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            job = self.session.get(f"{self.base_url}/jobs/{job['job_id']}", timeout=self.timeout).json()
+        if job["status"] == "succeeded":
+            return 200, job["result"]
+        return job.get("status_code") or 599, {}
+
+    def send(self, record: dict) -> dict:
+        body = {"question": record["question"], "chart_type": record.get("chart_type")}
+        started = time.perf_counter()
+        try:
+            status, data = self._job(body) if self.endpoint == "jobs" else self._ask(body)
+        except requests.RequestException as e:
+            status, data = 599, {"error": str(e)}
+        return {
+            "status": status,
+            "ms": (time.perf_counter() - started) * 1000,
+            "same_sql": bool(data.get("sql")) and data.get("sql") == record.get("sql"),
+            "cached_sql": bool(data.get("cached", {}).get("sql")),
+            "row_count": len(data.get("rows", [])),
+        }
+
+
+def replay(records, replayer: Replayer, concurrency: int, speed: float):
+    """Send every record; with ``speed`` > 0 each is released at its recorded offset / speed."""
+    start = time.monotonic()
+    first_ts = records[0].get("ts", 0) if records else 0
+
+    def run(record):
+        if speed > 0:
+            delay = (record.get("ts", first_ts) - first_ts) / speed - (time.monotonic() - start)
+            if delay > 0:
+                time.sleep(delay)
+        return replayer.send(record)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(run, records))
+    return results, time.monotonic() - start
+
+
+def report(records, results, wall_seconds: float) -> dict:
+    ok = [r for r in results if r["status"] == 200]
+    latencies = [r["ms"] for r in ok]
+    statuses = {}
+    for r in results:
+        statuses[r["status"]] = statuses.get(r["status"], 0) + 1
+    recorded = [rec["timings"]["total_ms"] for rec in records if rec.get("timings", {}).get("total_ms")]
+    return {
+        "requests": len(results),
+        "statuses": statuses,
+        "throughput_rps": round(len(results) / wall_seconds, 2) if wall_seconds else None,
+        "latency_ms": {p: round(percentile(latencies, q), 1) if latencies else None
+                       for p, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))},
+        "recorded_latency_ms": {p: round(percentile(recorded, q), 1) if recorded else None
+                                for p, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))},
+        "same_sql_rate": round(sum(r["same_sql"] for r in ok) / len(ok), 4) if ok else None,
+        "sql_cache_hit_rate": round(sum(r["cached_sql"] for r in ok) / len(ok), 4) if ok else None,
+        "wall_seconds": round(wall_seconds, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a captured query log against the API")
+    parser.add_argument("logs", nargs="+", help="Query log files, glob patterns or directories, e.g. logs or 'logs/queries.*.jsonl*'")
+    parser.add_argument("--url", default=os.getenv("API_URL", "http://localhost:8001"))
+    parser.add_argument("--endpoint", choices=("ask", "jobs"), default="ask")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--speed", type=float, default=0.0,
+                        help="Replay at recorded arrival times divided by this factor (0 = as fast as possible)")
+    parser.add_argument("--limit", type=int, help="Replay only the first N records")
+    parser.add_argument("--include-errors", action="store_true", help="Also replay records that failed")
+    parser.add_argument("--api-key", help="Client key sent as X-API-Key")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    records = load_records(args.logs, args.include_errors, args.limit)
+    if not records:
+        print("❌ No replayable records found")
+        sys.exit(1)
+    print(f"🔁 Replaying {len(records)} questions against {args.url}/{args.endpoint} "
+          f"(concurrency {args.concurrency}, speed {args.speed or 'max'})")
+    replayer = Replayer(args.url, args.endpoint, args.api_key, args.timeout)
+    results, wall_seconds = replay(records, replayer, max(1, args.concurrency), args.speed)
+    summary = report(records, results, wall_seconds)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        for key, value in summary.items():
+            print(f"  {key:20} {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,12 +3,13 @@
 Vector Relation Map & LLM Configuration Checker
 This script analyzes and displays:
 1. Vector embeddings and their relationships for the database schema stored in the FAISS index
+   (nearest neighbours via retriever/analysis.py; --export writes the neighbor graph)
 2. LLM configuration and environment variables for diagnostics
 """
 
+import argparse
 import os
 import sys
-import pickle
 import numpy as np
 from pathlib import Path
 
@@ -16,10 +17,12 @@ from pathlib import Path
 sys.path.append(str(Path(__file__).parent))
 
 try:
-    import faiss
-    from sentence_transformers import SentenceTransformer
     from app.config import Config
     from app.llm_client import LLMClient
+    from retriever.analysis import (DEFAULT_BLOCK_SIZE, export_neighbor_graph, nearest_neighbors,
+                                    query_matches, similarity_block, top_pairs)
+    from retriever.query_index import _get_server_client, get_model
+    from retriever.vector_store import load_vector_store
 except ImportError as e:
     print(f"❌ Missing dependency: {e}")
     print("Please install required packages: pip install faiss-cpu sentence-transformers")
@@ -101,7 +104,7 @@ def print_llm_configuration():
     print()
 
 def load_vector_index():
-    """Load the FAISS index and metadata"""
+    """Load the memory-mapped embedding store and metadata"""
     config = Config()
     index_path = config.VECTOR_STORE_PATH
     
@@ -110,41 +113,74 @@ def load_vector_index():
         print("Run 'python retriever/build_index.py' first to create the index.")
         return None, None, None
     
-    # Load FAISS index
-    index_file = os.path.join(index_path, "schema.index")
-    if not os.path.exists(index_file):
-        print(f"❌ FAISS index file not found: {index_file}")
-        return None, None, None
-    
-    index = faiss.read_index(index_file)
-    
-    # Load metadata
-    metadata_file = os.path.join(index_path, "table_names.pkl")
-    if not os.path.exists(metadata_file):
-        print(f"❌ Metadata file not found: {metadata_file}")
+    try:
+        store = load_vector_store(index_path, config.DATABASE_PATH)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"❌ {e}")
         return None, None, None
     
-    with open(metadata_file, "rb") as f:
-        schema_texts, table_names = pickle.load(f)
-    
-    return index, schema_texts, table_names
+    return store, store.schema_texts, store.table_names
 
-def calculate_similarity_matrix(index, schema_texts, model):
-    """Calculate similarity matrix between all schema elements"""
-    # Get all vectors from the index
-    vectors = index.reconstruct_n(0, index.ntotal)
-    
-    # Calculate cosine similarity matrix
-    # Normalize vectors for cosine similarity
-    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
-    normalized_vectors = vectors / norms
+# Beyond these sizes the per-table listing and the heatmap are summarised
+SCHEMA_LIST_MAX = 50
+HEATMAP_MAX_TABLES = 40
+
+TEST_QUERIES = [
+    "customer information",
+    "sales data",
+    "product details",
+    "order history",
+    "payment records"
+]
+
+def encode_test_queries(queries):
+    """Encode all test queries in one batch, via the embedding server when configured"""
+    client = _get_server_client()
+    if client is not None:
+        try:
+            response = client.post("/encode", json={"texts": queries})
+            response.raise_for_status()
+            return np.asarray(response.json()["embeddings"], dtype=np.float32)
+        except Exception as e:
+            print(f"⚠️ Embedding server unavailable, encoding in-process: {e}")
+    return get_model().encode(queries)
+
+def print_heatmap(index, table_names):
+    """Print a similarity heatmap for small catalogs"""
+    print("🌡️  SIMILARITY HEATMAP")
+    print("-" * 25)
+    if len(table_names) > HEATMAP_MAX_TABLES:
+        print(f"  Skipped for {len(table_names)} tables (limit {HEATMAP_MAX_TABLES}); use --export for the neighbor graph")
+        print()
+        return
+    similarity_matrix = similarity_block(index.vectors())
+    print("     ", end="")
+    for i, table in enumerate(table_names):
+        print(f"{i+1:3d}", end="")
+    print()
     
-    # Compute similarity matrix
-    similarity_matrix = np.dot(normalized_vectors, normalized_vectors.T)
+    for i, table in enumerate(table_names):
+        print(f"{i+1:2d}. ", end="")
+        for j in range(len(table_names)):
+            sim = similarity_matrix[i][j]
+            if i == j:
+                print(" ██", end="")  # Self-similarity
+            elif sim > 0.8:
+                print(" ▓▓", end="")  # High similarity
+            elif sim > 0.6:
+                print(" ▒▒", end="")  # Medium similarity
+            elif sim > 0.4:
+                print(" ░░", end="")  # Low similarity
+            else:
+                print(" ··", end="")  # Very low similarity
+        print(f" {table}")
     
-    return similarity_matrix
+    print()
+    print("Legend: ██ Self  ▓▓ High(>0.8)  ▒▒ Med(>0.6)  ░░ Low(>0.4)  ·· VeryLow")
+    print()
 
-def print_vector_relation_map():
+def print_vector_relation_map(neighbors=10, top=10, export_path=None, min_similarity=None,
+                              block_size=DEFAULT_BLOCK_SIZE):
     """Print the vector relation map"""
     print("🔍 VECTOR RELATION MAP ANALYZER")
     print("=" * 50)
@@ -167,105 +203,73 @@ def print_vector_relation_map():
     print(f"📐 Vector dimension: {index.d}")
     print()
     
-    # Load embedding model
-    print("🤖 Loading embedding model...")
-    model = SentenceTransformer(f"sentence-transformers/{config.EMBEDDING_MODEL}")
-    print("✅ Model loaded")
-    print()
-    
     # Display schema information
     print("📋 DATABASE SCHEMA MAPPING")
     print("-" * 30)
-    for i, (table_name, schema_text) in enumerate(zip(table_names, schema_texts)):
+    for i, (table_name, schema_text) in enumerate(zip(table_names[:SCHEMA_LIST_MAX], schema_texts)):
         print(f"{i+1:2d}. {table_name}")
         print(f"    📝 {schema_text}")
         print()
+    if len(table_names) > SCHEMA_LIST_MAX:
+        print(f"    ... and {len(table_names) - SCHEMA_LIST_MAX} more tables")
+        print()
     
-    # Calculate similarity matrix
+    # Nearest neighbours per table, without the full n x n matrix
     print("🧮 CALCULATING VECTOR SIMILARITIES")
     print("-" * 35)
-    similarity_matrix = calculate_similarity_matrix(index, schema_texts, model)
+    k = max(neighbors, top)
+    sims, ids = nearest_neighbors(index.vectors(), k=k, block_size=block_size)
+    print(f"✅ {sims.shape[1]} nearest neighbors for each of {len(table_names)} tables")
+    print()
     
     # Display similarity relationships
     print("🔗 TABLE RELATIONSHIPS (Cosine Similarity)")
     print("-" * 45)
-    
-    # Find most similar pairs
-    similarities = []
-    for i in range(len(table_names)):
-        for j in range(i+1, len(table_names)):
-            sim = similarity_matrix[i][j]
-            similarities.append((i, j, sim, table_names[i], table_names[j]))
-    
-    # Sort by similarity (descending)
-    similarities.sort(key=lambda x: x[2], reverse=True)
-    
-    print("Top 10 Most Similar Table Pairs:")
-    for i, (idx1, idx2, sim, table1, table2) in enumerate(similarities[:10]):
-        print(f"{i+1:2d}. {table1} ↔ {table2}")
+    print(f"Top {top} Most Similar Table Pairs:")
+    for i, (idx1, idx2, sim) in enumerate(top_pairs(sims, ids, limit=top)):
+        print(f"{i+1:2d}. {table_names[idx1]} ↔ {table_names[idx2]}")
         print(f"    📊 Similarity: {sim:.4f}")
         print()
     
-    # Display similarity matrix (heatmap style)
-    print("🌡️  SIMILARITY HEATMAP")
-    print("-" * 25)
-    print("     ", end="")
-    for i, table in enumerate(table_names):
-        print(f"{i+1:3d}", end="")
-    print()
-    
-    for i, table in enumerate(table_names):
-        print(f"{i+1:2d}. ", end="")
-        for j in range(len(table_names)):
-            sim = similarity_matrix[i][j]
-            if i == j:
-                print(" ██", end="")  # Self-similarity
-            elif sim > 0.8:
-                print(" ▓▓", end="")  # High similarity
-            elif sim > 0.6:
-                print(" ▒▒", end="")  # Medium similarity
-            elif sim > 0.4:
-                print(" ░░", end="")  # Low similarity
-            else:
-                print(" ··", end="")  # Very low similarity
-        print(f" {table}")
+    if export_path:
+        edges = export_neighbor_graph(export_path, table_names, sims[:, :neighbors], ids[:, :neighbors],
+                                      min_similarity)
+        print(f"💾 Exported {edges} neighbor edges to {export_path}")
+        print()
     
-    print()
-    print("Legend: ██ Self  ▓▓ High(>0.8)  ▒▒ Med(>0.6)  ░░ Low(>0.4)  ·· VeryLow")
-    print()
+    print_heatmap(index, table_names)
     
     # Test query similarity
     print("🔍 QUERY SIMILARITY TEST")
     print("-" * 25)
-    test_queries = [
-        "customer information",
-        "sales data",
-        "product details",
-        "order history",
-        "payment records"
-    ]
-    
-    for query in test_queries:
+    query_vectors = encode_test_queries(TEST_QUERIES)
+    for query, matches in zip(TEST_QUERIES, query_matches(index, query_vectors, top_k=3)):
         print(f"Query: '{query}'")
-        query_vector = model.encode([query])
-        D, I = index.search(query_vector, min(3, len(table_names)))
-        
         print("  Top matches:")
-        for j, (distance, idx) in enumerate(zip(D[0], I[0])):
-            similarity = 1 / (1 + distance)  # Convert distance to similarity
+        for j, (idx, similarity) in enumerate(matches):
             print(f"    {j+1}. {table_names[idx]} (similarity: {similarity:.4f})")
         print()
     
     print("✅ Vector relation map analysis complete!")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Vector relation map & LLM configuration checker")
+    parser.add_argument("--neighbors", type=int, default=10, help="Nearest neighbors kept per table")
+    parser.add_argument("--top", type=int, default=10, help="Most similar table pairs to print")
+    parser.add_argument("--export", help="Write the neighbor graph to this file (.csv edges or .jsonl)")
+    parser.add_argument("--min-similarity", type=float, help="Only export edges at or above this similarity")
+    parser.add_argument("--block-size", type=int, default=DEFAULT_BLOCK_SIZE,
+                        help="Rows per similarity block when FAISS is not installed")
+    parser.add_argument("--skip-llm", action="store_true", help="Skip the LLM configuration diagnostics")
+    args = parser.parse_args()
     try:
         # Print LLM configuration first
-        print_llm_configuration()
-        print("\n" + "="*70 + "\n")
+        if not args.skip_llm:
+            print_llm_configuration()
+            print("\n" + "="*70 + "\n")
         
         # Then print vector relation map
-        print_vector_relation_map()
+        print_vector_relation_map(args.neighbors, args.top, args.export, args.min_similarity, args.block_size)
     except KeyboardInterrupt:
         print("\n❌ Analysis interrupted by user")
     except Exception as e:
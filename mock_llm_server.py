@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Mock LLM Server
+A local stand-in for the chat-completions endpoint used by LLMClient, for
+exercising retries, hedging and the circuit breaker without a real provider.
+
+With --replay-log it answers prompts seen in a query log with the recorded
+LLM responses (matched by prompt hash), optionally with recorded latencies,
+so a captured workload can be replayed deterministically.
+
+Usage:
+    python mock_llm_server.py --port 9000 --latency 0.2 --jitter 1.5 --fail-rate 0.2
+    python mock_llm_server.py --port 9000 --replay-log logs --replay-latency
+    LLM_BASE_URL=http://127.0.0.1:9000 python app/main.py
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_SQL = "SELECT 1 AS value LIMIT 100;"
+
+
+def load_recorded_responses(paths):
+    """prompt sha1 -> (response, latency seconds) from query log records."""
+    recorded = {}
+    files = []
+    for path in paths or []:
+        # A directory stands for every worker's log in it (queries.{pid}.jsonl and rotations)
+        files.extend(sorted(glob.glob(os.path.join(path, "*.jsonl*"))) if os.path.isdir(path)
+                     else sorted(glob.glob(path)) if glob.has_magic(path) else [path])
+    for path in files:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                for call in record.get("llm_calls", []):
+                    if call.get("response") and call.get("prompt_sha1"):
+                        recorded[call["prompt_sha1"]] = (call["response"], call.get("ms", 0) / 1000)
+    return recorded
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    """Answers POST /llm/chat/completions (and /chat/completions)."""
+
+    settings = None
+    recorded = {}
+    counter_lock = threading.Lock()
+    request_count = 0
+    replay_hits = 0
+
+    def log_message(self, format, *args):
+        if not self.settings.quiet:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok", "requests": MockLLMHandler.request_count,
+                                  "recorded_responses": len(self.recorded),
+                                  "replay_hits": MockLLMHandler.replay_hits})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path not in ("/llm/chat/completions", "/chat/completions"):
+            self._send_json(404, {"error": "not found"})
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        with MockLLMHandler.counter_lock:
+            MockLLMHandler.request_count += 1
+            request_number = MockLLMHandler.request_count
+
+        settings = self.settings
+        prompts = [m.get("content", "") for m in payload.get("messages", []) if m.get("role") == "user"]
+        replayed = self.recorded.get(hashlib.sha1(prompts[-1].encode("utf-8")).hexdigest()) if prompts else None
+
+        # Optional slow tail: a fraction of requests take latency * jitter
+        delay = settings.latency
+        if replayed and settings.replay_latency:
+            delay = replayed[1]
+        elif settings.slow_rate and random.random() < settings.slow_rate:
+            delay *= settings.jitter
+        time.sleep(delay)
+
+        if request_number <= settings.fail_first or random.random() < settings.fail_rate:
+            self._send_json(settings.fail_status, {"error": "mock failure"})
+            return
+
+        if replayed:
+            with MockLLMHandler.counter_lock:
+                MockLLMHandler.replay_hits += 1
+            content = replayed[0]
+        else:
+            content = f"```sql\n{settings.sql}\n```"
+        self._send_json(200, {
+            "id": f"mock-{request_number}",
+            "model": payload.get("model", "mock"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}}],
+        })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a mock chat-completions LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", type=float, default=0.1, help="Base response latency in seconds")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Fraction of requests that are slow")
+    parser.add_argument("--jitter", type=float, default=10.0, help="Latency multiplier for slow requests")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of requests that fail")
+    parser.add_argument("--fail-first", type=int, default=0, help="Fail the first N requests")
+    parser.add_argument("--fail-status", type=int, default=503, help="HTTP status used for failures")
+    parser.add_argument("--sql", default=DEFAULT_SQL, help="SQL returned in every completion")
+    parser.add_argument("--replay-log", action="append",
+                        help="Query log file, glob or directory whose recorded LLM responses "
+                             "(QUERY_LOG_RESPONSES=True) are served for matching prompts")
+    parser.add_argument("--replay-latency", action="store_true",
+                        help="Delay replayed responses by their recorded latency instead of --latency")
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args()
+
+    MockLLMHandler.settings = args
+    MockLLMHandler.recorded = load_recorded_responses(args.replay_log)
+    if args.replay_log:
+        print(f"📼 Loaded {len(MockLLMHandler.recorded)} recorded LLM responses")
+    server = ThreadingHTTPServer((args.host, args.port), MockLLMHandler)
+    print(f"🤖 Mock LLM listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n🛑 Mock LLM stopped")
+
+
+if __name__ == "__main__":
+    main()
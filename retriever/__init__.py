@@ -8,14 +8,22 @@ for database schema retrieval using embeddings.
 Modules:
 - build_index: Script to extract and embed table schemas
 - query_index: Function to retrieve relevant tables from the index
+- vector_store: Memory-mapped embedding matrix + JSON metadata storage
+- adaptive: Score-gap cutoff for k and foreign-key expansion of the selection
 """
 
 from .query_index import retrieve_tables
+from .adaptive import adaptive_cutoff, select_tables
 from .build_index import *
+from .vector_store import VectorStore, load_vector_store
 
 __version__ = "1.0.0"
 __author__ = "AI Insight Team"
 
 __all__ = [
-    "retrieve_tables"
+    "retrieve_tables",
+    "adaptive_cutoff",
+    "select_tables",
+    "VectorStore",
+    "load_vector_store"
 ]
@@ -0,0 +1,144 @@
+"""
+Adaptive choice of how many schemas to send to the LLM.
+
+Instead of always taking ``TOP_K_RETRIEVAL`` tables, the ranked candidates
+are cut where the similarity drops sharply (score gap) or once the leading
+candidates hold most of the softmax mass of the scores, so a question about
+one table sends one schema. The selection is then widened through foreign
+keys only where a join would otherwise be impossible: junction tables bring
+the tables they link, and selected tables with no direct key between them
+get the table that bridges them.
+"""
+
+import sqlite3
+import sys
+from pathlib import Path
+from typing import Dict, List, Sequence, Set, Tuple
+
+import numpy as np
+
+# Add parent directory to path to import config
+sys.path.append(str(Path(__file__).parent.parent))
+from app.config import Config
+from app.models import TableInfo
+from app.schema_catalog import foreign_key_neighbors, get_schema_catalog, schema_text, table_map
+
+config = Config()
+
+
+def adaptive_cutoff(similarities: Sequence[float], min_k: int = None, max_k: int = None,
+                    score_gap: float = None, cumulative_mass: float = None,
+                    temperature: float = None) -> int:
+    """Number of leading candidates to keep, given their similarities in descending order."""
+    min_k = config.RETRIEVAL_MIN_K if min_k is None else min_k
+    max_k = config.TOP_K_RETRIEVAL if max_k is None else max_k
+    score_gap = config.RETRIEVAL_SCORE_GAP if score_gap is None else score_gap
+    cumulative_mass = config.RETRIEVAL_CUMULATIVE_MASS if cumulative_mass is None else cumulative_mass
+    temperature = config.RETRIEVAL_SOFTMAX_TEMPERATURE if temperature is None else temperature
+
+    scores = np.asarray(similarities[:max_k], dtype=np.float64)
+    n = len(scores)
+    if n == 0:
+        return 0
+    min_k = max(1, min(min_k, n))
+    weights = np.exp((scores - scores[0]) / max(temperature, 1e-6))
+    mass = np.cumsum(weights) / weights.sum()
+    for k in range(min_k, n):
+        if scores[k - 1] - scores[k] >= score_gap or mass[k - 1] >= cumulative_mass:
+            return k
+    return n
+
+
+def _is_junction(table: TableInfo) -> bool:
+    """Link tables: two or more foreign keys and at most one other non-key column."""
+    fk_columns = {fk.column.lower() for fk in table.foreign_keys}
+    if len(fk_columns) < 2:
+        return False
+    other = [c for c in table.columns if c.name.lower() not in fk_columns and not c.primary_key]
+    return len(other) <= 1
+
+
+def expand_with_foreign_keys(selected: List[str], ranked: List[str] = None, max_added: int = None,
+                             db_path: str = None) -> List[str]:
+    """
+    Tables to add so the selection can be joined: the targets of selected
+    junction tables, then the tables on the shortest foreign-key path between
+    selected pairs that are not yet joined, when the path fits the remaining
+    budget. Paths through tables that also ranked as candidates are preferred.
+    """
+    max_added = config.RETRIEVAL_FK_EXPANSION if max_added is None else max_added
+    if max_added <= 0 or not selected:
+        return []
+    tables = table_map(get_schema_catalog(db_path))
+    rank = {name.lower(): i for i, name in enumerate(ranked or [])}
+    neighbor_cache: Dict[str, Set[str]] = {}
+
+    def neighbors(name: str) -> Set[str]:
+        if name not in neighbor_cache:
+            neighbor_cache[name] = {n.lower() for n in foreign_key_neighbors(name, db_path)}
+        return neighbor_cache[name]
+
+    chosen = [name.lower() for name in selected]
+    added: List[str] = []
+
+    def path(a: str, b: str, members: Set[str] = None) -> List[str]:
+        """Tables between a and b on a shortest FK path (within ``members`` if given); None if unreachable."""
+        previous = {a: None}
+        frontier = [a]
+        while frontier and b not in previous:
+            following = []
+            for current in frontier:
+                for nxt in sorted(neighbors(current), key=lambda t: (rank.get(t, len(rank)), t)):
+                    if nxt not in previous and (members is None or nxt in members):
+                        previous[nxt] = current
+                        following.append(nxt)
+            frontier = following
+        if b not in previous:
+            return None
+        between, node = [], previous[b]
+        while node != a:
+            between.append(node)
+            node = previous[node]
+        return between[::-1]
+
+    for name in chosen:
+        table = tables.get(name)
+        if table is not None and _is_junction(table):
+            for fk in table.foreign_keys:
+                ref = fk.ref_table.lower()
+                if ref not in chosen and ref not in added:
+                    added.append(ref)
+
+    for i, a in enumerate(chosen):
+        for b in chosen[i + 1:]:
+            if path(a, b, set(chosen) | set(added)) is not None:
+                continue
+            bridge = path(a, b)
+            if bridge and len(added) + len(bridge) <= max_added:
+                added.extend(bridge)
+
+    return [tables[name].table_name if name in tables else name for name in added[:max_added]]
+
+
+def select_tables(matches: List[Tuple[str, str]], similarities: Sequence[float],
+                  db_path: str = None) -> List[Tuple[str, str]]:
+    """Adaptive subset of ranked ``(table_name, schema_text)`` matches, plus FK-needed tables."""
+    k = adaptive_cutoff(similarities)
+    selected = list(matches[:k])
+    try:
+        extra = expand_with_foreign_keys([name for name, _ in selected], [name for name, _ in matches],
+                                         db_path=db_path)
+    except (OSError, sqlite3.Error) as e:
+        print(f"⚠️ Foreign-key expansion skipped: {e}")
+        return selected
+    if not extra:
+        return selected
+
+    texts = {name.lower(): text for name, text in matches}
+    tables = table_map(get_schema_catalog(db_path))
+    for name in extra:
+        text = texts.get(name.lower())
+        if text is None and name.lower() in tables:
+            text = schema_text(tables[name.lower()])
+        selected.append((name, text or f"Table: {name}"))
+    return selected
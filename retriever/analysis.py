@@ -0,0 +1,151 @@
+"""
+Similarity analysis over the schema embedding store.
+
+Finds each table's nearest neighbours without materialising the n x n
+similarity matrix: FAISS inner-product self-search when FAISS is installed,
+otherwise blocked NumPy products with ``argpartition`` top-k. Memory stays at
+``block_size x n`` regardless of catalog size, and the neighbour graph can be
+exported for catalogs too large to print.
+
+Usage:
+    from retriever.analysis import nearest_neighbors, top_pairs
+    sims, ids = nearest_neighbors(store.vectors(), k=10)
+    for i, j, sim in top_pairs(sims, ids, limit=10): ...
+"""
+
+import csv
+import json
+from pathlib import Path
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+DEFAULT_BLOCK_SIZE = 1024
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """Row-normalised float32 copy, so inner products are cosine similarities."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.ascontiguousarray(vectors / np.where(norms > 0, norms, 1.0))
+
+
+def _faiss_neighbors(unit: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    import faiss
+
+    index = faiss.IndexFlatIP(unit.shape[1])
+    index.add(unit)
+    sims, ids = index.search(unit, k + 1)
+    # Drop each row's self match (usually first, but not guaranteed with duplicates)
+    keep = ids != np.arange(len(unit))[:, None]
+    out_sims = np.empty((len(unit), k), dtype=np.float32)
+    out_ids = np.empty((len(unit), k), dtype=np.int64)
+    for row in range(len(unit)):
+        out_sims[row] = sims[row][keep[row]][:k]
+        out_ids[row] = ids[row][keep[row]][:k]
+    return out_sims, out_ids
+
+
+def _blocked_neighbors(unit: np.ndarray, k: int, block_size: int) -> Tuple[np.ndarray, np.ndarray]:
+    n = len(unit)
+    out_sims = np.empty((n, k), dtype=np.float32)
+    out_ids = np.empty((n, k), dtype=np.int64)
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        scores = unit[start:stop] @ unit.T
+        scores[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        out_ids[start:stop] = np.take_along_axis(top, order, axis=1)
+        out_sims[start:stop] = np.take_along_axis(top_scores, order, axis=1)
+    return out_sims, out_ids
+
+
+def nearest_neighbors(vectors: np.ndarray, k: int = 10, block_size: int = DEFAULT_BLOCK_SIZE,
+                      use_faiss: bool = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Cosine similarities and ids of each row's ``k`` nearest other rows,
+    best first; both arrays are ``(n, k)``. ``use_faiss=None`` uses FAISS
+    when it is importable.
+    """
+    unit = normalize(vectors)
+    k = min(k, len(unit) - 1)
+    if k <= 0:
+        return np.empty((len(unit), 0), dtype=np.float32), np.empty((len(unit), 0), dtype=np.int64)
+    if use_faiss is None:
+        try:
+            import faiss  # noqa: F401
+            use_faiss = True
+        except ImportError:
+            use_faiss = False
+    if use_faiss:
+        return _faiss_neighbors(unit, k)
+    return _blocked_neighbors(unit, k, max(1, block_size))
+
+
+def top_pairs(sims: np.ndarray, ids: np.ndarray, limit: int = 10) -> List[Tuple[int, int, float]]:
+    """
+    Most similar distinct pairs ``(i, j, similarity)`` with ``i < j`` from a
+    neighbour graph. Exact for ``limit`` up to the graph's k: a pair among the
+    global top ``limit`` is always within both rows' top ``limit``.
+    """
+    rows = np.repeat(np.arange(len(ids)), ids.shape[1])
+    cols = ids.ravel()
+    values = sims.ravel()
+    valid = cols >= 0
+    first, second = np.minimum(rows, cols)[valid], np.maximum(rows, cols)[valid]
+    values = values[valid]
+    pairs = {}
+    for i, j, sim in zip(first.tolist(), second.tolist(), values.tolist()):
+        if i != j:
+            pairs[(i, j)] = sim
+    ranked = sorted(pairs.items(), key=lambda item: item[1], reverse=True)[:limit]
+    return [(i, j, sim) for (i, j), sim in ranked]
+
+
+def similarity_block(vectors: np.ndarray, rows: Sequence[int] = None) -> np.ndarray:
+    """Cosine similarities of ``rows`` (default all) against every vector; for small views like heatmaps."""
+    unit = normalize(vectors)
+    subset = unit if rows is None else unit[np.asarray(rows, dtype=np.int64)]
+    return subset @ unit.T
+
+
+def query_matches(store, query_vectors: np.ndarray, top_k: int = 3) -> List[List[Tuple[int, float]]]:
+    """For a batch of encoded queries, the ``top_k`` store rows and their cosine similarity."""
+    query_vectors = np.atleast_2d(np.asarray(query_vectors, dtype=np.float32))
+    _, ids = store.search(query_vectors, min(top_k, store.ntotal))
+    results = []
+    for vector, row in zip(query_vectors, ids):
+        valid = [int(i) for i in row if i >= 0]
+        sims = store.cosine_similarities(vector, valid) if valid else []
+        results.append(list(zip(valid, [float(s) for s in sims])))
+    return results
+
+
+def export_neighbor_graph(path: str, table_names: List[str], sims: np.ndarray, ids: np.ndarray,
+                          min_similarity: float = None) -> int:
+    """
+    Write the neighbour graph as CSV edges (``.csv``: source,target,similarity)
+    or JSON Lines (anything else: one ``{"table", "neighbors"}`` object per
+    table). Returns the number of edges written.
+    """
+    path = Path(path)
+    if path.parent:
+        path.parent.mkdir(parents=True, exist_ok=True)
+    edges = 0
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f) if path.suffix.lower() == ".csv" else None
+        if writer:
+            writer.writerow(["source", "target", "similarity"])
+        for i, (row_sims, row_ids) in enumerate(zip(sims, ids)):
+            neighbors = [(table_names[j], round(float(s), 6)) for s, j in zip(row_sims, row_ids)
+                         if j >= 0 and (min_similarity is None or s >= min_similarity)]
+            edges += len(neighbors)
+            if writer:
+                writer.writerows((table_names[i], name, sim) for name, sim in neighbors)
+            else:
+                f.write(json.dumps({"table": table_names[i],
+                                    "neighbors": [{"table": name, "similarity": sim} for name, sim in neighbors]},
+                                   ensure_ascii=False) + "\n")
+    return edges
@@ -0,0 +1,110 @@
+"""
+Dynamic micro-batching for sentence-transformer encodes.
+
+Callers submit single texts; a background thread gathers whatever arrives
+within ``max_wait_ms`` (up to ``max_batch_size`` texts) and runs one
+``model.encode`` forward pass for the whole batch. ``stats()`` reports batch
+sizes and the queueing delay that batching adds.
+"""
+
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+from typing import List
+
+import numpy as np
+
+
+class EncodeBatcher:
+    """Collects concurrent encode requests and serves them in batches."""
+
+    def __init__(self, model, max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        self.model = model
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._batch_sizes = Counter()
+        self._queue_delays = deque(maxlen=1000)
+        self._encode_times = deque(maxlen=1000)
+        self._thread = threading.Thread(target=self._run, name="encode-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, text: str) -> Future:
+        """Queue one text; the future resolves to its embedding vector."""
+        future = Future()
+        self._queue.put((text, future, time.monotonic()))
+        return future
+
+    def encode(self, texts: List[str], timeout: float = None) -> np.ndarray:
+        """Encode texts through the shared batch queue and stack the results."""
+        futures = [self.submit(text) for text in texts]
+        return np.vstack([f.result(timeout=timeout) for f in futures])
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _record(self, batch, started: float, finished: float):
+        with self._stats_lock:
+            self._batches += 1
+            self._items += len(batch)
+            self._batch_sizes[len(batch)] += 1
+            self._queue_delays.extend(started - submitted for _, _, submitted in batch)
+            self._encode_times.append(finished - started)
+
+    def stats(self) -> dict:
+        """Batch size distribution and added queueing delay (milliseconds)."""
+        with self._stats_lock:
+            delays = sorted(self._queue_delays)
+            encode_times = list(self._encode_times)
+            sizes = dict(sorted(self._batch_sizes.items()))
+            batches, items = self._batches, self._items
+
+        def percentile(values, pct):
+            if not values:
+                return 0.0
+            return round(values[min(len(values) - 1, int(len(values) * pct))] * 1000, 3)
+
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "batches": batches,
+            "items": items,
+            "avg_batch_size": round(items / batches, 3) if batches else 0.0,
+            "batch_size_histogram": sizes,
+            "queue_delay_ms_p50": percentile(delays, 0.50),
+            "queue_delay_ms_p95": percentile(delays, 0.95),
+            "queue_delay_ms_max": percentile(delays, 1.0),
+            "encode_ms_avg": round(sum(encode_times) / len(encode_times) * 1000, 3) if encode_times else 0.0,
+            "pending": self._queue.qsize(),
+        }
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            texts = [text for text, _, _ in batch]
+            started = time.monotonic()
+            try:
+                vectors = self.model.encode(texts, convert_to_numpy=True)
+                vectors = np.atleast_2d(vectors)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            self._record(batch, started, time.monotonic())
+            for (_, future, _), vector in zip(batch, vectors):
+                future.set_result(vector)
@@ -1,14 +1,21 @@
-import sqlite3
+import argparse
 import faiss
+import multiprocessing
 import os
-import pickle
 import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from pathlib import Path
+
+import numpy as np
 from sentence_transformers import SentenceTransformer
 
 # Add parent directory to path to import config
 sys.path.append(str(Path(__file__).parent.parent))
 from app.config import Config
+from app.schema_catalog import get_schema_catalog, schema_text
+from retriever.vector_store import (EMBEDDINGS_FILE, LEGACY_INDEX_FILE, commit_vector_store,
+                                    create_matrix_file, save_vector_store)
 
 # Initialize configuration
 config = Config()
@@ -17,48 +24,210 @@ DB_PATH = config.DATABASE_PATH
 INDEX_PATH = config.VECTOR_STORE_PATH
 MODEL_NAME = f"sentence-transformers/{config.EMBEDDING_MODEL}"
 
-os.makedirs(INDEX_PATH, exist_ok=True)
-
-# Step 1: Connect and extract table schemas
-conn = sqlite3.connect(DB_PATH)
-cursor = conn.cursor()
-
-cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-tables = [row[0] for row in cursor.fetchall()]
-
-schema_texts = []
-table_names = []
-
-for table in tables:
-    cursor.execute(f"PRAGMA table_info({table});")
-    cols = [row[1] for row in cursor.fetchall()]
-    schema_str = f"Table: {table} | Columns: {', '.join(cols)}"
-    schema_texts.append(schema_str)
-    table_names.append(table)
-
-conn.close()
-
-# Step 2: Embed using sentence-transformer
-model = SentenceTransformer(MODEL_NAME)
-embeddings = model.encode(schema_texts, convert_to_numpy=True)
-
-# Step 3: Store in FAISS
-if len(schema_texts) == 0:
-    print("❌ No tables found in database!")
-    exit(1)
-
-if embeddings.ndim == 1:
-    # If only one schema, reshape to 2D
-    embeddings = embeddings.reshape(1, -1)
-
-dimension = embeddings.shape[1]
-index = faiss.IndexFlatL2(dimension)
-index.add(embeddings)
-
-faiss.write_index(index, os.path.join(INDEX_PATH, "schema.index"))
-
-# Also save metadata
-with open(os.path.join(INDEX_PATH, "table_names.pkl"), "wb") as f:
-    pickle.dump((schema_texts, table_names), f)
 
-print("✅ Vector index built and stored.")
+def extract_schemas(db_path=DB_PATH):
+    """Return (schema_texts, table_names) for every table in the database."""
+    catalog = get_schema_catalog(db_path)
+    tables = [table for table in catalog.tables if table.kind == "table"]
+    schema_texts = [schema_text(table) for table in tables]
+    table_names = [table.table_name for table in tables]
+    return schema_texts, table_names
+
+
+def _flat_index_header(dimension, count):
+    """
+    Serialized ``IndexFlatL2`` header for ``count`` vectors, taken from an empty
+    index so it matches the installed FAISS. None if the layout is not the
+    known one (header, then the float count as int64, then the raw floats).
+    """
+    header = bytearray(faiss.serialize_index(faiss.IndexFlatL2(dimension)).tobytes())
+    if header[:4] != b"IxF2" or len(header) < 20 or header[-8:] != bytes(8) or header[8:16] != bytes(8):
+        return None
+    header[8:16] = int(count).to_bytes(8, "little")
+    header[-8:] = (int(count) * dimension).to_bytes(8, "little")
+    return bytes(header)
+
+
+def write_faiss_copy(index_path, embeddings, chunk_size=65536):
+    """
+    Keep a FAISS copy for tooling that works with native indexes. The file is
+    streamed chunk by chunk from ``embeddings`` (normally the memory-mapped
+    matrix), so no index holding every vector is built in RAM.
+    """
+    count, dimension = embeddings.shape
+    path = os.path.join(index_path, LEGACY_INDEX_FILE)
+    header = _flat_index_header(dimension, count)
+    if header is None:
+        print("⚠️ Unknown FAISS index layout, building the FAISS copy in memory")
+        index = faiss.IndexFlatL2(dimension)
+        for start in range(0, count, chunk_size):
+            index.add(np.ascontiguousarray(embeddings[start:start + chunk_size], dtype=np.float32))
+        faiss.write_index(index, path)
+        return
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        for start in range(0, count, chunk_size):
+            f.write(np.ascontiguousarray(embeddings[start:start + chunk_size], dtype="<f4").tobytes())
+    os.replace(tmp_path, path)
+
+
+def build_index(db_path=DB_PATH, index_path=INDEX_PATH):
+    os.makedirs(index_path, exist_ok=True)
+
+    # Step 1: Extract table schemas from the shared catalog
+    schema_texts, table_names = extract_schemas(db_path)
+    if len(schema_texts) == 0:
+        print("❌ No tables found in database!")
+        exit(1)
+
+    # Step 2: Embed using sentence-transformer
+    model = SentenceTransformer(MODEL_NAME)
+    embeddings = model.encode(schema_texts, convert_to_numpy=True)
+
+    if embeddings.ndim == 1:
+        # If only one schema, reshape to 2D
+        embeddings = embeddings.reshape(1, -1)
+
+    # Step 3: Store the memory-mappable matrix and its JSON metadata
+    save_vector_store(index_path, embeddings, schema_texts, table_names,
+                      model_name=config.EMBEDDING_MODEL, dtype=config.EMBEDDING_DTYPE)
+
+    # Step 4: Keep a FAISS copy for tooling that works with native indexes, streamed from the stored matrix
+    del embeddings
+    write_faiss_copy(index_path, np.load(os.path.join(index_path, EMBEDDINGS_FILE), mmap_mode="r"))
+
+    print(f"✅ Vector index built and stored ({len(table_names)} tables, {config.EMBEDDING_DTYPE}).")
+
+
+# --- Parallel build -------------------------------------------------------
+# Each worker process loads its own model once; chunks are encoded in the
+# workers and written straight into the preallocated .npy, so the parent
+# never holds more than one chunk of embeddings.
+
+_worker_model = None
+
+
+def _init_encoder(model_name, threads):
+    global _worker_model
+    try:
+        import torch
+
+        # Split the cores between workers instead of every process using all of them
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    _worker_model = SentenceTransformer(model_name)
+
+
+def _encode_chunk(start, texts, matrix_path=None):
+    """Encode one chunk; write it into ``matrix_path`` at ``start`` or return it."""
+    embeddings = _worker_model.encode(texts, convert_to_numpy=True)
+    if embeddings.ndim == 1:
+        embeddings = embeddings.reshape(1, -1)
+    if matrix_path is None:
+        return embeddings
+    matrix = np.lib.format.open_memmap(matrix_path, mode="r+")
+    matrix[start:start + len(texts)] = embeddings
+    matrix.flush()
+    del matrix
+    return len(texts)
+
+
+def _introspect(db_path):
+    return extract_schemas(db_path)
+
+
+def build_index_parallel(db_paths, index_path=INDEX_PATH, workers=None, chunk_size=None):
+    """
+    Build one index over ``db_paths`` with a pool of ``workers`` processes.
+    Table names stay unqualified; when more than one database is indexed, the
+    database file stem of every row is kept in ``table_databases`` so serving
+    can restrict retrieval to the database it queries.
+    """
+    workers = max(1, workers or config.INDEX_BUILD_WORKERS)
+    chunk_size = max(1, chunk_size or config.INDEX_BUILD_CHUNK_SIZE)
+    db_paths = list(db_paths)
+    started = time.perf_counter()
+    # spawn: forked children would inherit the parent's torch/tokenizer thread state
+    context = multiprocessing.get_context("spawn")
+    threads = max(1, (os.cpu_count() or 1) // workers)
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_encoder, initargs=(MODEL_NAME, threads)) as pool:
+        # Step 1: Introspect databases in parallel
+        schema_texts, table_names, table_databases = [], [], []
+        for db_path, (texts, names) in zip(db_paths, pool.map(_introspect, db_paths)):
+            print(f"📋 {db_path}: {len(names)} tables")
+            schema_texts.extend(texts)
+            table_names.extend(names)
+            table_databases.extend([Path(db_path).stem] * len(names))
+        if len(schema_texts) == 0:
+            print("❌ No tables found in database!")
+            exit(1)
+        introspect_seconds = time.perf_counter() - started
+
+        # Step 2: First chunk fixes the dimension, then stream the rest into the matrix
+        encode_started = time.perf_counter()
+        chunks = [(start, schema_texts[start:start + chunk_size])
+                  for start in range(0, len(schema_texts), chunk_size)]
+        first = pool.submit(_encode_chunk, *chunks[0]).result()
+        matrix_path = create_matrix_file(index_path, len(schema_texts), first.shape[1], config.EMBEDDING_DTYPE)
+        matrix = np.lib.format.open_memmap(matrix_path, mode="r+")
+        matrix[:len(first)] = first
+        matrix.flush()
+        del matrix, first
+
+        done_rows, done_chunks = len(chunks[0][1]), 1
+        pending = set()
+        remaining = iter(chunks[1:])
+        # Keep a couple of chunks queued per worker so texts are not all pickled up front
+        for start, texts in remaining:
+            pending.add(pool.submit(_encode_chunk, start, texts, matrix_path))
+            if len(pending) >= workers * 2:
+                break
+        while pending:
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                done_rows += future.result()
+                done_chunks += 1
+                nxt = next(remaining, None)
+                if nxt is not None:
+                    pending.add(pool.submit(_encode_chunk, nxt[0], nxt[1], matrix_path))
+            elapsed = time.perf_counter() - encode_started
+            print(f"⏳ {done_chunks}/{len(chunks)} chunks, {done_rows}/{len(schema_texts)} tables "
+                  f"({done_rows / elapsed:.0f} tables/s)")
+        encode_seconds = time.perf_counter() - encode_started
+
+    # Step 3: Publish the matrix and metadata, then the FAISS copy
+    extra = {"databases": db_paths}
+    if len(db_paths) > 1:
+        extra["table_databases"] = table_databases
+    commit_vector_store(index_path, matrix_path, schema_texts, table_names, model_name=config.EMBEDDING_MODEL,
+                        extra=extra)
+    faiss_started = time.perf_counter()
+    write_faiss_copy(index_path, np.load(os.path.join(index_path, EMBEDDINGS_FILE), mmap_mode="r"))
+    faiss_seconds = time.perf_counter() - faiss_started
+
+    total = time.perf_counter() - started
+    print(f"✅ Vector index built and stored ({len(table_names)} tables from {len(db_paths)} database(s), "
+          f"{config.EMBEDDING_DTYPE}).")
+    print(f"   introspection {introspect_seconds:.1f}s, encoding {encode_seconds:.1f}s "
+          f"({len(table_names) / encode_seconds:.0f} tables/s on {workers} workers), "
+          f"FAISS {faiss_seconds:.1f}s, total {total:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Embed database schemas into the vector store")
+    parser.add_argument("--db", action="append", help="SQLite database to index (repeatable; default DATABASE_PATH)")
+    parser.add_argument("--output", default=INDEX_PATH, help="Vector store directory")
+    parser.add_argument("--workers", type=int, default=config.INDEX_BUILD_WORKERS,
+                        help="Encoder processes; >1 (or several --db) uses the parallel build")
+    parser.add_argument("--chunk-size", type=int, default=config.INDEX_BUILD_CHUNK_SIZE,
+                        help="Schemas per encode task in the parallel build")
+    args = parser.parse_args()
+    databases = args.db or [DB_PATH]
+    if args.workers > 1 or len(databases) > 1:
+        build_index_parallel(databases, args.output, args.workers, args.chunk_size)
+    else:
+        build_index(databases[0], args.output)
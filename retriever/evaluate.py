@@ -0,0 +1,289 @@
+"""
+Retrieval quality and speed evaluation.
+
+Scores schema retrieval against a labeled set of questions and expected
+tables (JSON list or JSONL; ``tables`` may be omitted when gold ``sql`` is
+given, in which case the tables it reads from are used). For every
+combination of embedding model, index type and k it reports:
+
+- recall@k     - share of expected tables found in the top k
+- complete@k   - share of questions with *all* expected tables in the top k
+- MRR          - mean reciprocal rank of the first expected table
+- prompt size  - estimated tokens of the schema block sent to the LLM at k
+- latency      - query encoding and index search time per question
+
+and recommends the smallest k, then the fastest model/index, that keeps
+complete@k at or above ``--target``. Only the index types the app serves
+(``flat`` and ``flat16``, chosen with ``EMBEDDING_DTYPE``) can be recommended;
+FAISS ``hnsw``/``ivf`` rows are for comparison only. With ``--adaptive`` an extra ``auto``
+row per index scores the adaptive cutoff and foreign-key expansion of
+``retriever/adaptive.py`` (``avg_k`` is the mean number of tables sent).
+
+Usage:
+    python retriever/evaluate.py
+    python retriever/evaluate.py --models all-MiniLM-L6-v2,all-mpnet-base-v2 \\
+        --index-types flat,flat16,hnsw --k 1,2,3,5,8 --output-md retrieval_report.md
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+# Add parent directory to path to import config
+sys.path.append(str(Path(__file__).parent.parent))
+from app.config import Config
+from app.query_log import estimate_tokens
+from app.schema_catalog import describe_table, get_schema_catalog, table_map
+from app.sql_validator import referenced_tables
+from retriever.adaptive import adaptive_cutoff, expand_with_foreign_keys
+from retriever.build_index import extract_schemas
+from retriever.vector_store import VectorStore
+
+config = Config()
+
+DEFAULT_LABELS = str(Path(__file__).parent / "eval" / "sakila_questions.jsonl")
+INDEX_TYPES = ("flat", "flat16", "hnsw", "ivf")
+# Index types the runtime vector store serves, and the EMBEDDING_DTYPE that selects each
+SERVED_INDEX_DTYPES = {"flat": "float32", "flat16": "float16"}
+
+
+def load_labels(path: str, known_tables: List[str], db_path: str = None) -> List[dict]:
+    """Labeled questions with a non-empty, lower-cased ``tables`` list."""
+    text = Path(path).read_text(encoding="utf-8").strip()
+    items = json.loads(text) if text.startswith("[") else [json.loads(l) for l in text.splitlines() if l.strip()]
+    known = {t.lower() for t in known_tables}
+    labels = []
+    for item in items:
+        tables = item.get("tables")
+        if not tables and item.get("sql"):
+            try:
+                tables = sorted(referenced_tables(item["sql"], db_path))
+            except ValueError as e:
+                print(f"⚠️ Gold SQL does not compile ({e}): {item.get('question')!r}")
+                tables = []
+        tables = [t.lower() for t in tables or [] if t.lower() in known]
+        if not tables:
+            print(f"⚠️ Skipping question without known expected tables: {item.get('question')!r}")
+            continue
+        labels.append({"question": item["question"], "tables": tables})
+    return labels
+
+
+class _FaissIndex:
+    """Adapter giving FAISS indexes the VectorStore ``search`` contract."""
+
+    def __init__(self, index):
+        self.index = index
+
+    def search(self, query_vectors, top_k):
+        return self.index.search(np.ascontiguousarray(query_vectors, dtype=np.float32), top_k)
+
+
+def build_search_index(kind: str, embeddings: np.ndarray):
+    """Search structure of the given ``kind`` over ``embeddings``."""
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    if kind == "flat":
+        return VectorStore(embeddings, [], [])
+    if kind == "flat16":
+        return VectorStore(embeddings.astype(np.float16), [], [])
+
+    import faiss
+
+    n, d = embeddings.shape
+    if kind == "hnsw":
+        index = faiss.IndexHNSWFlat(d, 32)
+        index.hnsw.efSearch = 64
+    elif kind == "ivf":
+        nlist = max(1, int(np.sqrt(n)))
+        index = faiss.IndexIVFFlat(faiss.IndexFlatL2(d), d, nlist)
+        index.train(embeddings)
+        index.nprobe = max(1, nlist // 4)
+    else:
+        raise ValueError(f"Unknown index type {kind!r}; choose from {', '.join(INDEX_TYPES)}")
+    index.add(embeddings)
+    return _FaissIndex(index)
+
+
+def _pct(values, pct):
+    return round(float(np.percentile(values, pct)), 3) if len(values) else None
+
+
+def _score(labels: List[dict], selections: List[List[str]], table_tokens: Dict[str, int]) -> dict:
+    """Recall, completeness and prompt size of one selected table list per question."""
+    recall, complete, tokens = [], [], []
+    for label, selected in zip(labels, selections):
+        found = sum(1 for t in label["tables"] if t in selected)
+        recall.append(found / len(label["tables"]))
+        complete.append(found == len(label["tables"]))
+        tokens.append(sum(table_tokens.get(t, 0) for t in selected))
+    return {
+        "recall": round(float(np.mean(recall)), 4),
+        "complete": round(float(np.mean(complete)), 4),
+        "prompt_tokens": round(float(np.mean(tokens)), 1),
+        "avg_k": round(float(np.mean([len(s) for s in selections])), 2),
+    }
+
+
+def _adaptive_selection(ranking: List[str], similarities: np.ndarray, db_path: str) -> List[str]:
+    selected = ranking[:adaptive_cutoff(similarities)]
+    extra = expand_with_foreign_keys(selected, ranking, db_path=db_path)
+    return selected + [name.lower() for name in extra]
+
+
+def evaluate_model(model_name: str, labels: List[dict], schema_texts: List[str], table_names: List[str],
+                   index_types: List[str], ks: List[int], table_tokens: Dict[str, int],
+                   adaptive_db: str = None) -> List[dict]:
+    """
+    One result row per (index type, k) for ``model_name``, plus an ``auto``
+    row per index type when ``adaptive_db`` is given.
+    """
+    from sentence_transformers import SentenceTransformer
+
+    print(f"🤖 Loading {model_name}...")
+    model = SentenceTransformer(f"sentence-transformers/{model_name}")
+    started = time.perf_counter()
+    embeddings = model.encode(schema_texts, convert_to_numpy=True)
+    build_seconds = time.perf_counter() - started
+
+    # Encode one question at a time, as /ask does, to measure per-query latency
+    query_vectors, encode_ms = [], []
+    for label in labels:
+        started = time.perf_counter()
+        query_vectors.append(model.encode([label["question"]], convert_to_numpy=True)[0])
+        encode_ms.append((time.perf_counter() - started) * 1000)
+    query_vectors = np.vstack(query_vectors)
+
+    names = [name.lower() for name in table_names]
+    max_k = min(max(ks + ([config.TOP_K_RETRIEVAL] if adaptive_db else [])), len(names))
+    unit = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    rows = []
+    for kind in index_types:
+        index = build_search_index(kind, embeddings)
+        rankings, search_ms, similarities = [], [], []
+        for vector in query_vectors:
+            started = time.perf_counter()
+            _, ids = index.search(vector[None, :], max_k)
+            search_ms.append((time.perf_counter() - started) * 1000)
+            valid = [int(i) for i in ids[0] if i >= 0]
+            rankings.append([names[i] for i in valid])
+            similarities.append(unit[valid] @ (vector / max(np.linalg.norm(vector), 1e-12)))
+
+        reciprocal_ranks = []
+        for label, ranking in zip(labels, rankings):
+            ranks = [ranking.index(t) + 1 for t in label["tables"] if t in ranking]
+            reciprocal_ranks.append(1.0 / min(ranks) if ranks else 0.0)
+
+        selections = [(k, [ranking[:k] for ranking in rankings]) for k in ks]
+        if adaptive_db:
+            selections.append(("auto", [_adaptive_selection(ranking, sims[:config.TOP_K_RETRIEVAL], adaptive_db)
+                                        for ranking, sims in zip(rankings, similarities)]))
+        for k, selected in selections:
+            rows.append({
+                "model": model_name,
+                "index": kind,
+                "k": k,
+                **_score(labels, selected, table_tokens),
+                "mrr": round(float(np.mean(reciprocal_ranks)), 4),
+                "encode_ms_p50": _pct(encode_ms, 50),
+                "encode_ms_p95": _pct(encode_ms, 95),
+                "search_ms_p50": _pct(search_ms, 50),
+                "search_ms_p95": _pct(search_ms, 95),
+                "embed_schemas_s": round(build_seconds, 3),
+            })
+    return rows
+
+
+def recommend(rows: List[dict], target: float):
+    """Smallest k meeting ``target`` complete@k on a served index, then the lowest encode + search latency."""
+    passing = [r for r in rows if r["complete"] >= target and r["k"] != "auto"
+               and r["index"] in SERVED_INDEX_DTYPES]
+    if not passing:
+        return None
+    return min(passing, key=lambda r: (r["k"], r["encode_ms_p50"] + r["search_ms_p50"], r["prompt_tokens"]))
+
+
+COLUMNS = [("model", "Model"), ("index", "Index"), ("k", "k"), ("avg_k", "Avg k"), ("recall", "Recall@k"),
+           ("complete", "Complete@k"), ("mrr", "MRR"), ("prompt_tokens", "Prompt tok"),
+           ("encode_ms_p50", "Encode p50 ms"), ("search_ms_p50", "Search p50 ms"),
+           ("search_ms_p95", "Search p95 ms")]
+
+
+def markdown_report(rows: List[dict], best, target: float, n_questions: int) -> str:
+    lines = [f"# Retrieval evaluation ({n_questions} questions)", "",
+             "| " + " | ".join(title for _, title in COLUMNS) + " |",
+             "|" + "|".join("---" for _ in COLUMNS) + "|"]
+    for row in rows:
+        cells = {key: str(row[key]) for key, _ in COLUMNS}
+        if row["index"] not in SERVED_INDEX_DTYPES:
+            cells["index"] += " (comparison only)"
+        lines.append("| " + " | ".join(cells[key] for key, _ in COLUMNS) + " |")
+    lines.append("")
+    if best:
+        lines.append(f"**Recommendation** (complete@k ≥ {target}): `EMBEDDING_MODEL={best['model']}`, "
+                     f"`TOP_K_RETRIEVAL={best['k']}`, `EMBEDDING_DTYPE={SERVED_INDEX_DTYPES[best['index']]}` "
+                     f"(recall {best['recall']}, ~{best['prompt_tokens']} prompt tokens).")
+    elif not any(row["index"] in SERVED_INDEX_DTYPES for row in rows):
+        lines.append("No recommendation: only FAISS indexes were evaluated, and the app serves "
+                     "`flat`/`flat16`; add them to `--index-types`.")
+    else:
+        lines.append(f"No configuration reached complete@k ≥ {target}; try larger k or another model.")
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate schema retrieval quality and speed")
+    parser.add_argument("--labels", default=DEFAULT_LABELS, help="Labeled questions (JSON or JSONL)")
+    parser.add_argument("--db", default=config.DATABASE_PATH, help="SQLite database to index")
+    parser.add_argument("--models", default=config.EMBEDDING_MODEL, help="Comma-separated sentence-transformers models")
+    parser.add_argument("--index-types", default="flat", help=f"Comma-separated: {', '.join(INDEX_TYPES)}")
+    parser.add_argument("--k", default="1,2,3,5,8", help="Comma-separated k values")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="Also score adaptive k (RETRIEVAL_* settings, up to TOP_K_RETRIEVAL)")
+    parser.add_argument("--target", type=float, default=0.95, help="Required complete@k for the recommendation")
+    parser.add_argument("--output-json", help="Write all result rows as JSON")
+    parser.add_argument("--output-md", help="Write a Markdown comparison report")
+    args = parser.parse_args()
+
+    schema_texts, table_names = extract_schemas(args.db)
+    if not table_names:
+        print(f"❌ No tables found in {args.db}")
+        sys.exit(1)
+    tables = table_map(get_schema_catalog(args.db))
+    table_tokens = {name.lower(): estimate_tokens(describe_table(tables[name.lower()]) if name.lower() in tables
+                                                  else text)
+                    for name, text in zip(table_names, schema_texts)}
+    labels = load_labels(args.labels, table_names, args.db)
+    if not labels:
+        print("❌ No usable labeled questions")
+        sys.exit(1)
+
+    ks = sorted({int(k) for k in args.k.split(",") if k.strip()})
+    index_types = [t.strip() for t in args.index_types.split(",") if t.strip()]
+    print(f"📊 {len(labels)} questions, {len(table_names)} tables, k={ks}{' + auto' if args.adaptive else ''}, "
+          f"indexes={index_types}")
+
+    rows = []
+    for model_name in [m.strip() for m in args.models.split(",") if m.strip()]:
+        rows.extend(evaluate_model(model_name, labels, schema_texts, table_names, index_types, ks, table_tokens,
+                                   adaptive_db=args.db if args.adaptive else None))
+
+    best = recommend(rows, args.target)
+    report = markdown_report(rows, best, args.target, len(labels))
+    print()
+    print(report)
+    if args.output_md:
+        Path(args.output_md).write_text(report, encoding="utf-8")
+        print(f"📝 Report written to {args.output_md}")
+    if args.output_json:
+        Path(args.output_json).write_text(json.dumps({"rows": rows, "recommendation": best}, indent=2),
+                                          encoding="utf-8")
+        print(f"📝 Results written to {args.output_json}")
+
+
+if __name__ == "__main__":
+    main()
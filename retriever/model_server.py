@@ -0,0 +1,101 @@
+"""
+Embedding/retrieval sidecar shared by all API workers.
+
+Running ``uvicorn app.main:app --workers N`` would otherwise load N copies of
+the SentenceTransformer. This server owns a single model instance and the
+memory-mapped vector store, micro-batches incoming encode requests, and
+answers retrieval calls from every worker over local HTTP or a Unix socket.
+
+Usage:
+    python retriever/model_server.py                       # EMBEDDING_SERVER_PORT on 127.0.0.1
+    python retriever/model_server.py --socket /tmp/embed.sock
+
+Point the API workers at it with EMBEDDING_SERVER_URL or EMBEDDING_SERVER_SOCKET.
+"""
+
+import argparse
+import sys
+from pathlib import Path
+from typing import List, Optional
+
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel
+
+# Add parent directory to path to import config
+sys.path.append(str(Path(__file__).parent.parent))
+from app.config import Config
+from retriever.query_index import get_batcher, batching_stats, search_tables
+
+config = Config()
+
+app = FastAPI(title="AI Insight Embedding Server", version="1.0")
+
+
+class EncodeRequest(BaseModel):
+    texts: List[str]
+
+
+class EncodeResponse(BaseModel):
+    embeddings: List[List[float]]
+
+
+class RetrieveRequest(BaseModel):
+    query: str
+    top_k: Optional[int] = None
+
+
+class RetrieveResponse(BaseModel):
+    matches: List[List[str]]
+    distances: List[float]
+    similarities: List[float] = []
+
+
+@app.on_event("startup")
+def warm_up():
+    # Load the model before the first request instead of on it
+    get_batcher()
+
+
+@app.get("/health")
+def health():
+    return {"status": "ok", "model": config.EMBEDDING_MODEL}
+
+
+@app.get("/metrics")
+def metrics():
+    return {"embedding_batcher": batching_stats()}
+
+
+@app.post("/encode", response_model=EncodeResponse)
+def encode(req: EncodeRequest):
+    if not req.texts:
+        return EncodeResponse(embeddings=[])
+    vectors = get_batcher().encode(req.texts)
+    return EncodeResponse(embeddings=vectors.tolist())
+
+
+@app.post("/retrieve", response_model=RetrieveResponse)
+def retrieve(req: RetrieveRequest):
+    if not req.query.strip():
+        raise HTTPException(status_code=400, detail="Query cannot be empty.")
+    top_k = req.top_k or config.TOP_K_RETRIEVAL
+    query_vec = get_batcher().encode([req.query])
+    matches, distances, similarities = search_tables(query_vec, top_k)
+    return RetrieveResponse(matches=[list(m) for m in matches], distances=distances, similarities=similarities)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Run the shared embedding/retrieval server")
+    parser.add_argument("--host", default=config.EMBEDDING_SERVER_HOST)
+    parser.add_argument("--port", type=int, default=config.EMBEDDING_SERVER_PORT)
+    parser.add_argument("--socket", default=config.EMBEDDING_SERVER_SOCKET or None,
+                        help="Serve on a Unix domain socket instead of TCP")
+    args = parser.parse_args()
+
+    # A single process on purpose: the whole point is one model instance
+    if args.socket:
+        uvicorn.run(app, uds=args.socket, workers=1)
+    else:
+        uvicorn.run(app, host=args.host, port=args.port, workers=1)
@@ -1,12 +1,14 @@
-import faiss
-import pickle
 import sys
+import threading
 from pathlib import Path
 from sentence_transformers import SentenceTransformer
 
 # Add parent directory to path to import config
 sys.path.append(str(Path(__file__).parent.parent))
 from app.config import Config
+from retriever.adaptive import select_tables
+from retriever.batching import EncodeBatcher
+from retriever.vector_store import load_vector_store
 
 # Initialize configuration
 config = Config()
@@ -14,20 +16,116 @@ config = Config()
 INDEX_PATH = config.VECTOR_STORE_PATH
 MODEL_NAME = f"sentence-transformers/{config.EMBEDDING_MODEL}"
 
-def retrieve_tables(query, top_k=None):
-    if top_k is None:
-        top_k = config.TOP_K_RETRIEVAL
-        
-    # Load index and metadata
-    index = faiss.read_index(f"{INDEX_PATH}/schema.index")
-    with open(f"{INDEX_PATH}/table_names.pkl", "rb") as f:
-        schema_texts, table_names = pickle.load(f)
+_model = None
+_model_lock = threading.Lock()
+_batcher = None
+_server_client = None
+
+
+def get_model():
+    """Load the embedding model once per process."""
+    global _model
+    with _model_lock:
+        if _model is None:
+            _model = SentenceTransformer(MODEL_NAME)
+        return _model
+
+
+def get_batcher():
+    """Process-wide micro-batcher around the embedding model."""
+    global _batcher
+    model = get_model()
+    with _model_lock:
+        if _batcher is None:
+            _batcher = EncodeBatcher(
+                model,
+                max_batch_size=config.EMBED_BATCH_MAX_SIZE,
+                max_wait_ms=config.EMBED_BATCH_MAX_WAIT_MS,
+            )
+        return _batcher
+
+
+def encode_queries(queries):
+    """Embed query texts, batching them with concurrent callers when enabled."""
+    if config.EMBED_BATCHING:
+        return get_batcher().encode(queries)
+    return get_model().encode(queries)
+
+
+def batching_stats():
+    """Batcher metrics, or None before the first batched encode."""
+    return _batcher.stats() if _batcher is not None else None
+
+
+def search_tables(query_vec, top_k):
+    """Search the vector store; returns ([(table_name, schema_text)], distances, cosine similarities)."""
+    # Load the memory-mapped matrix and metadata (cached per process), limited to the served database
+    store = load_vector_store(INDEX_PATH, config.DATABASE_PATH)
+    D, I = store.search(query_vec, top_k)
+    ids = [int(i) for i in I[0] if i >= 0]
+    matches = [(store.table_names[i], store.schema_texts[i]) for i in ids]
+    distances = [float(d) for d, i in zip(D[0], I[0]) if i >= 0]
+    similarities = store.cosine_similarities(query_vec[0], ids).tolist() if ids else []
+    return matches, distances, similarities
 
-    # Embed query
-    model = SentenceTransformer(MODEL_NAME)
-    query_vec = model.encode([query])
+
+def _get_server_client():
+    """Pooled HTTP client for the shared embedding server, or None if not configured."""
+    global _server_client
+    if not (config.EMBEDDING_SERVER_URL or config.EMBEDDING_SERVER_SOCKET):
+        return None
+    if _server_client is None:
+        import httpx
+
+        if config.EMBEDDING_SERVER_SOCKET:
+            transport = httpx.HTTPTransport(uds=config.EMBEDDING_SERVER_SOCKET)
+            base_url = "http://embedding-server"
+        else:
+            transport = httpx.HTTPTransport()
+            base_url = config.EMBEDDING_SERVER_URL.rstrip("/")
+        _server_client = httpx.Client(base_url=base_url, transport=transport,
+                                      timeout=config.EMBEDDING_SERVER_TIMEOUT)
+    return _server_client
+
+
+def _retrieve_remote(client, query, top_k):
+    response = client.post("/retrieve", json={"query": query, "top_k": top_k})
+    response.raise_for_status()
+    data = response.json()
+    # Servers predating adaptive retrieval send no similarities
+    return [tuple(match) for match in data["matches"]], data.get("similarities", [])
+
+
+def _ranked_tables(query, top_k):
+    """Up to ``top_k`` ranked matches and their cosine similarities."""
+    # Prefer the shared embedding server so workers don't each load the model
+    client = _get_server_client()
+    if client is not None:
+        try:
+            return _retrieve_remote(client, query, top_k)
+        except Exception as e:
+            print(f"⚠️ Embedding server unavailable, encoding in-process: {e}")
+
+    # Embed query (concurrent requests share one forward pass)
+    query_vec = encode_queries([query])
 
     # Search
-    D, I = index.search(query_vec, top_k)
-    matches = [(table_names[i], schema_texts[i]) for i in I[0]]
-    return matches
+    matches, _, similarities = search_tables(query_vec, top_k)
+    return matches, similarities
+
+
+def retrieve_tables(query, top_k=None, adaptive=None):
+    """
+    Schemas for ``query``. With adaptive retrieval, ``top_k`` is the upper
+    bound: the ranking is cut at the first large score gap and widened with
+    the tables needed to join the selection.
+    """
+    if top_k is None:
+        top_k = config.TOP_K_RETRIEVAL
+    if adaptive is None:
+        adaptive = config.RETRIEVAL_ADAPTIVE
+
+    matches, similarities = _ranked_tables(query, top_k)
+    if not adaptive or len(similarities) != len(matches):
+        return matches
+    return select_tables(matches, similarities)
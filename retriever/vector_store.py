@@ -0,0 +1,263 @@
+"""
+Compact on-disk vector store for schema embeddings.
+
+The index directory holds:
+- embeddings.npy  - raw float32/float16 matrix, one row per table
+- metadata.json   - table names, schema texts and build information; indexes
+                    built over several databases also list the database
+                    (file stem) of every row in ``table_databases``
+
+The matrix is opened with ``np.load(mmap_mode='r')`` so every uvicorn worker
+maps the same file and shares it through the OS page cache instead of each
+process unpickling and holding its own copy. Indexes built before this format
+existed (``schema.index`` + ``table_names.pkl``) are still readable.
+"""
+
+import json
+import os
+import pickle
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+EMBEDDINGS_FILE = "embeddings.npy"
+METADATA_FILE = "metadata.json"
+LEGACY_INDEX_FILE = "schema.index"
+LEGACY_METADATA_FILE = "table_names.pkl"
+
+FORMAT_VERSION = 1
+SUPPORTED_DTYPES = ("float32", "float16")
+
+# Rows scored per block during search, bounds the float32 temporaries
+SEARCH_BLOCK_ROWS = 65536
+
+
+class VectorStore:
+    """Memory-mapped embedding matrix plus its table metadata."""
+
+    def __init__(self, embeddings: np.ndarray, schema_texts: List[str],
+                 table_names: List[str], metadata: Optional[dict] = None):
+        if embeddings.ndim == 1:
+            embeddings = embeddings.reshape(1, -1)
+        self.embeddings = embeddings
+        self.schema_texts = list(schema_texts)
+        self.table_names = list(table_names)
+        self.metadata = metadata or {}
+        self._sq_norms = None
+
+    @property
+    def ntotal(self) -> int:
+        return self.embeddings.shape[0]
+
+    @property
+    def d(self) -> int:
+        return self.embeddings.shape[1]
+
+    @property
+    def sq_norms(self) -> np.ndarray:
+        """Squared L2 norm of every stored vector (computed once per process)."""
+        if self._sq_norms is None:
+            norms = np.empty(self.ntotal, dtype=np.float32)
+            for start in range(0, self.ntotal, SEARCH_BLOCK_ROWS):
+                block = np.asarray(self.embeddings[start:start + SEARCH_BLOCK_ROWS], dtype=np.float32)
+                norms[start:start + len(block)] = np.einsum("ij,ij->i", block, block)
+            self._sq_norms = norms
+        return self._sq_norms
+
+    def for_database(self, database: str) -> "VectorStore":
+        """
+        The rows indexed from ``database`` (matched by file stem) in an index
+        built over several databases; the store itself for single-database indexes.
+        """
+        table_databases = self.metadata.get("table_databases")
+        if not table_databases:
+            return self
+        stem = Path(database).stem
+        ids = [i for i, name in enumerate(table_databases) if name == stem]
+        if not ids:
+            raise ValueError(f"Vector store has no tables from database '{stem}'; "
+                             f"it indexes {sorted(set(table_databases))}")
+        # Rows of one database are contiguous when built by build_index, keeping the slice memory-mapped
+        rows = slice(ids[0], ids[-1] + 1) if ids[-1] - ids[0] + 1 == len(ids) else ids
+        return VectorStore(self.embeddings[rows], [self.schema_texts[i] for i in ids],
+                           [self.table_names[i] for i in ids], {**self.metadata, "served_database": stem})
+
+    def vectors(self) -> np.ndarray:
+        """All vectors as a float32 array (replaces FAISS ``reconstruct_n``)."""
+        return np.asarray(self.embeddings, dtype=np.float32)
+
+    def cosine_similarities(self, query_vector: np.ndarray, ids) -> np.ndarray:
+        """Cosine similarity between one query vector and the stored rows ``ids``."""
+        query = np.asarray(query_vector, dtype=np.float32).ravel()
+        rows = np.asarray(self.embeddings[np.asarray(ids, dtype=np.int64)], dtype=np.float32)
+        denominators = np.sqrt(self.sq_norms[np.asarray(ids, dtype=np.int64)]) * np.linalg.norm(query)
+        return (rows @ query) / np.where(denominators > 0, denominators, 1.0)
+
+    def search(self, query_vectors: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Exact squared-L2 search, same contract as ``faiss.IndexFlatL2.search``.
+        Returns (distances, ids); slots beyond ``ntotal`` are filled with -1 ids.
+        """
+        queries = np.atleast_2d(np.asarray(query_vectors, dtype=np.float32))
+        n_queries = queries.shape[0]
+        distances = np.full((n_queries, top_k), np.inf, dtype=np.float32)
+        ids = np.full((n_queries, top_k), -1, dtype=np.int64)
+        k = min(top_k, self.ntotal)
+        if k == 0:
+            return distances, ids
+
+        q_norms = np.einsum("ij,ij->i", queries, queries)
+        scores = np.empty((n_queries, self.ntotal), dtype=np.float32)
+        for start in range(0, self.ntotal, SEARCH_BLOCK_ROWS):
+            block = np.asarray(self.embeddings[start:start + SEARCH_BLOCK_ROWS], dtype=np.float32)
+            scores[:, start:start + len(block)] = -2.0 * (queries @ block.T)
+        scores += self.sq_norms[None, :]
+        scores += q_norms[:, None]
+        np.maximum(scores, 0.0, out=scores)
+
+        if k < self.ntotal:
+            candidates = np.argpartition(scores, k - 1, axis=1)[:, :k]
+        else:
+            candidates = np.tile(np.arange(self.ntotal), (n_queries, 1))
+        candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+        order = np.argsort(candidate_scores, axis=1)
+        ids[:, :k] = np.take_along_axis(candidates, order, axis=1)
+        distances[:, :k] = np.take_along_axis(candidate_scores, order, axis=1)
+        return distances, ids
+
+
+def _check_dtype(dtype: str) -> None:
+    if dtype not in SUPPORTED_DTYPES:
+        raise ValueError(f"Unsupported embedding dtype '{dtype}', expected one of {SUPPORTED_DTYPES}")
+
+
+def _tmp_matrix_path(index_path: str) -> str:
+    # np.save appends .npy to names that lack it, so keep the suffix on the temp file
+    return os.path.join(index_path, EMBEDDINGS_FILE)[:-len(".npy")] + ".tmp.npy"
+
+
+def create_matrix_file(index_path: str, count: int, dimension: int, dtype: str = "float32") -> str:
+    """
+    Preallocate the temporary ``.npy`` matrix so rows can be streamed into it
+    (from several processes) with ``np.lib.format.open_memmap(path, mode="r+")``.
+    Returns its path; publish it with ``commit_vector_store``.
+    """
+    _check_dtype(dtype)
+    os.makedirs(index_path, exist_ok=True)
+    path = _tmp_matrix_path(index_path)
+    matrix = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(count, dimension))
+    del matrix
+    return path
+
+
+def commit_vector_store(index_path: str, tmp_matrix: str, schema_texts: List[str], table_names: List[str],
+                        model_name: str = "", extra: Optional[dict] = None) -> None:
+    """Write the JSON sidecar for a finished temporary matrix and swap both in atomically."""
+    matrix = np.load(tmp_matrix, mmap_mode="r")
+    if matrix.shape[0] != len(table_names):
+        raise ValueError(f"{matrix.shape[0]} vectors for {len(table_names)} tables")
+    metadata = {
+        "format_version": FORMAT_VERSION,
+        "model": model_name,
+        "dtype": str(matrix.dtype),
+        "count": int(matrix.shape[0]),
+        "dimension": int(matrix.shape[1]),
+        "built_at": datetime.now(timezone.utc).isoformat(),
+        **(extra or {}),
+        "table_names": list(table_names),
+        "schema_texts": list(schema_texts),
+    }
+    del matrix
+
+    metadata_path = os.path.join(index_path, METADATA_FILE)
+    tmp_metadata = metadata_path + ".tmp"
+    with open(tmp_metadata, "w", encoding="utf-8") as f:
+        json.dump(metadata, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_matrix, os.path.join(index_path, EMBEDDINGS_FILE))
+    os.replace(tmp_metadata, metadata_path)
+
+
+def save_vector_store(index_path: str, embeddings: np.ndarray, schema_texts: List[str],
+                      table_names: List[str], model_name: str = "",
+                      dtype: str = "float32") -> None:
+    """Write the matrix and JSON sidecar; files are swapped in atomically."""
+    _check_dtype(dtype)
+    if embeddings.ndim == 1:
+        embeddings = embeddings.reshape(1, -1)
+
+    os.makedirs(index_path, exist_ok=True)
+    tmp_matrix = _tmp_matrix_path(index_path)
+    np.save(tmp_matrix, np.ascontiguousarray(embeddings, dtype=dtype))
+    commit_vector_store(index_path, tmp_matrix, schema_texts, table_names, model_name)
+
+
+def _load_legacy(index_path: str) -> VectorStore:
+    """Read an index written before the .npy/.json format existed."""
+    import faiss
+
+    index = faiss.read_index(os.path.join(index_path, LEGACY_INDEX_FILE))
+    with open(os.path.join(index_path, LEGACY_METADATA_FILE), "rb") as f:
+        schema_texts, table_names = pickle.load(f)
+    embeddings = index.reconstruct_n(0, index.ntotal)
+    return VectorStore(embeddings, schema_texts, table_names, {"format_version": 0})
+
+
+def read_vector_store(index_path: str) -> VectorStore:
+    """Open the store under ``index_path`` without caching."""
+    matrix_path = os.path.join(index_path, EMBEDDINGS_FILE)
+    metadata_path = os.path.join(index_path, METADATA_FILE)
+
+    if not os.path.exists(matrix_path) or not os.path.exists(metadata_path):
+        if os.path.exists(os.path.join(index_path, LEGACY_INDEX_FILE)):
+            return _load_legacy(index_path)
+        raise FileNotFoundError(
+            f"Vector store not found in {index_path}. Run 'python retriever/build_index.py' first."
+        )
+
+    with open(metadata_path, "r", encoding="utf-8") as f:
+        metadata = json.load(f)
+    embeddings = np.load(matrix_path, mmap_mode="r")
+    if embeddings.shape[0] != len(metadata["table_names"]):
+        raise ValueError(
+            f"Vector store in {index_path} is inconsistent: "
+            f"{embeddings.shape[0]} vectors for {len(metadata['table_names'])} tables"
+        )
+    return VectorStore(embeddings, metadata["schema_texts"], metadata["table_names"], metadata)
+
+
+_store_cache = {}
+_store_lock = threading.Lock()
+
+
+def _store_signature(index_path: str) -> tuple:
+    signature = []
+    for name in (EMBEDDINGS_FILE, METADATA_FILE, LEGACY_INDEX_FILE):
+        try:
+            stat = os.stat(os.path.join(index_path, name))
+            signature.append((name, stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append((name, None, None))
+    return tuple(signature)
+
+
+def load_vector_store(index_path: str, database: Optional[str] = None) -> VectorStore:
+    """
+    Return the store for ``index_path``, cached per process and reopened
+    automatically when the files on disk are rebuilt. With ``database``, a
+    multi-database index is narrowed to that database's tables.
+    """
+    path = os.path.abspath(index_path)
+    key = (path, Path(database).stem if database else None)
+    signature = _store_signature(path)
+    with _store_lock:
+        cached = _store_cache.get(key)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        store = read_vector_store(path)
+        if database:
+            store = store.for_database(database)
+        _store_cache[key] = (signature, store)
+        return store
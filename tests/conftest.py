@@ -0,0 +1,34 @@
+import os
+import random
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import Config  # noqa: E402
+
+
+@pytest.fixture
+def sample_db(tmp_path, monkeypatch):
+    """Small film/actor/payment database served as DATABASE_PATH (no snapshots)."""
+    path = str(tmp_path / "sample.db")
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE film (film_id INTEGER PRIMARY KEY, title TEXT NOT NULL);
+        CREATE TABLE actor (actor_id INTEGER PRIMARY KEY, first_name TEXT NOT NULL);
+        CREATE TABLE film_actor (actor_id INTEGER REFERENCES actor, film_id INTEGER REFERENCES film);
+        CREATE TABLE payment (payment_id INTEGER PRIMARY KEY, customer_id INTEGER, amount REAL);
+    """)
+    conn.executemany("INSERT INTO film VALUES (?, ?)", [(i, f"Film {i}") for i in range(1, 11)])
+    conn.executemany("INSERT INTO actor VALUES (?, ?)", [(i, f"Actor {i}") for i in range(1, 6)])
+    conn.executemany("INSERT INTO film_actor VALUES (?, ?)", [(i % 5 + 1, i) for i in range(1, 11)])
+    rng = random.Random(7)
+    conn.executemany("INSERT INTO payment VALUES (?, ?, ?)",
+                     [(i, rng.randint(1, 50), round(rng.uniform(0, 12), 2)) for i in range(1, 501)])
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(Config, "DATABASE_PATH", path)
+    monkeypatch.setattr(Config, "SNAPSHOT_MODE", "off")
+    return path
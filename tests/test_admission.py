@@ -0,0 +1,53 @@
+import pytest
+
+from app.admission import RateLimiter, TokenBucket, client_key
+
+
+def test_token_bucket_allows_a_burst_then_reports_the_wait():
+    bucket = TokenBucket(rate=1.0, burst=3, now=100.0)
+    assert [bucket.take(100.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.take(100.0) == pytest.approx(1.0)
+
+
+def test_token_bucket_refills_at_its_rate_up_to_the_burst():
+    bucket = TokenBucket(rate=2.0, burst=2, now=0.0)
+    bucket.take(0.0)
+    bucket.take(0.0)
+    assert bucket.take(0.25) == pytest.approx(0.25)
+    assert bucket.take(0.5) == 0.0
+    bucket.take(1000.0)
+    assert bucket.tokens == pytest.approx(1.0)
+
+
+def test_token_bucket_ignores_clock_readings_older_than_its_start():
+    bucket = TokenBucket(rate=1.0, burst=1, now=10.0)
+    assert bucket.take(9.999) == 0.0
+
+
+def test_rate_limiter_buckets_are_per_client():
+    limiter = RateLimiter(per_minute=60, burst=2)
+    assert limiter.check("a") == 0 and limiter.check("a") == 0
+    assert limiter.check("a") > 0
+    assert limiter.check("b") == 0
+    assert limiter.stats()["allowed"] == 3 and limiter.stats()["limited"] == 1
+
+
+def test_rate_limiter_disabled_at_zero():
+    limiter = RateLimiter(per_minute=0, burst=1)
+    assert not limiter.enabled
+    assert all(limiter.check("a") == 0 for _ in range(100))
+
+
+def test_rate_limiter_forgets_least_recent_clients():
+    limiter = RateLimiter(per_minute=60, burst=1, max_clients=2)
+    limiter.check("a")
+    limiter.check("b")
+    limiter.check("c")
+    assert limiter.stats()["clients"] == 2
+    # "a" was evicted, so it starts with a full bucket again
+    assert limiter.check("a") == 0
+
+
+def test_client_key_prefers_the_key_header():
+    assert client_key({"X-API-Key": "k1"}, "10.0.0.1") == "key:k1"
+    assert client_key({}, "10.0.0.1") == "ip:10.0.0.1"
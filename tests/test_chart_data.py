@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+
+from app.chart_data import ChartDataError, build_chart_data, grid_thin, lttb
+from app.result_store import StoredResult
+
+
+def _result(sql):
+    return StoredResult(handle="test", sql=sql)
+
+
+def test_lttb_keeps_threshold_points_including_ends():
+    x = np.arange(1000, dtype=np.float64)
+    y = np.sin(x / 50)
+    keep = lttb(x, y, 50)
+    assert len(keep) == 50
+    assert keep[0] == 0 and keep[-1] == 999
+    assert np.all(np.diff(keep) > 0)
+
+
+def test_lttb_returns_everything_below_threshold():
+    x = np.arange(10, dtype=np.float64)
+    assert list(lttb(x, x, 20)) == list(range(10))
+
+
+def test_lttb_keeps_a_spike():
+    x = np.arange(500, dtype=np.float64)
+    y = np.zeros(500)
+    y[321] = 100.0
+    assert 321 in lttb(x, y, 20)
+
+
+@pytest.mark.parametrize("rows, max_points", [(500, 8), (2000, 50), (20000, 1000)])
+def test_grid_thin_reaches_max_points(rows, max_points):
+    xy = np.random.default_rng(0).normal(size=(rows, 2))
+    keep = grid_thin(xy, max_points)
+    assert len(keep) == max_points
+    assert len(set(keep.tolist())) == max_points
+
+
+def test_grid_thin_returns_fewer_only_for_fewer_distinct_points():
+    xy = np.repeat(np.array([[0.0, 0.0], [1.0, 1.0], [2.0, 5.0]]), 100, axis=0)
+    assert len(grid_thin(xy, 10)) == 3
+
+
+def test_top_n_keeps_a_real_other_category_apart(sample_db):
+    sql = "SELECT CASE WHEN payment_id % 2 = 0 THEN 'Other' ELSE customer_id END AS k, amount FROM payment"
+    chart = build_chart_data(_result(sql), "Bar Chart", 5)
+    labels = [row[0] for row in chart.rows]
+    assert "Other" in labels
+    assert chart.extra["other_label"] in labels and chart.extra["other_label"] != "Other"
+    assert len(labels) == len(set(labels)) == 5
+    assert chart.source_rows == 500
+    total = sum(row[1] for row in chart.rows)
+    assert total == pytest.approx(sum(row[1] for row in build_chart_data(_result(sql), "Bar Chart", 1000).rows))
+
+
+def test_top_n_without_overflow_has_no_other_bucket(sample_db):
+    chart = build_chart_data(_result("SELECT first_name, actor_id FROM actor"), "Pie Chart", 10)
+    assert chart.method == "sql_group_by"
+    assert chart.extra == {}
+    assert len(chart.rows) == 5
+
+
+def test_series_is_sorted_by_x_before_downsampling(sample_db):
+    chart = build_chart_data(_result("SELECT amount, customer_id FROM payment ORDER BY random()"), "Line Chart", 40)
+    assert chart.method == "lttb"
+    xs = [row[0] for row in chart.rows]
+    assert len(xs) == 40 and xs == sorted(xs)
+
+
+def test_series_needs_a_numeric_value_column(sample_db):
+    with pytest.raises(ChartDataError):
+        build_chart_data(_result("SELECT title, title FROM film"), "Line Chart", 5)
+
+
+def test_scatter_drops_rows_without_both_coordinates(sample_db):
+    sql = ("SELECT customer_id, CASE WHEN payment_id % 4 = 0 THEN NULL ELSE amount END AS amount "
+           "FROM payment")
+    chart = build_chart_data(_result(sql), "Scatter Plot", 30)
+    assert chart.method == "grid_thinning"
+    assert len(chart.rows) == 30
+    assert all(row[1] is not None for row in chart.rows)
+
+
+def test_scatter_with_non_numeric_x_is_stride_sampled(sample_db):
+    chart = build_chart_data(_result("SELECT 'p' || payment_id, amount FROM payment"), "Scatter Plot", 25)
+    assert chart.method == "stride_sample"
+    assert len(chart.rows) == 25
+
+
+def test_numeric_reductions_skip_non_numeric_values(sample_db):
+    sql = "SELECT CASE WHEN payment_id > 300 THEN 'n/a' ELSE amount END AS v FROM payment"
+    chart = build_chart_data(_result(sql), "Histogram", 50)
+    assert chart.source_rows == 500
+    assert sum(row[2] for row in chart.rows) == 300
@@ -0,0 +1,70 @@
+import sqlite3
+
+import pytest
+
+from app.sql_validator import referenced_tables, validate_sql
+
+
+def _count(db, table):
+    conn = sqlite3.connect(db)
+    try:
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize("sql", [
+    "WITH x AS (SELECT 1) DELETE FROM actor",
+    "WITH x AS (SELECT 1) UPDATE film SET title = 'x'",
+    "WITH x AS (SELECT 1) INSERT INTO actor (first_name) SELECT 'x' FROM x",
+])
+def test_with_prefixed_writes_are_rejected(sample_db, sql):
+    error = validate_sql(sql, sample_db)
+    assert error is not None and "read-only" in error
+    assert _count(sample_db, "actor") == 5
+
+
+@pytest.mark.parametrize("sql", [
+    "DROP TABLE film",
+    "ATTACH 'other.db' AS other",
+    "SELECT * FROM film; DROP TABLE film",
+])
+def test_non_select_statements_are_rejected(sample_db, sql):
+    assert validate_sql(sql, sample_db) is not None
+    assert _count(sample_db, "film") == 10
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT title FROM film WHERE film_id = 1",
+    "SELECT f.title, a.first_name FROM film f, actor a, film_actor fa "
+    "WHERE fa.film_id = f.film_id AND fa.actor_id = a.actor_id",
+    "SELECT value FROM json_each('[1, 2, 3]')",
+    "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < 3) SELECT x FROM c",
+])
+def test_read_only_queries_pass(sample_db, sql):
+    assert validate_sql(sql, sample_db) is None
+
+
+def test_unknown_table_names_the_table(sample_db):
+    error = validate_sql("SELECT f.title FROM film f, actr a", sample_db)
+    assert error is not None and "actr" in error
+
+
+def test_unknown_column_names_the_column(sample_db):
+    error = validate_sql("SELECT f.titel FROM film f", sample_db)
+    assert error is not None and "titel" in error
+
+
+def test_referenced_tables_come_from_the_query_plan(sample_db):
+    tables = referenced_tables("SELECT * FROM film f, actor a JOIN film_actor fa USING (actor_id)", sample_db)
+    assert sorted(tables) == ["actor", "film", "film_actor"]
+
+
+def test_referenced_tables_ignores_ctes_and_table_valued_functions(sample_db):
+    sql = "WITH recent AS (SELECT film_id FROM film) SELECT r.film_id, j.value FROM recent r, json_each('[1]') j"
+    assert referenced_tables(sql, sample_db) == ["film"]
+
+
+def test_referenced_tables_raises_on_invalid_sql(sample_db):
+    with pytest.raises(ValueError):
+        referenced_tables("SELECT * FROM nowhere", sample_db)